@@ -0,0 +1,310 @@
+"""
+Benchmarks of the solver kernels: compile time, steady-state wall time per call and memory, swept over the
+grid sizes (Nx, Ny, Nz), Hermite sizes (Nn, Nm, Np), number of species Ns and floating-point precision.
+
+Each case is the base parameters with one swept value changed, and times the kernels of KERNELS:
+the jitted right-hand side VlasovMaxwellSolver.rhs, the legacy ode_system (compute_dCk_s_dt), one integrator
+step (with the counts of Integrators.INTEGRATOR_STATISTICS for the adaptive 'odeint'), initialize_system and
+anti_transform. Results are written as JSON, and compare() reports the ratios to a
+stored baseline, so that a regression shows up as a number, e.g.
+
+    python Benchmarks.py --output benchmarks.json --baseline baseline.json
+
+profile_rhs (--profile) times the pieces of the right-hand side separately (streaming, E and v x B couplings,
+collisions and Maxwell update) and can dump their XLA HLO and cost analysis (--hlo-dir).
+
+Every case runs in a fresh process by default, so that the peak host memory (getrusage) is that of the case alone.
+"""
+
+import os
+import sys
+import json
+import time
+import resource
+import platform
+import argparse
+import multiprocessing
+import numpy as np
+import jax
+from functools import partial
+
+
+# Kernels timed by benchmark_case.
+KERNELS = ('rhs', 'legacy_rhs', 'step', 'initialize_system', 'anti_transform')
+
+# Values swept one at a time around the base parameters.
+DEFAULT_SWEEPS = {'Nx': [3, 9, 27], 'Ny': [1, 9], 'Nz': [1, 9], 'Nn': [8, 32, 128], 'Nm': [1, 4], 'Np': [1, 4], 'Ns': [2],
+                  'precision': ['double', 'single', 'mixed']}
+
+DEFAULT_PARAMETERS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'plasma_parameters_Landau_damping_HF_1D.json')
+
+# Metrics compared against a baseline (larger is worse for all of them).
+METRICS = ('compile_time', 'time', 'device_memory', 'peak_host_memory')
+
+
+def time_call(function, args, repeats=10, jit=True, hlo_path=None):
+    """
+    Time function(*args): the lowering and compilation (if jit) and the median wall time of repeats calls after
+    a warm-up call, waiting for the results. For jitted functions the device memory of the compiled program
+    (arguments, outputs and temporaries, from memory_analysis) and XLA's estimates of its floating-point operations
+    and memory traffic (cost_analysis) are reported as well, when the backend provides them, and the optimized HLO
+    is written to hlo_path if given.
+
+    Returns:
+    dict: compile_time (s, None if not jit), time (s per call), device_memory, flops and bytes_accessed (or None).
+    """
+
+    compile_time, device_memory, cost = None, None, {}
+    if jit:
+        start = time.perf_counter()
+        function = jax.jit(function).lower(*args).compile()
+        compile_time = time.perf_counter() - start
+        memory = function.memory_analysis()
+        if memory is not None:
+            device_memory = int(memory.argument_size_in_bytes + memory.output_size_in_bytes + memory.temp_size_in_bytes)
+        cost = function.cost_analysis() or {}
+        cost = cost[0] if isinstance(cost, list) else cost
+        if hlo_path is not None:
+            with open(hlo_path, 'w') as file:
+                file.write(function.as_text())
+
+    jax.block_until_ready(function(*args))
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        jax.block_until_ready(function(*args))
+        times.append(time.perf_counter() - start)
+
+    return {'compile_time': compile_time, 'time': float(np.median(times)), 'device_memory': device_memory,
+            'flops': cost.get('flops'), 'bytes_accessed': cost.get('bytes accessed')}
+
+
+def profile_rhs(solver, Ck_Fk, params=None, repeats=10, hlo_dir=None):
+    """
+    Time each piece of the right-hand side of solver (see VlasovMaxwellSolver.rhs_terms) and the full rhs, each
+    compiled on its own, at the state Ck_Fk. With hlo_dir the optimized HLO of each piece is written to
+    hlo_dir/<piece>.hlo.txt and the cost analyses to hlo_dir/cost_analysis.json.
+
+    Returns:
+    dict: time_call results for each piece and for 'rhs'.
+    """
+
+    params = solver.params if params is None else params
+    if hlo_dir is not None:
+        os.makedirs(hlo_dir, exist_ok=True)
+    hlo_path = lambda name: None if hlo_dir is None else os.path.join(hlo_dir, name + '.hlo.txt')
+
+    profile = {name: time_call(term, (Ck_Fk, params), repeats, hlo_path=hlo_path(name)) for name, term in solver.rhs_terms().items()}
+    profile['rhs'] = time_call(solver.rhs, (Ck_Fk, 0.0, params), repeats, hlo_path=hlo_path('rhs'))
+
+    if hlo_dir is not None:
+        with open(os.path.join(hlo_dir, 'cost_analysis.json'), 'w') as file:
+            json.dump(profile, file, indent=2)
+
+    return profile
+
+
+def benchmark_case(parameters, precision='double', integrator='rk4', dt=0.01, kernels=KERNELS, repeats=10):
+    """
+    Time the selected kernels for one set of parameters (a plasma_parameters*.json dictionary) in the given
+    precision (a key of JAX_VM_solver.PRECISIONS, run within the precision_scope of the solver).
+
+    Returns:
+    dict: The timings of time_call for each kernel, and the peak host memory of the process (bytes).
+    """
+
+    import JAX_VM_solver as solver_module
+    from Integrators import make_stepper, adaptive_stepper
+
+    solver = solver_module.VlasovMaxwellSolver(dict(parameters, compilation_cache_dir=None, precision=precision))
+    with solver.precision_scope():
+        params = solver.params
+        complex_dtype = solver.complex_dtype
+        size = solver.size_Ck + int(np.prod(solver.shape_Fk))
+        rng = np.random.default_rng(0)
+        Ck_Fk = jax.numpy.asarray(1e-3 * (rng.standard_normal(size) + 1j * rng.standard_normal(size)), dtype=complex_dtype)
+        Nx, Ny, Nz, Nn, Nm, Np, Ns = solver.Nx, solver.Ny, solver.Nz, solver.Nn, solver.Nm, solver.Np, solver.Ns
+
+        results = {}
+        if 'rhs' in kernels:
+            results['rhs'] = time_call(solver.rhs, (Ck_Fk, 0.0, params), repeats)
+        if 'legacy_rhs' in kernels:
+            legacy = partial(solver_module.ode_system, Nx=Nx, Ny=Ny, Nz=Nz, Nn=Nn, Nm=Nm, Np=Np, Ns=Ns,
+                             convolution=solver.convolution, dealiasing=solver.dealiasing)
+            results['legacy_rhs'] = time_call(legacy, (solver.to_full_spectrum(Ck_Fk), 0.0, params['qs'], params['nu'], params['Omega_cs'],
+                                                       params['alpha_s'], params['u_s'], params['Lx'], params['Ly'], params['Lz']), repeats)
+        if 'step' in kernels:
+            init, step = make_stepper(solver, integrator, dt)
+            results['step'] = time_call(step, (Ck_Fk, 0.0, init(params)), repeats)
+            if integrator == 'odeint':
+                # The adaptive step also reports its accepted and rejected attempts and right-hand side evaluations.
+                init, step = adaptive_stepper(solver, dt, statistics=True, **solver.parameters.get('odeint_options', {}))
+                results['step'].update({name: float(value) for name, value in step(Ck_Fk, 0.0, init(params))[1].items()})
+        if 'initialize_system' in kernels:
+            initialize = partial(solver_module.initialize_system, parameters['Omega_ce'], parameters['mi_me'],
+                                 np.asarray(parameters['alpha_s']), np.asarray(parameters['u_s']), parameters['Lx'], parameters['Ly'],
+                                 parameters['Lz'], Nx, Ny, Nz, Nn, Nm, Np)
+            results['initialize_system'] = time_call(initialize, (), max(1, repeats // 5), jit=False)
+        if 'anti_transform' in kernels:
+            full = solver.to_full_spectrum(Ck_Fk)
+            Ck = full[:Ns * Nn * Nm * Np * Nx * Ny * Nz].reshape(1, Ns * Nn * Nm * Np, Nx, Ny, Nz)
+            Fk = full[Ns * Nn * Nm * Np * Nx * Ny * Nz:].reshape(1, 6, Nx, Ny, Nz)
+            transform = lambda Ck, Fk, params: solver_module.anti_transform_species(
+                Ck, Fk, parameters['Omega_ce'], params['Omega_cs'][0] / params['Omega_cs'], params['alpha_s'], params['u_s'],
+                params['Lx'], params['Ly'], params['Lz'], Nx, Ny, Nz, parameters.get('Nvx', 1), parameters.get('Nvy', 1),
+                parameters.get('Nvz', 1), Nn, Nm, Np)
+            results['anti_transform'] = time_call(transform, (Ck, Fk, params), repeats)
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return {'kernels': results, 'peak_host_memory': peak * (1 if sys.platform == 'darwin' else 1024)}
+
+
+def sweep_cases(parameters, sweeps=DEFAULT_SWEEPS):
+    """
+    Cases (name, parameters, precision) of a one-at-a-time sweep around parameters: the base case 'base' and one case
+    'key=value' for each swept value that differs from the base. The precision of the base case is
+    parameters['precision'] ('double' by default).
+    """
+
+    base = parameters.get('precision', 'double')
+    cases = [('base', parameters, base)]
+    for key, values in sweeps.items():
+        for value in values:
+            if key == 'precision':
+                if value != base:
+                    cases.append((f'precision={value}', parameters, value))
+            elif value != parameters[key]:
+                cases.append((f'{key}={value}', species_parameters(parameters, value) if key == 'Ns' else dict(parameters, **{key: value}),
+                              base))
+
+    return cases
+
+
+def species_parameters(parameters, Ns):
+    """
+    parameters with Ns species, repeating the per-species entries (qs, alpha_s, u_s and ms if given) of the last species.
+    """
+
+    per_species = {key: np.asarray(parameters[key]).reshape(parameters['Ns'], -1) for key in ('qs', 'alpha_s', 'u_s', 'ms')
+                   if key in parameters}
+    per_species = {key: np.concatenate([value, np.repeat(value[-1:], max(Ns - len(value), 0), axis=0)])[:Ns]
+                   for key, value in per_species.items()}
+
+    return dict(parameters, Ns=Ns, **{key: value.ravel().tolist() for key, value in per_species.items()})
+
+
+def _run_case(case, integrator, dt, kernels, repeats):
+    name, parameters, precision = case
+
+    return name, precision, benchmark_case(parameters, precision, integrator, dt, kernels, repeats)
+
+
+def run_benchmarks(parameters, sweeps=DEFAULT_SWEEPS, integrator='rk4', dt=0.01, kernels=KERNELS, repeats=10, isolate=True):
+    """
+    Run benchmark_case over the sweep_cases of parameters, each in a fresh process if isolate.
+
+    Returns:
+    dict: metadata (versions, backend, devices) and results, a dictionary of case name to precision, sizes,
+          kernel timings and peak host memory, ready for json.dump.
+    """
+
+    cases = sweep_cases(parameters, sweeps)
+    run_case = partial(_run_case, integrator=integrator, dt=dt, kernels=tuple(kernels), repeats=repeats)
+    if isolate:
+        # Spawned (not forked) workers, since JAX is not fork-safe; one worker per case for a clean peak memory.
+        with multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1) as pool:
+            outputs = pool.map(run_case, cases, chunksize=1)
+    else:
+        outputs = [run_case(case) for case in cases]
+
+    sizes = ('Nx', 'Ny', 'Nz', 'Nn', 'Nm', 'Np', 'Ns')
+    results = {name: dict(precision=precision, **{key: parameters[key] for key in sizes}, **output)
+               for (name, parameters, _), (_, precision, output) in zip(cases, outputs)}
+    metadata = {'jax': jax.__version__, 'numpy': np.__version__, 'python': platform.python_version(), 'machine': platform.machine(),
+                'backend': jax.default_backend(), 'devices': [str(device) for device in jax.devices()],
+                'integrator': integrator, 'repeats': repeats, 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+    return {'metadata': metadata, 'results': results}
+
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    Ratios current / baseline of every METRICS entry of the cases and kernels present in both results.
+
+    Returns:
+    tuple: (ratios, regressions), where ratios is a list of (case, kernel, metric, baseline, current, ratio) and
+           regressions the entries with ratio > 1 + tolerance. Peak host memory is reported with kernel None.
+    """
+
+    ratios = []
+    for case, result in results['results'].items():
+        if case not in baseline['results']:
+            continue
+        reference = baseline['results'][case]
+        entries = [(kernel, timings, reference['kernels'][kernel]) for kernel, timings in result['kernels'].items()
+                   if kernel in reference['kernels']]
+        entries.append((None, {'peak_host_memory': result.get('peak_host_memory')},
+                        {'peak_host_memory': reference.get('peak_host_memory')}))
+        for kernel, current, old in entries:
+            for metric in METRICS:
+                if current.get(metric) is not None and old.get(metric):
+                    ratios.append((case, kernel, metric, old[metric], current[metric], current[metric] / old[metric]))
+
+    return ratios, [entry for entry in ratios if entry[-1] > 1 + tolerance]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--parameters', default=DEFAULT_PARAMETERS, help='Base plasma_parameters*.json file.')
+    parser.add_argument('--sweeps', default=None, help='JSON dictionary of swept values, e.g. \'{"Nn": [8, 64]}\' (default: DEFAULT_SWEEPS).')
+    parser.add_argument('--integrator', default='rk4')
+    parser.add_argument('--kernels', nargs='+', default=list(KERNELS), choices=KERNELS)
+    parser.add_argument('--repeats', type=int, default=10)
+    parser.add_argument('--no-isolate', action='store_true', help='Run all cases in this process.')
+    parser.add_argument('--output', default='benchmarks.json')
+    parser.add_argument('--baseline', default=None, help='Results of a previous run to compare against.')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Relative increase reported as a regression.')
+    parser.add_argument('--profile', action='store_true', help='Only time the pieces of the right-hand side of the base parameters.')
+    parser.add_argument('--hlo-dir', default=None, help='With --profile, directory for the HLO and cost analysis dumps.')
+    args = parser.parse_args()
+
+    with open(args.parameters, 'r') as file:
+        parameters = json.load(file)
+
+    if args.profile:
+        from JAX_VM_solver import VlasovMaxwellSolver
+        solver = VlasovMaxwellSolver(dict(parameters, compilation_cache_dir=None))
+        size = solver.size_Ck + int(np.prod(solver.shape_Fk))
+        with solver.precision_scope():
+            Ck_Fk = jax.numpy.asarray(1e-3 * np.random.default_rng(0).standard_normal(size), dtype=solver.complex_dtype)
+            profile = profile_rhs(solver, Ck_Fk, repeats=args.repeats, hlo_dir=args.hlo_dir)
+        for name, timings in profile.items():
+            print(f"{name:>12}: {timings['time'] * 1e3:.3g} ms, {timings['flops'] or 0:.3g} flops, "
+                  f"{timings['bytes_accessed'] or 0:.3g} bytes")
+        with open(args.output, 'w') as file:
+            json.dump({'profile': profile}, file, indent=2)
+        return
+    sweeps = json.loads(args.sweeps) if args.sweeps else DEFAULT_SWEEPS
+
+    results = run_benchmarks(parameters, sweeps, args.integrator, kernels=args.kernels, repeats=args.repeats,
+                             isolate=not args.no_isolate)
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    for case, result in results['results'].items():
+        print(case, ', '.join(f"{kernel}: {timings['time'] * 1e3:.3g} ms" for kernel, timings in result['kernels'].items()),
+              f"(peak {result['peak_host_memory'] / 2 ** 20:.0f} MiB)")
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as file:
+            ratios, regressions = compare(results, json.load(file), args.tolerance)
+        for case, kernel, metric, old, current, ratio in ratios:
+            flag = '  REGRESSION' if ratio > 1 + args.tolerance else ''
+            print(f'{case:>18} {kernel or "":>18} {metric:>16}: {old:.4g} -> {current:.4g} (x{ratio:.2f}){flag}')
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -172,7 +172,7 @@ def Landau_damping_HF_1D(Lx, Omega_ce, alpha_e, alpha_i, Nn):
     # Hermite-Fourier components of electron and ion distribution functions.
     Ce0_mk, Ce0_0, Ce0_k = 0 + 1j * (1 / 2) * (1 / vte ** 3) * dn, (1 / vte ** 3) + 0 * 1j, 0 - 1j * (1 / 2) * (1 / vte ** 3) * dn
     Ci0_0 = (1 / vti ** 3) + 0 * 1j
-    Ck_0 = jnp.zeros((2 * Nn, 3, 1, 1), dtype=jnp.complex128)
+    Ck_0 = jnp.zeros((2 * Nn, 3, 1, 1), dtype=complex)
     Ck_0 = Ck_0.at[0, 0, 0, 0].set(Ce0_mk)
     Ck_0 = Ck_0.at[0, 1, 0, 0].set(Ce0_0)
     Ck_0 = Ck_0.at[0, 2, 0, 0].set(Ce0_k)
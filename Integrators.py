@@ -0,0 +1,784 @@
+"""
+Fixed-step time integrators for the Hermite-Fourier Vlasov-Maxwell system.
+
+A stepper is a pair of functions (init, step), in the style of jax.example_libraries.optimizers:
+init(params) precomputes whatever depends on the physical parameters and the step size (e.g. the matrix
+exponentials of the linear operator) and returns an auxiliary pytree, and step(Ck_Fk, t, aux) advances the
+state by one step. integrate() runs any stepper inside lax.scan, and integrate_adjoint() does so with
+reverse-mode derivatives of bounded memory.
+"""
+
+import math
+import jax
+import jax.numpy as jnp
+import numpy as np
+from jax.scipy.linalg import lu_factor, lu_solve
+from jax.scipy.sparse.linalg import gmres
+from functools import partial
+from Output import save_checkpoint, load_checkpoint
+
+
+# Explicit Butcher tableaus (a, b, c) used by the Runge-Kutta and integrating-factor steppers.
+TABLEAUS = {
+    'euler': ([[]], [1.0], [0.0]),
+    'rk2': ([[], [1.0]], [0.5, 0.5], [0.0, 1.0]),
+    'rk4': ([[], [0.5], [0.0, 0.5], [0.0, 0.0, 1.0]], [1 / 6, 1 / 3, 1 / 3, 1 / 6], [0.0, 0.5, 0.5, 1.0])}
+
+
+def runge_kutta_stepper(solver, dt, method='rk4'):
+    """
+    Fixed-step explicit Runge-Kutta stepper for the full right-hand side solver.rhs.
+
+    Parameters:
+    solver (VlasovMaxwellSolver): Solver providing rhs(Ck_Fk, t, params).
+    dt (float): Time step.
+    method (str): Key of TABLEAUS.
+
+    Returns:
+    tuple: (init, step) functions.
+    """
+
+    a, b, c = TABLEAUS[method]
+
+    def init(params):
+        return params
+
+    def step(Ck_Fk, t, params):
+        k = []
+        for i in range(len(b)):
+            Y = Ck_Fk + dt * sum(a[i][j] * k[j] for j in range(len(a[i])) if a[i][j] != 0)
+            k.append(solver.rhs(Y, t + c[i] * dt, params))
+        return Ck_Fk + dt * sum(b[i] * k[i] for i in range(len(b)))
+
+    return init, step
+
+
+def integrating_factor_stepper(solver, dt, method='rk4'):
+    """
+    Fixed-step integrating-factor (Lawson) Runge-Kutta stepper.
+
+    The stiff linear streaming and hypercollision terms L are integrated exactly with the matrix exponentials
+    exp(h * L) from solver.linear_propagator, and only the E/B coupling and Maxwell update N (solver.nonlinear_rhs)
+    are treated explicitly. For a tableau (a, b, c):
+
+        Y_i = exp(c_i h L) y + h sum_j a_ij exp((c_i - c_j) h L) N(Y_j),
+        y_new = exp(h L) y + h sum_j b_j exp((1 - c_j) h L) N(Y_j).
+
+    The step size is therefore limited by the explicit terms only, not by nu or k * alpha / L.
+
+    Parameters:
+    solver (VlasovMaxwellSolver): Solver providing nonlinear_rhs, linear_propagator and apply_linear_propagator.
+    dt (float): Time step.
+    method (str): Key of TABLEAUS ('euler', 'rk2' or 'rk4').
+
+    Returns:
+    tuple: (init, step) functions.
+    """
+
+    a, b, c = TABLEAUS[method]
+
+    # Fractions of dt for which exp(fraction * dt * L) is needed.
+    fractions = sorted(({c[i] for i in range(len(c))} | {1 - c[j] for j in range(len(b))} |
+                        {c[i] - c[j] for i in range(len(a)) for j in range(len(a[i])) if a[i][j] != 0}) - {0})
+
+    def init(params):
+        propagators = [solver.linear_propagator(fraction * dt, params) for fraction in fractions]
+        return params, propagators
+
+    def step(Ck_Fk, t, aux):
+        params, propagators = aux
+
+        def propagate(fraction, y):
+            return y if fraction == 0 else solver.apply_linear_propagator(propagators[fractions.index(fraction)], y)
+
+        N = []
+        for i in range(len(b)):
+            Y = propagate(c[i], Ck_Fk) + dt * sum(a[i][j] * propagate(c[i] - c[j], N[j])
+                                                  for j in range(len(a[i])) if a[i][j] != 0)
+            N.append(solver.nonlinear_rhs(Y, t + c[i] * dt, params))
+        return propagate(1.0, Ck_Fk) + dt * sum(b[j] * propagate(1 - c[j], N[j]) for j in range(len(b)))
+
+    return init, step
+
+
+def implicit_midpoint_stepper(solver, dt, newton_tol=1e-10, max_newton=20, krylov_tol=1e-6, restart=20, max_restarts=10,
+                              preconditioner='block'):
+    """
+    Implicit midpoint (Crank-Nicolson) stepper y_new = y + dt f((y + y_new) / 2), solved by Jacobian-free
+    Newton-Krylov.
+
+    The midpoint z = (y + y_new) / 2 is the root of G(z) = z - y - dt / 2 f(z). Every Newton update solves
+    (I - dt / 2 J(z)) dz = -G(z) with GMRES (jax.scipy.sparse.linalg.gmres), where the products J(z) v come from
+    jax.linearize of solver.rhs and the Jacobian is never formed; the iteration stops once |dz| <= newton_tol |y|.
+    If that does not happen within max_newton iterations the step returns NaN, which propagates through the rest
+    of the run, rather than an unconverged state (raise max_newton, or lower krylov_tol or dt).
+    The scheme is A-stable and time-reversible, and conserves the linear and quadratic invariants of the system
+    (such as the total energy of the AW Hermite-Fourier system) up to the solver tolerances, so dt is limited
+    by accuracy only, not by the plasma, cyclotron or light waves. The step has reverse-mode derivatives (e.g. for
+    Integrators.integrate_adjoint), obtained implicitly from a transposed GMRES solve at the midpoint.
+
+    With preconditioner='block', GMRES is preconditioned by the inverse of I - dt / 2 A, with A the Jacobian about
+    the spatially uniform part of y (see VlasovMaxwellSolver.jacobian_blocks), which is block diagonal in k and
+    treats the linear waves of every Fourier mode exactly; it is factorized once per step, leaving only the mode
+    coupling by the perturbations to the Krylov iterations. Its cost (M Jacobian-vector products and Nk dense
+    (M, M) blocks, M = Ns * K + 6) suits moderate Hermite bases; preconditioner=None runs plain GMRES.
+
+    Parameters:
+    solver (VlasovMaxwellSolver): Solver providing rhs, and jacobian_blocks, Fourier_blocks and
+                                  from_Fourier_blocks for the preconditioner.
+    dt (float): Time step.
+    newton_tol (float): Relative tolerance of the Newton updates.
+    max_newton (int): Maximum number of Newton iterations per step.
+    krylov_tol (float): Relative tolerance of GMRES.
+    restart, max_restarts (int): Krylov subspace size and maximum number of restarts of GMRES.
+    preconditioner (str or None): 'block' or None.
+
+    Returns:
+    tuple: (init, step) functions.
+    """
+
+    def init(params):
+        return params
+
+    @jax.custom_vjp
+    def midpoint(Ck_Fk, t, params):
+        f = lambda y: solver.rhs(y, t + dt / 2, params)
+        
+        precondition = None
+        if preconditioner == 'block':
+            blocks = jnp.eye(solver.size_Ck // int(np.prod(solver.shape_k)) + 6) - (dt / 2) * solver.jacobian_blocks(Ck_Fk, params)
+            lu = jax.vmap(lu_factor)(blocks)
+            precondition = lambda r: solver.from_Fourier_blocks(jax.vmap(lu_solve)(lu, solver.Fourier_blocks(r)))
+        elif preconditioner is not None:
+            raise ValueError(f"Unknown preconditioner '{preconditioner}'. Use 'block' or None.")
+        
+        def newton(state):
+            z, _, i = state
+            f_z, J = jax.linearize(f, z)
+            dz, _ = gmres(lambda v: v - (dt / 2) * J(v), Ck_Fk + (dt / 2) * f_z - z, tol=krylov_tol, restart=restart,
+                          maxiter=max_restarts, M=precondition)
+            return z + dz, jnp.linalg.norm(dz), i + 1
+        
+        tolerance = newton_tol * jnp.linalg.norm(Ck_Fk)
+        not_converged = lambda state: (state[1] > tolerance) & (state[2] < max_newton)
+        
+        z, residual, _ = jax.lax.while_loop(not_converged, newton, (Ck_Fk, jnp.array(jnp.inf, dtype=tolerance.dtype), 0))
+        
+        # A step whose Newton iteration did not converge would no longer conserve the invariants: poison it.
+        return jnp.where(residual <= tolerance, z, jnp.nan)
+
+    def midpoint_fwd(Ck_Fk, t, params):
+        z = midpoint(Ck_Fk, t, params)
+        return z, (Ck_Fk, t, params, z)
+
+    def midpoint_bwd(residuals, z_adjoint):
+        # The midpoint is differentiated implicitly rather than through the Newton iterations: from
+        # (I - dt / 2 J(z)) dz = dy + dt / 2 df/dparams dparams, the adjoints are w and dt / 2 w df/dparams, with w
+        # solving the transposed system (I - dt / 2 J(z))^T w = z_adjoint by GMRES.
+        Ck_Fk, t, params, z = residuals
+        _, rhs_vjp = jax.vjp(lambda z, params: solver.rhs(z, t + dt / 2, params), z, params)
+        w, _ = gmres(lambda v: v - (dt / 2) * rhs_vjp(v)[0], z_adjoint, tol=krylov_tol, restart=restart, maxiter=max_restarts)
+        return w, jnp.zeros_like(t), jax.tree.map(lambda x: (dt / 2) * x, rhs_vjp(w)[1])
+
+    midpoint.defvjp(midpoint_fwd, midpoint_bwd)
+
+    def step(Ck_Fk, t, params):
+        return 2 * midpoint(Ck_Fk, jnp.asarray(t, dtype=jnp.real(Ck_Fk).dtype), params) - Ck_Fk
+
+    return init, step
+
+
+# Statistics of the adaptive steps, available as per-step diagnostics (see adaptive_stepper and integrate).
+INTEGRATOR_STATISTICS = ('n_accepted', 'n_rejected', 'n_rhs', 'min_dt')
+
+
+def adaptive_stepper(solver, dt, rtol=1.4e-8, atol=1.4e-8, max_steps=10000, statistics=False):
+    """
+    Stepper advancing the state over dt with adaptive Dormand-Prince (dormand_prince, with the error control of
+    odeint as VlasovMaxwellSolver.solve), which takes as many internal steps as the tolerances require. With dt
+    the interval between snapshots, it lets integrate_chunked stream and checkpoint odeint runs. A step that
+    exceeds max_steps attempts returns NaN.
+
+    Parameters:
+    solver (VlasovMaxwellSolver): Solver providing rhs(Ck_Fk, t, params).
+    dt (float): Interval covered by one step.
+    rtol, atol (float): Relative and absolute tolerances.
+    max_steps (int): Maximum number of step attempts per step.
+    statistics (bool): If True, step returns (Ck_Fk, stats), with the INTEGRATOR_STATISTICS of the step: the
+                       numbers of accepted and rejected attempts and of right-hand side evaluations, and the
+                       smallest accepted step size. integrate() saves them with the per-step diagnostics.
+
+    Returns:
+    tuple: (init, step) functions.
+    """
+
+    def init(params):
+        return params
+
+    def step(Ck_Fk, t, params):
+        states, stats = dormand_prince(solver.rhs, Ck_Fk, jnp.stack([t, t + dt]).astype(float), params, rtol, atol, max_steps)
+        if not statistics:
+            return states[-1]
+        return states[-1], {'n_accepted': stats['n_accepted'], 'n_rejected': stats['n_rejected'], 'n_rhs': stats['n_rhs'],
+                            'min_dt': jnp.min(jnp.where(stats['accepted'], stats['dt'], jnp.inf))}
+
+    return init, step
+
+
+def make_stepper(solver, integrator, dt):
+    """
+    Build a stepper from its name: 'euler', 'rk2' or 'rk4' for explicit Runge-Kutta, 'if-euler', 'if-rk2' or
+    'if-rk4' for the integrating-factor versions, 'implicit-midpoint', whose options (newton_tol, max_newton,
+    krylov_tol, restart, max_restarts and preconditioner, see implicit_midpoint_stepper) are read from the
+    'implicit_options' dictionary of solver.parameters, and 'odeint' (see adaptive_stepper), whose rtol, atol and
+    max_steps are read from its 'odeint_options'.
+    """
+
+    if integrator == 'implicit-midpoint':
+        return implicit_midpoint_stepper(solver, dt, **solver.parameters.get('implicit_options', {}))
+    elif integrator == 'odeint':
+        return adaptive_stepper(solver, dt, **solver.parameters.get('odeint_options', {}))
+    elif integrator.startswith('if-'):
+        return integrating_factor_stepper(solver, dt, integrator[3:])
+    elif integrator in TABLEAUS:
+        return runge_kutta_stepper(solver, dt, integrator)
+    else:
+        raise ValueError(f"Unknown integrator '{integrator}'.")
+
+
+@partial(jax.jit, static_argnames=['stepper', 'n_steps', 'save_every', 'output', 'diagnostics'])
+def integrate(stepper, Ck_Fk_0, params, dt, n_steps, save_every=1, t0=0.0, output=None, diagnostics=None):
+    """
+    Advance Ck_Fk_0 by n_steps steps of size dt with the given stepper, saving every save_every steps.
+
+    Parameters:
+    stepper (tuple): (init, step) pair, e.g. from integrating_factor_stepper.
+    Ck_Fk_0 (jax.Array): Initial state.
+    params (dict): Physical parameters (VlasovMaxwellSolver.params).
+    dt (float): Time step.
+    n_steps (int): Number of steps, a multiple of save_every.
+    save_every (int): Number of steps between saved snapshots.
+    t0 (float): Initial time.
+    output (callable or None): Function of the state and params returning the pytree saved at each snapshot
+                               (e.g. VlasovMaxwellSolver.snapshot_output); None saves the full state.
+    diagnostics (callable or None): Function of the state and params evaluated after every step (not only at the snapshots),
+                                    typically returning a few scalars and spectra (e.g.
+                                    VlasovMaxwellSolver.snapshot_output(('kinetic_energy', 'EM_energy'))), as a dictionary
+                                    to which the statistics of steppers that return them are added.
+
+    Returns:
+    tuple: (Ck_Fk, t, snapshots), the final state and the times and outputs of the n_steps // save_every
+           snapshots after t0, followed by the stacked diagnostics of the n_steps steps if diagnostics is given.
+    """
+
+    init, step = stepper
+    aux = init(params)
+    output = output or (lambda Ck_Fk, params: Ck_Fk)
+
+    def step_with_statistics(Ck_Fk, t):
+        # Steps may also return statistics (see adaptive_stepper), which are saved with the diagnostics.
+        result = step(Ck_Fk, t, aux)
+        return result if isinstance(result, tuple) else (result, {})
+
+    def advance(carry, _):
+        Ck_Fk, i = carry
+        if diagnostics is None:
+            Ck_Fk, i = jax.lax.fori_loop(0, save_every, lambda _, c: (step_with_statistics(c[0], t0 + c[1] * dt)[0], c[1] + 1), (Ck_Fk, i))
+            return (Ck_Fk, i), (t0 + i * dt, output(Ck_Fk, params))
+        
+        def substep(c, _):
+            Ck_Fk, statistics = step_with_statistics(c[0], t0 + c[1] * dt)
+            return (Ck_Fk, c[1] + 1), dict(diagnostics(Ck_Fk, params), **statistics) if statistics else diagnostics(Ck_Fk, params)
+        
+        (Ck_Fk, i), diagnostics_i = jax.lax.scan(substep, (Ck_Fk, i), None, length=save_every)
+        return (Ck_Fk, i), (t0 + i * dt, output(Ck_Fk, params), diagnostics_i)
+
+    (Ck_Fk, _), outputs = jax.lax.scan(advance, (Ck_Fk_0, jnp.array(0)), None, length=n_steps // save_every)
+
+    if diagnostics is None:
+        return (Ck_Fk,) + outputs
+    
+    # Merge the (snapshot, step) axes of the diagnostics into a single step axis.
+    t, snapshots, diagnostics_steps = outputs
+    
+    return Ck_Fk, t, snapshots, jax.tree.map(lambda x: x.reshape((-1,) + x.shape[2:]), diagnostics_steps)
+
+
+@partial(jax.jit, static_argnames=['stepper', 'n_steps', 'save_every', 'output', 'diagnostics'])
+def integrate_ensemble(stepper, Ck_Fk_0, params, dt, n_steps, save_every=1, t0=0.0, output=None, diagnostics=None):
+    """
+    Integrate an ensemble of runs with the same grid shapes in one vmapped, jitted program.
+
+    params carries a leading ensemble axis on every leaf (see VlasovMaxwellSolver.ensemble_params). Ck_Fk_0 is
+    either a single initial state shared by all members or one state per member (2D array). Other parameters
+    as in integrate(); an output function reducing each snapshot to diagnostics keeps the stacked result small.
+
+    Returns:
+    tuple: (Ck_Fk, t, snapshots[, diagnostics]) as in integrate(), each stacked along a leading ensemble axis.
+    """
+
+    run = lambda Ck_Fk_0, params: integrate(stepper, Ck_Fk_0, params, dt, n_steps, save_every, t0, output, diagnostics)
+
+    return jax.vmap(run, in_axes=(0 if Ck_Fk_0.ndim == 2 else None, 0))(Ck_Fk_0, params)
+
+
+def integrate_chunked(stepper, Ck_Fk_0, params, dt, n_steps, writer, save_every=1, chunk_size=100, t0=0.0, output=None,
+                      start=0, checkpoint_path=None, checkpoint_every=1, metadata=None, diagnostics=None, diagnostics_writer=None,
+                      rescale=None):
+    """
+    Integrate like integrate(), but in segments of chunk_size snapshots that are handed to writer as soon as
+    they are computed, so that device memory is bounded by one chunk instead of the whole trajectory.
+    The next segment is dispatched before the previous one is written, so disk I/O overlaps with computation.
+
+    Snapshot i (time t0 + i * save_every * dt) is written at index i, with the initial state at index 0, so the
+    writer must hold n_steps // save_every + 1 snapshots.
+
+    Parameters:
+    writer: Object with write(index, t, snapshots) and flush() methods (see Output.py).
+    chunk_size (int): Number of snapshots per segment.
+    start (int): Number of snapshots already computed; Ck_Fk_0 is then the state at snapshot start (used for restarts).
+    checkpoint_path (str or None): If given, a checkpoint (see Output.save_checkpoint) is written atomically after
+                                   every checkpoint_every segments and at the end of the run.
+    metadata (dict or None): JSON-serializable data stored in the checkpoints (e.g. the parameters).
+    diagnostics_writer: Writer receiving the per-step diagnostics (see integrate()), with step i written at index i
+                        (the initial state at index 0), so it must hold n_steps + 1 entries.
+    rescale (callable or None): Function (Ck_Fk, params) -> (Ck_Fk, params) applied before every segment, e.g.
+                                VlasovMaxwellSolver.rescale. The checkpoints then also hold the params of their state.
+    Other parameters as in integrate().
+
+    Returns:
+    jax.Array: Final state Ck_Fk.
+    """
+
+    n_saves = n_steps // save_every
+    Ck_Fk, index, pending, n_chunks = Ck_Fk_0, start, None, 0
+
+    if start == 0:
+        writer.write(0, np.array([t0]), jax.tree.map(lambda x: np.asarray(x)[None], (output or (lambda y, params: y))(Ck_Fk_0, params)))
+        if diagnostics is not None:
+            diagnostics_writer.write(0, np.array([t0]), jax.tree.map(lambda x: np.asarray(x)[None], diagnostics(Ck_Fk_0, params)))
+
+    def finish(index, Ck_Fk, t, snapshots, *diagnostics_steps, index_end, n_chunks, params):
+        writer.write(index + 1, t, snapshots)
+        if diagnostics_steps:
+            steps = index * save_every + 1 + np.arange((index_end - index) * save_every)
+            diagnostics_writer.write(index * save_every + 1, t0 + steps * dt, diagnostics_steps[0])
+        if checkpoint_path is not None and (n_chunks % checkpoint_every == 0 or index_end == n_saves):
+            # Snapshots must be on disk before the checkpoint that refers to them.
+            writer.flush()
+            if diagnostics_steps:
+                diagnostics_writer.flush()
+            save_checkpoint(checkpoint_path, Ck_Fk, index_end, t0, dt, save_every, metadata, params if rescale is not None else None)
+
+    while index < n_saves:
+        n = min(chunk_size, n_saves - index)
+        if rescale is not None:
+            Ck_Fk, params = rescale(Ck_Fk, params)
+        result = integrate(stepper, Ck_Fk, params, dt, n * save_every, save_every, t0 + index * save_every * dt, output, diagnostics)
+        Ck_Fk = result[0]
+        n_chunks += 1
+        if pending is not None:
+            finish(*pending[0], **pending[1])
+        pending = ((index,) + result, {'index_end': index + n, 'n_chunks': n_chunks, 'params': params})
+        index += n
+
+    if pending is not None:
+        finish(*pending[0], **pending[1])
+
+    return Ck_Fk
+
+
+def resume_chunked(checkpoint_path, stepper, params, n_steps, writer, chunk_size=100, output=None, checkpoint_every=1, metadata=None,
+                   diagnostics=None, diagnostics_writer=None, rescale=None):
+    """
+    Continue a run of integrate_chunked from its last checkpoint, up to n_steps steps in total (which may exceed
+    the original n_steps to extend the run). The time step, save cadence and initial time are taken from the
+    checkpoint, as is the metadata unless new metadata is given, and the params when the checkpoint holds them
+    (runs with rescale). With the same chunk_size the segments are laid
+    out as in the original run, so the result is bit-for-bit identical to an uninterrupted run.
+
+    Returns:
+    jax.Array: Final state Ck_Fk.
+    """
+
+    checkpoint = load_checkpoint(checkpoint_path)
+    if checkpoint['params'] is not None:
+        params = jax.tree.map(lambda x, y: jnp.asarray(y, dtype=x.dtype), params, checkpoint['params'])
+
+    return integrate_chunked(stepper, jnp.asarray(checkpoint['Ck_Fk']), params, checkpoint['dt'], n_steps, writer,
+                             checkpoint['save_every'], chunk_size, checkpoint['t0'], output, checkpoint['index'],
+                             checkpoint_path, checkpoint_every, metadata or checkpoint['metadata'], diagnostics, diagnostics_writer,
+                             rescale)
+
+
+# Gradient strategies of integrate_adjoint.
+GRADIENTS = ('checkpoint', 'binomial', 'continuous')
+
+
+def checkpoint_levels(n_units, memory_budget=None):
+    """
+    Number of levels d and length k of the nested checkpointed scans of integrate_adjoint over n_units units:
+    the fewest levels whose d * k stored states (k ** d >= n_units) fit in memory_budget, or ceil(log2(n_units))
+    levels of length 2 if none do (O(log(n_units)) memory); two levels (O(sqrt(n_units))) if memory_budget is None.
+    """
+
+    def length(depth):
+        k = max(1, int(n_units ** (1 / depth)))
+        while k ** depth < n_units:
+            k += 1
+        return k
+
+    max_depth = max(1, math.ceil(math.log2(n_units)))
+    if memory_budget is None:
+        depth = min(2, max_depth)
+    else:
+        depth = next((d for d in range(1, max_depth + 1) if d * length(d) <= memory_budget), max_depth)
+
+    return depth, length(depth)
+
+
+def binomial_schedule(n_units, n_slots):
+    """
+    Reversal schedule of a chain of n_units units with n_slots stored states, after the binomial checkpointing
+    (Revolve) of Griewank and Walther: s free slots and r recomputations of each unit reverse up to binom(s + r, s)
+    units, so that n_slots ~ log2(n_units) costs O(n_units * log(n_units)) unit evaluations.
+
+    Slot 0 holds the initial state and slot n_slots is a work slot. Each action is a row (kind, source, destination,
+    unit, count): kind 0 advances the state of unit in slot source by count units into slot destination, kind 1
+    reverses unit from its state in slot source. The units are reversed in decreasing order.
+
+    Returns:
+    numpy.ndarray: Actions, of shape (n_actions, 5).
+    """
+
+    work, actions = n_slots, []
+
+    def reverse(start, n, slot, free):
+        if n == 1:
+            actions.append((1, slot, slot, start, 0))
+        elif free == 0:
+            for i in range(n - 1, 0, -1):
+                actions.extend([(0, slot, work, start, i), (1, work, work, start + i, 0)])
+            actions.append((1, slot, slot, start, 0))
+        else:
+            # Fewest recomputations r that reverse the n units, and the longest tail that free - 1 slots reverse with r.
+            r = 1
+            while math.comb(free + r, free) < n:
+                r += 1
+            m = max(1, n - math.comb(free - 1 + r, free - 1))
+            actions.append((0, slot, slot + 1, start, m))
+            reverse(start + m, n - m, slot + 1, free - 1)
+            reverse(start, m, slot, free)
+
+    reverse(0, n_units, 0, n_slots - 1)
+
+    return np.array(actions, dtype=np.int32).reshape(-1, 5)
+
+
+@partial(jax.jit, static_argnames=['stepper', 'n_steps', 'save_every', 'output', 'gradient', 'memory_budget', 'rhs'])
+def integrate_adjoint(stepper, Ck_Fk_0, params, dt, n_steps, save_every=1, t0=0.0, output=None, gradient='checkpoint',
+                      memory_budget=None, rhs=None):
+    """
+    Integrate like integrate(), in a form whose reverse-mode derivatives with respect to Ck_Fk_0 and params (e.g.
+    nu, or the amplitudes Ck_Fk_0 is built from) take a bounded memory instead of the n_steps states of a plain
+    scan. The memory_budget is the number of states stored at snapshots (a unit being the save_every steps between
+    two snapshots, which are always recomputed, so keep save_every small), besides the snapshots themselves:
+
+    'checkpoint': discrete adjoint through d nested lax.scans of length k, each wrapped in jax.checkpoint, which
+                  store d * k states and evaluate each step about d + 1 times (see checkpoint_levels); sqrt(n_units)
+                  memory by default.
+    'binomial':   discrete adjoint run by a custom VJP along the binomial reversal schedule of memory_budget
+                  states (see binomial_schedule); log2(n_units) + 1 states by default.
+    'continuous': continuous adjoint run by a custom VJP: the adjoint equations da/dt = -a df/dCk_Fk and
+                  dg/dt = -a df/dparams of f = rhs(Ck_Fk, t, params) are integrated backwards with RK4, sub-stepped
+                  to its stability limit, along the cubic Hermite interpolation of the states of the steps. These are
+                  recomputed with the stepper from memory_budget evenly spaced states of the forward pass, one segment
+                  of n_units / memory_budget units at a time, so that memory_budget + n_units / memory_budget states
+                  are stored (sqrt(n_units) by default). The stepper itself is never differentiated. The gradient
+                  is that of the exact solution along the computed trajectory: it differs from that of the run
+                  (e.g. from its finite differences) by the error of the time steps, which is large when dt does not
+                  resolve the dynamics, as with the long steps of 'implicit-midpoint'. There the sub-steps keep the
+                  adjoint bounded, but the discrete adjoints give the gradient of the run itself.
+
+    Parameters:
+    stepper, Ck_Fk_0, params, dt, n_steps, save_every, t0, output: As in integrate().
+    gradient (str): Key of GRADIENTS.
+    memory_budget (int or None): Number of stored states, None for the default of the gradient strategy.
+    rhs (callable or None): Right-hand side rhs(Ck_Fk, t, params) (VlasovMaxwellSolver.rhs), for gradient='continuous'.
+
+    Returns:
+    tuple: (Ck_Fk, t, snapshots), as in integrate().
+    """
+
+    if gradient not in GRADIENTS:
+        raise ValueError(f"Unknown gradient '{gradient}'. Use one of {GRADIENTS}.")
+    if gradient == 'continuous' and rhs is None:
+        raise ValueError("gradient='continuous' requires rhs.")
+
+    init, step = stepper
+    output = output or (lambda Ck_Fk, params: Ck_Fk)
+    n_units = n_steps // save_every
+    t = t0 + save_every * dt * jnp.arange(1, n_units + 1)
+    n_slots = min(memory_budget or n_units.bit_length() + 1, n_units)
+    add = lambda x, y: jax.tree.map(jnp.add, x, y)
+
+    # The custom VJPs must not close over the traced t0 and dt, which are passed along as clock = (t0, dt).
+    def advance(Ck_Fk, i, aux, clock):
+        # The save_every steps of unit i, from snapshot i - 1 (or Ck_Fk_0) to snapshot i.
+        t0, dt = clock
+        return jax.lax.fori_loop(0, save_every, lambda j, Ck_Fk: step(Ck_Fk, t0 + (i * save_every + j) * dt, aux), Ck_Fk)
+
+    def unit(Ck_Fk, i, aux, params, clock):
+        Ck_Fk = advance(Ck_Fk, i, aux, clock)
+        return Ck_Fk, output(Ck_Fk, params)
+
+    def forward(Ck_Fk_0, aux, params, clock):
+        return jax.lax.scan(lambda Ck_Fk, i: unit(Ck_Fk, i, aux, params, clock), Ck_Fk_0, jnp.arange(n_units))
+
+    if gradient == 'checkpoint':
+        depth, k = checkpoint_levels(n_units, memory_budget)
+        aux = init(params)
+
+        def level(Ck_Fk, i, depth):
+            if depth == 0:
+                # The k ** depth - n_units padding units leave the state unchanged.
+                Ck_Fk = jax.lax.cond(i < n_units, lambda Ck_Fk: advance(Ck_Fk, i, aux, (t0, dt)), lambda Ck_Fk: Ck_Fk, Ck_Fk)
+                return Ck_Fk, output(Ck_Fk, params)
+            return jax.lax.scan(jax.checkpoint(lambda Ck_Fk, i: level(Ck_Fk, i, depth - 1)), Ck_Fk, i)
+
+        Ck_Fk, snapshots = level(Ck_Fk_0, jnp.arange(k ** depth).reshape((k,) * depth), depth)
+
+        return Ck_Fk, t, jax.tree.map(lambda x: x.reshape((-1,) + x.shape[depth:])[:n_units], snapshots)
+
+    if gradient == 'binomial':
+        schedule = binomial_schedule(n_units, n_slots)
+
+        @jax.custom_vjp
+        def run(Ck_Fk_0, aux, params, clock):
+            return forward(Ck_Fk_0, aux, params, clock)
+
+        def run_fwd(Ck_Fk_0, aux, params, clock):
+            return forward(Ck_Fk_0, aux, params, clock), (Ck_Fk_0, aux, params, clock)
+
+        def run_bwd(residuals, cotangents):
+            Ck_Fk_0, aux, params, clock = residuals
+            adjoint, snapshots_adjoint = cotangents
+            slots = jnp.zeros((n_slots + 1,) + Ck_Fk_0.shape, dtype=Ck_Fk_0.dtype).at[0].set(Ck_Fk_0)
+
+            def act(carry, action):
+                kind, source, destination, i, count = action
+
+                def advance_slot(carry):
+                    slots, adjoints = carry
+                    Ck_Fk = jax.lax.fori_loop(i, i + count, lambda j, Ck_Fk: advance(Ck_Fk, j, aux, clock), slots[source])
+                    return slots.at[destination].set(Ck_Fk), adjoints
+
+                def reverse_unit(carry):
+                    slots, (adjoint, aux_adjoint, params_adjoint) = carry
+                    _, unit_vjp = jax.vjp(lambda Ck_Fk, aux, params: unit(Ck_Fk, i, aux, params, clock), slots[source],
+                                          aux, params)
+                    adjoint, aux_i, params_i = unit_vjp((adjoint, jax.tree.map(lambda x: x[i], snapshots_adjoint)))
+                    return slots, (adjoint, add(aux_adjoint, aux_i), add(params_adjoint, params_i))
+
+                return jax.lax.cond(kind == 0, advance_slot, reverse_unit, carry), None
+
+            adjoints = (adjoint, jax.tree.map(jnp.zeros_like, aux), jax.tree.map(jnp.zeros_like, params))
+            (_, adjoints), _ = jax.lax.scan(act, (slots, adjoints), schedule)
+            return adjoints + (jax.tree.map(jnp.zeros_like, clock),)
+
+        run.defvjp(run_fwd, run_bwd)
+        Ck_Fk, snapshots = run(Ck_Fk_0, init(params), params, (t0, dt))
+
+        return Ck_Fk, t, snapshots
+
+    # Continuous adjoint: the forward pass stores the first state of every anchor_every units, from which the backward
+    # pass recomputes one segment of units, and then the steps of one unit, at a time.
+    n_anchors = min(memory_budget or math.isqrt(n_units - 1) + 1, n_units)
+    anchor_every = -(-n_units // n_anchors)
+    n_anchors = -(-n_units // anchor_every)
+    a, b, c = TABLEAUS['rk4']
+
+    @jax.custom_vjp
+    def run(Ck_Fk_0, params, clock):
+        return forward(Ck_Fk_0, init(params), params, clock)
+
+    def run_fwd(Ck_Fk_0, params, clock):
+        aux = init(params)
+
+        def store(carry, i):
+            Ck_Fk, anchors = carry
+            anchor = jnp.where(i % anchor_every == 0, Ck_Fk, anchors[i // anchor_every])
+            Ck_Fk, snapshot = unit(Ck_Fk, i, aux, params, clock)
+            return (Ck_Fk, anchors.at[i // anchor_every].set(anchor)), snapshot
+
+        anchors = jnp.zeros((n_anchors,) + Ck_Fk_0.shape, dtype=Ck_Fk_0.dtype)
+        (Ck_Fk, anchors), snapshots = jax.lax.scan(store, (Ck_Fk_0, anchors), jnp.arange(n_units))
+        return (Ck_Fk, snapshots), (Ck_Fk, anchors, params, clock)
+
+    def run_bwd(residuals, cotangents):
+        Ck_Fk, anchors, params, clock = residuals
+        adjoint, snapshots_adjoint = cotangents
+        t0, dt = clock
+        aux = init(params)
+
+        # RK4 is stable for |h * lambda| <= 2.78 on the real and imaginary axes: each step of dt is split into enough
+        # sub-steps for the spectral radius of the Jacobian of rhs, estimated by power iteration at the final state,
+        # so that stiff steps (e.g. of 'implicit-midpoint') do not make the adjoint diverge.
+        jvp = lambda v: jax.jvp(lambda Ck_Fk: rhs(Ck_Fk, t0 + n_units * save_every * dt, params), (Ck_Fk,), (v,))[1]
+        power_iteration = lambda _, c: (jvp(c[0]) / jnp.linalg.norm(jvp(c[0])), jnp.maximum(c[1], jnp.linalg.norm(jvp(c[0]))))
+        v = jax.random.normal(jax.random.key(0), Ck_Fk.shape, dtype=Ck_Fk.dtype)
+        _, radius = jax.lax.fori_loop(0, 50, power_iteration, (v / jnp.linalg.norm(v), jnp.zeros((), dtype=jnp.real(v).dtype)))
+        n_substeps = jnp.maximum(1, jnp.ceil(1.25 * dt * radius / 2.78)).astype(int)
+
+        def reverse_step(state, t_j, Ck_Fk_j, Ck_Fk_next):
+            # Adjoint and params adjoint from t_j + dt back to t_j, along the cubic Hermite interpolation of the state
+            # between the steps.
+            f_j, f_next = rhs(Ck_Fk_j, t_j, params), rhs(Ck_Fk_next, t_j + dt, params)
+
+            def adjoint_rhs(state, t):
+                s = (t - t_j) / dt
+                Ck_Fk = ((1 + 2 * s) * (1 - s) ** 2 * Ck_Fk_j + s * (1 - s) ** 2 * dt * f_j +
+                         s ** 2 * (3 - 2 * s) * Ck_Fk_next - s ** 2 * (1 - s) * dt * f_next)
+                _, rhs_vjp = jax.vjp(lambda Ck_Fk, params: rhs(Ck_Fk, t, params), Ck_Fk, params)
+                return jax.tree.map(jnp.negative, rhs_vjp(state[0]))
+
+            def substep(m, state):
+                h = dt / n_substeps
+                t_m, k = t_j + dt - m * h, []
+                for n in range(len(b)):
+                    Y = jax.tree.map(lambda y, *k: y - h * sum(a[n][l] * k[l] for l in range(len(a[n])) if a[n][l] != 0), state, *k)
+                    k.append(adjoint_rhs(Y, t_m - c[n] * h))
+                return jax.tree.map(lambda y, *k: y - h * sum(b[n] * k[n] for n in range(len(b))), state, *k)
+
+            return jax.lax.fori_loop(0, n_substeps, substep, state)
+
+        def reverse_unit(state, i, Ck_Fk_i):
+            # Recompute the save_every steps of unit i from its first state, then run the adjoint back over them.
+            Ck_Fk, Ck_Fk_steps = jax.lax.scan(lambda Ck_Fk, j: (step(Ck_Fk, t0 + (i * save_every + j) * dt, aux), Ck_Fk),
+                                              Ck_Fk_i, jnp.arange(save_every))
+            Ck_Fk_steps = jnp.concatenate([Ck_Fk_steps, Ck_Fk[None]])
+            _, output_vjp = jax.vjp(output, Ck_Fk, params)
+            adjoint_i, params_i = output_vjp(jax.tree.map(lambda x: x[i], snapshots_adjoint))
+            state = (state[0] + adjoint_i, add(state[1], params_i))
+            reverse = lambda state, j: (reverse_step(state, t0 + (i * save_every + j) * dt, Ck_Fk_steps[j], Ck_Fk_steps[j + 1]), None)
+            return jax.lax.scan(reverse, state, jnp.arange(save_every), reverse=True)[0]
+
+        def reverse_segment(state, segment):
+            # Recompute the first states of the units of the segment from its anchor (the units beyond n_units pad the
+            # last segment and are skipped).
+            units = segment * anchor_every + jnp.arange(anchor_every)
+            advance_unit = lambda Ck_Fk, i: (jax.lax.cond(i < n_units, lambda Ck_Fk: advance(Ck_Fk, i, aux, clock),
+                                                          lambda Ck_Fk: Ck_Fk, Ck_Fk), Ck_Fk)
+            _, Ck_Fk_units = jax.lax.scan(advance_unit, anchors[segment], units)
+            reverse = lambda state, x: (jax.lax.cond(x[0] < n_units, lambda state: reverse_unit(state, *x), lambda state: state,
+                                                     state), None)
+            return jax.lax.scan(reverse, state, (units, Ck_Fk_units), reverse=True)[0], None
+
+        state, _ = jax.lax.scan(reverse_segment, (adjoint, jax.tree.map(jnp.zeros_like, params)), jnp.arange(n_anchors), reverse=True)
+        return state + (jax.tree.map(jnp.zeros_like, clock),)
+
+    run.defvjp(run_fwd, run_bwd)
+    Ck_Fk, snapshots = run(Ck_Fk_0, params, (t0, dt))
+
+    return Ck_Fk, t, snapshots
+
+
+# Dormand-Prince 5(4) tableau (a, b, c) and the weights of the embedded error estimate (b - b*).
+DORMAND_PRINCE = ([[], [1 / 5], [3 / 40, 9 / 40], [44 / 45, -56 / 15, 32 / 9],
+                   [19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729],
+                   [9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656],
+                   [35 / 384, 0.0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84]],
+                  [35 / 384, 0.0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84, 0.0],
+                  [0.0, 1 / 5, 3 / 10, 4 / 5, 8 / 9, 1.0, 1.0])
+DORMAND_PRINCE_ERROR = [35 / 384 - 5179 / 57600, 0.0, 500 / 1113 - 7571 / 16695, 125 / 192 - 393 / 640,
+                        -2187 / 6784 + 92097 / 339200, 11 / 84 - 187 / 2100, -1 / 40]
+
+
+def rhs_evaluations_per_step(integrator):
+    """
+    Number of right-hand side evaluations of one step of the fixed-step integrator (see make_stepper); for the
+    integrating-factor integrators these are evaluations of the nonlinear part only. None for 'implicit-midpoint'
+    and 'odeint', whose counts depend on the Newton and GMRES iterations or on the adaptive step sizes.
+    """
+
+    if integrator in ('implicit-midpoint', 'odeint'):
+        return None
+
+    return len(TABLEAUS[integrator[3:] if integrator.startswith('if-') else integrator][1])
+
+
+@partial(jax.jit, static_argnames=['rhs', 'max_steps'])
+def dormand_prince(rhs, Ck_Fk_0, t, params, rtol=1.4e-8, atol=1.4e-8, max_steps=10000):
+    """
+    Adaptive Dormand-Prince 5(4) integration of d(Ck_Fk)/dt = rhs(Ck_Fk, t, params), with the error control of
+    jax.experimental.ode.odeint, that also records every step attempt.
+
+    The steps are shortened to land on the output times t instead of interpolating between them, so a dense t
+    costs extra steps. After max_steps attempts the integration stops and the remaining outputs are NaN.
+
+    Returns:
+    tuple: (Ck_Fk, stats), the states at the times t and a dictionary with the totals n_accepted, n_rejected and
+           n_rhs (right-hand side evaluations), and the traces t, dt, error (error norm relative to the tolerance,
+           accepted if <= 1) and accepted of the step attempts, padded with NaN (False) to max_steps.
+    """
+
+    a, b, c = DORMAND_PRINCE
+    real = jnp.zeros((), dtype=jnp.abs(Ck_Fk_0).dtype)
+    error_norm = lambda error, y0, y1: jnp.sqrt(jnp.mean((jnp.abs(error) / (atol + rtol * jnp.maximum(jnp.abs(y0), jnp.abs(y1)))) ** 2))
+
+    def attempt(y, t, h, k1):
+        # The stages are formed in the precision of the state, which may be lower than that of the times.
+        h_y = h.astype(real.dtype)
+        k = [k1]
+        for i in range(1, 7):
+            k.append(rhs(y + h_y * sum(a[i][j] * k[j] for j in range(i) if a[i][j] != 0), t + c[i] * h, params))
+        y1 = y + h_y * sum(b[i] * k[i] for i in range(7) if b[i] != 0)
+        error = h_y * sum(DORMAND_PRINCE_ERROR[i] * k[i] for i in range(7) if DORMAND_PRINCE_ERROR[i] != 0)
+        return y1, k[6], error_norm(error, y, y1)
+
+    def next_step_size(h, ratio):
+        # As jax.experimental.ode.optimal_step_size, with ratio the error norm (not its square).
+        factor = jnp.maximum(0.1, jnp.minimum(ratio ** 0.2 / 0.9, jnp.where(ratio < 1, 1.0, 5.0)))
+        return jnp.where(ratio == 0, h * 10.0, h / factor)
+
+    # Initial step size (Hairer, Norsett and Wanner, Solving ODEs I, II.4).
+    k1 = rhs(Ck_Fk_0, t[0], params)
+    scale = atol + rtol * jnp.abs(Ck_Fk_0)
+    d0, d1 = jnp.sqrt(jnp.mean(jnp.abs(Ck_Fk_0 / scale) ** 2)), jnp.sqrt(jnp.mean(jnp.abs(k1 / scale) ** 2))
+    h0 = jnp.where((d0 < 1e-5) | (d1 < 1e-5), 1e-6, 0.01 * d0 / d1)
+    k1_h0 = rhs(Ck_Fk_0 + h0.astype(real.dtype) * k1, t[0] + h0, params)
+    d2 = jnp.sqrt(jnp.mean(jnp.abs((k1_h0 - k1) / scale) ** 2)) / h0
+    h1 = jnp.where((d1 <= 1e-15) & (d2 <= 1e-15), jnp.maximum(1e-6, h0 * 1e-3), (0.01 / jnp.maximum(d1, d2)) ** 0.2)
+    dt0 = jnp.minimum(100 * h0, h1).astype(t.dtype)
+
+    traces = {'t': jnp.full(max_steps, jnp.nan, dtype=t.dtype), 'dt': jnp.full(max_steps, jnp.nan, dtype=t.dtype),
+              'error': jnp.full(max_steps, jnp.nan, dtype=real.dtype), 'accepted': jnp.zeros(max_steps, dtype=bool)}
+    counts = {'n_accepted': jnp.array(0), 'n_rejected': jnp.array(0), 'n_rhs': jnp.array(2)}
+
+    def advance(carry, t_out):
+        def not_done(carry):
+            y, t, dt, k1, counts, traces = carry
+            return (t < t_out) & (counts['n_accepted'] + counts['n_rejected'] < max_steps)
+
+        def step(carry):
+            y, t, dt, k1, counts, traces = carry
+            h = jnp.minimum(dt, t_out - t)
+            y1, k7, ratio = attempt(y, t, h, k1)
+            accepted = ratio <= 1
+            i = counts['n_accepted'] + counts['n_rejected']
+            traces = {'t': traces['t'].at[i].set(t), 'dt': traces['dt'].at[i].set(h), 'error': traces['error'].at[i].set(ratio),
+                      'accepted': traces['accepted'].at[i].set(accepted)}
+            counts = {'n_accepted': counts['n_accepted'] + accepted, 'n_rejected': counts['n_rejected'] + ~accepted,
+                      'n_rhs': counts['n_rhs'] + 6}
+            # Land exactly on t_out when the shortened final step is accepted.
+            t_new = jnp.where(h == t_out - t, t_out, t + h)
+            return (jnp.where(accepted, y1, y), jnp.where(accepted, t_new, t), next_step_size(h, ratio),
+                    jnp.where(accepted, k7, k1), counts, traces)
+
+        carry = jax.lax.while_loop(not_done, step, carry)
+        y, t = carry[0], carry[1]
+        return carry, jnp.where(t >= t_out, y, jnp.nan)
+
+    (_, _, _, _, counts, traces), Ck_Fk = jax.lax.scan(advance, (Ck_Fk_0, t[0], dt0, k1, counts, traces), t[1:])
+
+    return jnp.concatenate([Ck_Fk_0[None], Ck_Fk]), dict(counts, **traces)
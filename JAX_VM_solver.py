@@ -8,37 +8,115 @@ Created on Sun Jun 23 10:55:45 2024
 import jax
 import jax.numpy as jnp
 from jax.scipy.signal import convolve
-from jax.numpy.fft import fftn, ifftn, fftshift, ifftshift, fftfreq
+from jax.numpy.fft import fftn, ifftn, rfftn, irfftn
 from jax.scipy.special import factorial
-from jax.scipy.integrate import trapezoid
+from jax.scipy.linalg import expm
 from jax.experimental.ode import odeint
+from jax.sharding import Mesh, NamedSharding, PartitionSpec
 # from quadax import quadgk
-from functools import partial
+from functools import partial, lru_cache, wraps
+from contextlib import nullcontext
 from Examples import density_perturbation, density_perturbation_solution, Landau_damping_1D, Landau_damping_HF_1D
+from Integrators import make_stepper, adaptive_stepper, INTEGRATOR_STATISTICS, integrate, integrate_adjoint, integrate_chunked, resume_chunked, dormand_prince
+from Output import open_writer, load_checkpoint
 import json
-import matplotlib.pyplot as plt
+import os
+import argparse
 import numpy as np
 
-jax.config.update("jax_enable_x64", True)
+# Floating-point precisions of VlasovMaxwellSolver: real and complex dtypes of the state, and complex dtype in which
+# the current density, the Maxwell update and the diagnostics are accumulated.
+PRECISIONS = {'double': (np.float64, np.complex128, np.complex128),
+              'single': (np.float32, np.complex64, np.complex64),
+              'mixed': (np.float32, np.complex64, np.complex128)}
 
-def Hermite(n, x):
+# Directory of the persistent compilation cache used by the command-line runner (see main).
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'JAX_VM_solver')
+
+def normalized_Hermite(n, x, weight=1.0):
     """
-    I have to add docstrings!
+    Normalized Hermite polynomial H_n(x) / sqrt(2^n n!) of (possibly traced) order n, times weight.
+
+    Evaluated with the three-term recurrence h_{k+1} = sqrt(2 / (k+1)) x h_k - sqrt(k / (k+1)) h_{k-1}, seeded
+    with h_0 = weight. Unlike the explicit power series this does not suffer from cancellation, and with a
+    decaying weight such as exp(-x^2) no intermediate value overflows, even for orders in the hundreds.
+    """
+
+    h_0 = weight * jnp.ones_like(x)
+    
+    def next_order(k, h):
+        h_k, h_k_minus_1 = h
+        return jnp.sqrt(2 / (k + 1)) * x * h_k - jnp.sqrt(k / (k + 1)) * h_k_minus_1, h_k
+    
+    return jax.lax.fori_loop(0, n, next_order, (h_0, jnp.zeros_like(h_0)))[0]
+
+
+def Hermite_recurrence(N, x, weight=1.0):
+    """
+    All orders 0, ..., N-1 of normalized_Hermite at once, stacked along a new leading axis of length N.
+    """
+
+    h_0 = weight * jnp.ones_like(x)
+    
+    def next_order(h, k):
+        h_k, h_k_minus_1 = h
+        return (jnp.sqrt(2 / (k + 1)) * x * h_k - jnp.sqrt(k / (k + 1)) * h_k_minus_1, h_k), h_k
+    
+    return jax.lax.scan(next_order, (h_0, jnp.zeros_like(h_0)), jnp.arange(N, dtype=h_0.real.dtype))[1]
+
+
+@lru_cache
+def cached_Hermite_tables(v, alpha, u, N):
+    """
+    Host-side version of Hermite_tables for a hashable velocity grid v (a tuple).
+    """
+
+    xi = (np.array(v) - u) / alpha
+    
+    # Evaluate in float64 on the host, independently of the precision JAX runs with.
+    h, psi = np.zeros((N, len(v))), np.zeros((N, len(v)))
+    h[0], psi[0] = 1.0, np.exp(-xi ** 2) / np.sqrt(np.pi)
+    for k in range(N - 1):
+        h[k + 1] = np.sqrt(2 / (k + 1)) * xi * h[k] - np.sqrt(k / (k + 1)) * (h[k - 1] if k > 0 else 0)
+        psi[k + 1] = np.sqrt(2 / (k + 1)) * xi * psi[k] - np.sqrt(k / (k + 1)) * (psi[k - 1] if k > 0 else 0)
+    
+    return h, psi
+
+
+def Hermite_tables(v, alpha, u, N):
     """
+    Tables of the 1D AW Hermite basis on the velocity grid v for one velocity component.
+
+    With xi = (v - u) / alpha, returns the normalized polynomials H_n(xi) / sqrt(2^n n!) used to project f,
+    and the basis functions H_n(xi) exp(-xi^2) / sqrt(pi 2^n n!) (the 1D factors of generate_Hermite_basis)
+    used to reconstruct f, for n = 0, ..., N-1. The tables are cached on the host,
+    keyed by (v, alpha, u, N), when the arguments are concrete, and computed with Hermite_recurrence otherwise.
+
+    Returns:
+    tuple: (h, psi), arrays of shape (N, len(v)).
+    """
+
+    if any(isinstance(a, jax.core.Tracer) for a in (v, alpha, u)):
+        xi = (jnp.asarray(v) - u) / alpha
+        return Hermite_recurrence(N, xi), Hermite_recurrence(N, xi, jnp.exp(-xi ** 2) / jnp.sqrt(jnp.pi))
     
-    n = n.astype(int) # Ensure that n is an integer.
+    h, psi = cached_Hermite_tables(tuple(np.asarray(v, dtype=float).tolist()), float(alpha), float(u), int(N))
     
-    # Add next term in Hermite polynomial. Body function of fori_loop below.
-    def add_Hermite_term(m, partial_sum):
-        return partial_sum + ((-1)**m / (factorial(m) * factorial(n - 2*m))) * (2*x)**(n - 2*m)
+    return jnp.asarray(h), jnp.asarray(psi)
+
+
+def Hermite(n, x):
+    """
+    Physicists' Hermite polynomial H_n(x), from the recurrence of normalized_Hermite.
+    """
     
-    # Return Hermite polynomial of order n.
-    return factorial(n) * jax.lax.fori_loop(0, (n // 2) + 1, add_Hermite_term, jnp.zeros_like(x))
+    return normalized_Hermite(n, x) * jnp.sqrt(2.0 ** n * factorial(n))
 
 
 def generate_Hermite_basis(xi_x, xi_y, xi_z, Nn, Nm, Np, indices):
     """
-    I have to add docstrings!
+    Element indices = n + m * Nn + p * Nn * Nm of the 3D AW Hermite basis,
+    H_n(xi_x) H_m(xi_y) H_p(xi_z) exp(-xi^2) / sqrt(pi^3 2^(n+m+p) n! m! p!).
     """
     
     # Indices below represent order of Hermite polynomials.
@@ -46,103 +124,189 @@ def generate_Hermite_basis(xi_x, xi_y, xi_z, Nn, Nm, Np, indices):
     m = jnp.floor((indices - p * Nn * Nm) / Nn).astype(int)
     n = (indices - p * Nn * Nm - m * Nn).astype(int)
     
-    # Generate element of AW Hermite basis in 3D space.
-    Hermite_basis = (Hermite(n, xi_x) * Hermite(m, xi_y) * Hermite(p, xi_z) * 
-                jnp.exp(-(xi_x**2 + xi_y**2 + xi_z**2)) / 
-                jnp.sqrt((jnp.pi)**3 * 2**(n + m + p) * factorial(n) * factorial(m) * factorial(p)))
+    # Generate element of AW Hermite basis in 3D space. Each factor carries its own Gaussian weight,
+    # so that the recurrences never overflow.
+    Hermite_basis = (normalized_Hermite(n, xi_x, jnp.exp(-xi_x**2) / jnp.sqrt(jnp.pi)) * 
+                     normalized_Hermite(m, xi_y, jnp.exp(-xi_y**2) / jnp.sqrt(jnp.pi)) * 
+                     normalized_Hermite(p, xi_z, jnp.exp(-xi_z**2) / jnp.sqrt(jnp.pi)))
     
     return Hermite_basis
 
 
+def Gauss_Hermite_projection(alpha, u, N, n_quad):
+    """
+    Gauss-Hermite quadrature for the projection of one velocity component onto the AW Hermite basis.
+
+    The nodes are v_j = u + alpha * x_j, with x_j the roots of H_{n_quad}, so that for any g
+    int g(v) h_n((v - u) / alpha) dv / alpha = sum_j P[n, j] g(v_j), where h_n = H_n / sqrt(2^n n!) and
+    P[n, j] = w_j exp(x_j^2) h_n(x_j). This is exact when g(v) exp((v - u)^2 / alpha^2) is a polynomial of
+    degree below 2 * n_quad - n, and converges quickly for any smooth g decaying like a Maxwellian.
+
+    Returns:
+    tuple: (v, P), the nodes (n_quad,) and the projection matrix (N, n_quad).
+    """
+
+    x, w = np.polynomial.hermite.hermgauss(n_quad)
+    v = u + alpha * x
+    
+    return v, Hermite_tables(v, alpha, u, N)[0] * np.exp(np.log(w) + x ** 2)
+
+
+def project_Hermite(f, alpha, u, x, y, z, Nn, Nm, Np, n_quad=None, memory_budget=None):
+    """
+    Coefficients C_nmp(x, y, z) = int f H_n(xi_x) H_m(xi_y) H_p(xi_z) / sqrt(2^(n+m+p) n! m! p!) dxi of the
+    AW Hermite decomposition of f, with xi = (v - u) / alpha, for all (n, m, p) at once.
+
+    The velocity integrals use Gauss-Hermite quadrature matched to alpha and u (see Gauss_Hermite_projection),
+    and all coefficients come out of one tensor contraction of f on the nodes with the three per-axis
+    projection matrices. For a velocity-separable f the contraction is done factor by factor, so f is
+    never evaluated on a 6D grid. Otherwise f is evaluated on blocks of spatial points inside lax.map, and
+    memory_budget bounds the size of the phase-space blocks: below the cost of one point, the vx nodes of
+    that point are also taken in blocks, accumulating the coefficients.
+
+    Parameters:
+    f (callable, tuple or list): Either f(x, y, z, vx, vy, vz) (called with broadcastable arrays), or a separable
+                                 f = f_r(x, y, z) * f_vx(vx) * f_vy(vy) * f_vz(vz) given as the tuple
+                                 (f_r, f_vx, f_vy, f_vz), or a list of such tuples whose products are summed.
+    alpha, u (jax.Array): Hermite scaling and shift of the species, length 3.
+    x, y, z (jax.Array): 1D spatial grids.
+    n_quad (int or tuple or None): Quadrature nodes per velocity axis, which controls the accuracy;
+                                   by default max(2 * N, 40) for an axis with N Hermite modes.
+    memory_budget (int or None): Approximate bytes available for f on the quadrature nodes (and the partial
+                                 contractions and coefficients) of a block of spatial points or vx nodes; None
+                                 evaluates all points at once.
+
+    Returns:
+    jax.Array: Coefficients, shape (Np, Nm, Nn, len(x), len(y), len(z)).
+    """
+
+    N = (Nn, Nm, Np)
+    n_quad = n_quad if n_quad is not None else tuple(max(2 * Ni, 40) for Ni in N)
+    n_quad = n_quad if isinstance(n_quad, tuple) else (n_quad,) * 3
+    (vx, Px), (vy, Py), (vz, Pz) = [Gauss_Hermite_projection(alpha[i], u[i], N[i], n_quad[i]) for i in range(3)]
+    
+    X, Y, Z = jnp.meshgrid(x, y, z, indexing='ij')
+    
+    if callable(f):
+        # Nodes of the vx axis per block and spatial points per block. A point costs f on a block of nodes and its
+        # partial contraction (contracted over vz, then vy, then the block of vx, so that neither exceeds the size of
+        # the block of f), plus its coefficients and their accumulator.
+        itemsize, output_size = jnp.result_type(float).itemsize, Nn * Nm * Np
+        n_block, n_points = n_quad[0], X.size
+        if memory_budget is not None:
+            point_bytes = itemsize * (2 * n_quad[0] * n_quad[1] * n_quad[2] + 2 * output_size)
+            if memory_budget >= point_bytes:
+                n_points = int(min(memory_budget // point_bytes, X.size))
+            else:
+                n_points = 1
+                n_block = int(min(max((memory_budget // itemsize - 2 * output_size) // (2 * n_quad[1] * n_quad[2]), 1), n_quad[0]))
+        
+        # Blocks of vx nodes, padded with nodes of zero weight.
+        n_blocks = -(-n_quad[0] // n_block)
+        vx_blocks = jnp.pad(vx, (0, n_blocks * n_block - n_quad[0]), mode='edge').reshape(n_blocks, n_block)
+        Px_blocks = jnp.moveaxis(jnp.pad(Px, ((0, 0), (0, n_blocks * n_block - n_quad[0]))).reshape(Nn, n_blocks, n_block), 1, 0)
+        
+        def project_point(r):
+            def add_block(C, block):
+                vx_block, Px_block = block
+                F = jnp.broadcast_to(f(*r, vx_block[:, None, None], vy[None, :, None], vz[None, None, :]), (n_block,) + n_quad[1:])
+                G = jnp.einsum('ajk,bj->abk', jnp.einsum('ajc,kc->ajk', F, Pz), Py)
+                return C + jnp.einsum('abk,ia->kbi', G, Px_block), None
+            
+            return jax.lax.scan(add_block, jnp.zeros((Np, Nm, Nn), dtype=Px.dtype), (vx_blocks, Px_blocks))[0]
+        
+        C = jax.lax.map(project_point, (X.flatten(), Y.flatten(), Z.flatten()), batch_size=n_points)
+        return jnp.moveaxis(C, 0, -1).reshape(Np, Nm, Nn, *X.shape)
+    
+    terms = [f] if isinstance(f, tuple) else f
+    
+    return sum(jnp.einsum('k,j,i,xyz->kjixyz', Pz @ jnp.broadcast_to(f_vz(vz), vz.shape), Py @ jnp.broadcast_to(f_vy(vy), vy.shape),
+                          Px @ jnp.broadcast_to(f_vx(vx), vx.shape), jnp.broadcast_to(f_r(X, Y, Z), X.shape))
+               for f_r, f_vx, f_vy, f_vz in terms)
+
+
 def compute_C_nmp(f, alpha, u, Nx, Ny, Nz, Lx, Ly, Lz, Nn, Nm, Np, indices):
     """
-    I have to add docstrings!
+    Hermite coefficient indices = n + m * Nn + p * Nn * Nm of f on the spatial grid, shape (Nx, Ny, Nz).
+    See project_Hermite, which computes all of them at once.
     """
 
-    # Indices below represent order of Hermite polynomials.
-    p = jnp.floor(indices / (Nn * Nm)).astype(int)
-    m = jnp.floor((indices - p * Nn * Nm) / Nn).astype(int)
-    n = (indices - p * Nn * Nm - m * Nn).astype(int)
+    x = jnp.linspace(0, Lx, Nx, endpoint=False)
+    y = jnp.linspace(0, Ly, Ny, endpoint=False)
+    z = jnp.linspace(0, Lz, Nz, endpoint=False)
 
-    # Generate 6D space for particle distribution function f.
-    x = jnp.linspace(0, Lx, Nx)
-    y = jnp.linspace(0, Ly, Ny)
-    z = jnp.linspace(0, Lz, Nz)
-    vx = jnp.linspace(-5 * alpha[0], 5 * alpha[0], 40) # Possibly define limits in terms of thermal velocity or alpha.
-    vy = jnp.linspace(-5 * alpha[1], 5 * alpha[1], 40)
-    vz = jnp.linspace(-5 * alpha[2], 5 * alpha[2], 40)
-    X, Y, Z, Vx, Vy, Vz = jnp.meshgrid(x, y, z, vx, vy, vz, indexing='ij')
+    return project_Hermite(f, alpha, u, x, y, z, Nn, Nm, Np).reshape(Nn * Nm * Np, Nx, Ny, Nz)[indices]
 
-    # Define variables for Hermite polynomials.
-    xi_x = (Vx - u[0]) / alpha[0]
-    xi_y = (Vy - u[1]) / alpha[1]
-    xi_z = (Vz - u[2]) / alpha[2]
 
-    # Compute coefficients of Hermite decomposition of 3D velocity space.
-    # Possible improvement: integrate using quadax.quadgk.
-    C_nmp = (trapezoid(trapezoid(trapezoid(
-            (f(X, Y, Z, Vx, Vy, Vz) * Hermite(n, xi_x) * Hermite(m, xi_y) * Hermite(p, xi_z)) /
-            jnp.sqrt(factorial(n) * factorial(m) * factorial(p) * 2 ** (n + m + p)),
-            (vx - u[0]) / alpha[0], axis=-3), (vy - u[1]) / alpha[1], axis=-2), (vz - u[2]) / alpha[2], axis=-1))
+def Fourier_matrix(N, L, x):
+    """
+    Matrix exp(i k x) of shape (len(x), N) that evaluates N centered Fourier modes (k = 2 * pi * j / L for
+    j = -(N-1)//2, ..., N//2, see center_spectrum) at the points x.
+    """
 
-    # def integral_vz(x, y, z, vx, vy):
-    #     interval = jnp.array([-jnp.inf, jnp.inf])
-    #     integral = quadgk(lambda vz: f(x, y, z, vx, vy, vz) * Hermite(n, (vx - u[0]) / alpha[0]) * 
-    #                   Hermite(m, (vy - u[1]) / alpha[1]) * Hermite(p, (vz - u[2]) / alpha[2]) /
-    #             jnp.sqrt(factorial(n) * factorial(m) * factorial(p) * 2 ** (n + m + p)), interval)[0]
-    #     return integral
+    return jnp.exp(1j * 2 * jnp.pi * (jnp.arange(N) - (N - 1) // 2)[None, :] * jnp.asarray(x)[:, None] / L)
 
-    # def integral_vy(x, y, z, vx):
-    #     interval = jnp.array([-jnp.inf, jnp.inf])
-    #     return quadgk(lambda vy: integral_vz(x, y, z, vx, vy), interval)[0]
 
-    # def C(x, y, z):
-    #     interval = jnp.array([-jnp.inf, jnp.inf])
-    #     return quadgk(lambda vx: integral_vy(x, y, z, vx), interval)[0]
+def evaluate_distribution(Ck, alpha, u, Lx, Ly, Lz, x, y, z, vx, vy, vz):
+    """
+    Distribution function f(x, y, z, vx, vy, vz) = sum_k sum_nmp Ck_nmp exp(ik.x) Psi_n Psi_m Psi_p of one species,
+    on the tensor grid of the given 1D coordinates (Psi being the 1D factors of generate_Hermite_basis).
 
+    Ck holds the physical amplitudes of the Fourier modes (as in spectrum_to_grid). The sums are separable, so f
+    is computed by a single einsum of Ck with per-axis Fourier matrices and Hermite-function tables, and only
+    the requested points are ever formed.
 
-    # x = jnp.linspace(0, Lx, Nx)
-    # y = jnp.linspace(0, Ly, Ny)
-    # z = jnp.linspace(0, Lz, Nz)
-    # X, Y, Z = jnp.meshgrid(x, y, z, indexing='ij')
+    Parameters:
+    Ck (jax.Array): Coefficients of the species, shape (..., Np, Nm, Nn, Nx, Ny, Nz).
+    alpha, u (jax.Array): Hermite scaling and shift of the species, length 3.
+    x, y, z, vx, vy, vz (array-like): 1D coordinates at which f is evaluated.
 
-    # C_nmp = C(X, Y, Z)
+    Returns:
+    jax.Array: f, shape (..., len(x), len(y), len(z), len(vx), len(vy), len(vz)).
+    """
 
-    return C_nmp
+    Np, Nm, Nn, Nx, Ny, Nz = Ck.shape[-6:]
+    
+    Psi_x = Hermite_tables(vx, alpha[0], u[0], Nn)[1]
+    Psi_y = Hermite_tables(vy, alpha[1], u[1], Nm)[1]
+    Psi_z = Hermite_tables(vz, alpha[2], u[2], Np)[1]
+    
+    return jnp.einsum('...pmnijk,ai,bj,ck,nd,me,pf->...abcdef', Ck, Fourier_matrix(Nx, Lx, x), Fourier_matrix(Ny, Ly, y),
+                      Fourier_matrix(Nz, Lz, z), Psi_x, Psi_y, Psi_z, optimize=True).real
 
 
 # @partial(jax.jit, static_argnums=[7, 8, 9, 10, 11, 12])
-def initialize_system(Omega_ce, mi_me, alpha_s, u_s, Lx, Ly, Lz, Nx, Ny, Nz, Nn, Nm, Np):
+def initialize_system(Omega_ce, mi_me, alpha_s, u_s, Lx, Ly, Lz, Nx, Ny, Nz, Nn, Nm, Np, memory_budget=None):
     """
-    I have to add docstrings!
+    Hermite-Fourier coefficients Ck_0, shape (2 * Nn * Nm * Np, Nx, Ny, Nz), and Fourier coefficients of (E, B)
+    Fk_0, shape (6, Nx, Ny, Nz), of the initial condition, as the physical amplitudes of the centered Fourier modes
+    (see grid_to_spectrum) sampled on the periodic grid x_j = j * Lx / Nx. memory_budget (bytes) bounds the phase-space blocks
+    evaluated at once by project_Hermite. The coefficients are complex128 only with 64-bit types enabled (see
+    initial_condition, which sets them from the precision).
     """
     
     # Initialize fields and distributions.
     B, E, fe, fi = Landau_damping_1D(Lx, Omega_ce, mi_me)
         
+    # Define the periodic 3D grid x_j = j * Lx / Nx of the FFT.
+    x = jnp.linspace(0, Lx, Nx, endpoint=False)
+    y = jnp.linspace(0, Ly, Ny, endpoint=False)
+    z = jnp.linspace(0, Lz, Nz, endpoint=False)
+        
     # Hermite decomposition of dsitribution funcitons.
-    Ce_0 = (jax.vmap(
-        compute_C_nmp, in_axes=(
-            None, None, None, None, None, None, None, None, None, None, None, None, 0))
-        (fe, alpha_s[:3], u_s[:3], Nx, Ny, Nz, Lx, Ly, Lz, Nn, Nm, Np, jnp.arange(Nn * Nm * Np)))
-    Ci_0 = (jax.vmap(
-        compute_C_nmp, in_axes=(
-            None, None, None, None, None, None, None, None, None, None, None, None, 0))
-        (fi, alpha_s[3:], u_s[3:], Nx, Ny, Nz, Lx, Ly, Lz, Nn, Nm, Np, jnp.arange(Nn * Nm * Np)))
-
-    # Combine Ce_0 and Ci_0 into single array and compute the fast Fourier transform.
+    Ce_0 = project_Hermite(fe, alpha_s[:3], u_s[:3], x, y, z, Nn, Nm, Np, memory_budget=memory_budget).reshape(Nn * Nm * Np, Nx, Ny, Nz)
+    Ci_0 = project_Hermite(fi, alpha_s[3:], u_s[3:], x, y, z, Nn, Nm, Np, memory_budget=memory_budget).reshape(Nn * Nm * Np, Nx, Ny, Nz)
+
+    # Combine Ce_0 and Ci_0 into single array and compute the physical amplitudes of its Fourier modes.
     C_0 = jnp.concatenate([Ce_0, Ci_0])
-    Ck_0 = fftshift(fftn(C_0, axes=(-3, -2, -1)), axes=(-3, -2, -1))
+    Ck_0 = grid_to_spectrum(C_0, (Nx, Ny, Nz))
     
-    # Define 3D grid for functions E(x, y, z) and B(x, y, z).
-    x = jnp.linspace(0, Lx, Nx)
-    y = jnp.linspace(0, Ly, Ny)
-    z = jnp.linspace(0, Lz, Nz)
+    # Evaluate E(x, y, z) and B(x, y, z) on the same grid.
     X, Y, Z = jnp.meshgrid(x, y, z, indexing='ij')
     
-    # Combine E and B into single array and compute the fast Fourier transform.
+    # Combine E and B into single array and compute the physical amplitudes of its Fourier modes.
     F_0 = jnp.concatenate([E(X, Y, Z), B(X, Y, Z)])
-    Fk_0 = fftshift(fftn(F_0, axes=(-3, -2, -1)), axes=(-3, -2, -1))
+    Fk_0 = grid_to_spectrum(F_0, (Nx, Ny, Nz))
     
     return Ck_0, Fk_0
 
@@ -164,9 +328,251 @@ def cross_product(k_vec, F_vec):
     return jnp.array([result_x, result_y, result_z])
 
 
-def compute_dCk_s_dt(Ck, Fk, kx_grid, ky_grid, kz_grid, Lx, Ly, Lz, nu, alpha_s, u_s, qs, Omega_cs, Nn, Nm, Np, indices):
+def convolve_pseudospectral(Fk, Ck, dealiasing='padding', axis=None):
+    """
+    Convolve centered Fourier coefficients pseudo-spectrally.
+
+    Equivalent to jax.scipy.signal.convolve(Fk, Ck, mode='same') over the last three axes,
+    but computed as inverse FFT -> pointwise product -> forward FFT, which costs O(N log N)
+    instead of O(N^2) per product.
+
+    Parameters:
+    Fk (jax.Array): Fourier coefficients of the first factor, shape (..., Nx, Ny, Nz).
+    Ck (jax.Array): Fourier coefficients of the second factor, broadcastable with Fk.
+    dealiasing (str or None): 'padding' zero-pads each axis to N + N//2 points (3/2 rule), which
+                              reproduces the truncated convolution exactly; '2/3' zeroes all modes
+                              with |k| > (N-1)//3 before and after the product; None does no dealiasing.
+    axis (int or None): If given, the products are summed along this axis in real space, so that
+                        only one forward FFT is needed for the whole sum.
+
+    Returns:
+    jax.Array: Fourier coefficients of the product, truncated to the shape of the inputs.
+    """
+
+    N = jnp.broadcast_shapes(Fk.shape, Ck.shape)[-3:]
+    M = dealiased_grid_shape(N, dealiasing)
+
+    if dealiasing == '2/3':
+        # Keep only the modes that cannot alias back into the retained part of the spectrum.
+        Fk, Ck = Fk * two_thirds_mask(N), Ck * two_thirds_mask(N)
+
+    # Multiply both factors in real space.
+    FC = spectrum_to_grid(Fk, M) * spectrum_to_grid(Ck, M)
+    FC = FC if axis is None else jnp.sum(FC, axis=axis)
+
+    # Transform the product back to Fourier space and drop the padded modes.
+    FCk = grid_to_spectrum(FC, N)
+
+    if dealiasing == '2/3':
+        FCk = FCk * two_thirds_mask(N)
+
+    return FCk
+
+
+def dealiased_grid_shape(N, dealiasing):
+    """
+    Real-space grid shape on which products of spectra of shape N are evaluated for the given dealiasing.
+    """
+
+    if dealiasing == 'padding':
+        return tuple(Ni + Ni // 2 for Ni in N)
+    elif dealiasing in ('2/3', None):
+        return tuple(N)
+    else:
+        raise ValueError(f"Unknown dealiasing '{dealiasing}'. Use 'padding', '2/3' or None.")
+
+
+def center_spectrum(Ck, axes=(-3, -2, -1)):
+    """
+    Reorder Fourier coefficients from the FFT order (k = 0 first) to the centered order used throughout the solver:
+    k = -(N-1)//2, ..., N//2, with k = 0 at index (N - 1) // 2, as in wave_vector_grids and the direct convolution
+    convolve(..., mode='same'). This is fftshift for odd N; for even N the unpaired mode is +N/2, not -N/2.
+    """
+
+    return jnp.roll(Ck, [(Ck.shape[axis] - 1) // 2 for axis in axes], axes)
+
+
+def uncenter_spectrum(Ck, axes=(-3, -2, -1)):
+    """
+    Inverse of center_spectrum: back to the FFT order.
+    """
+
+    return jnp.roll(Ck, [-((Ck.shape[axis] - 1) // 2) for axis in axes], axes)
+
+
+def spectrum_to_grid(Ck, M):
+    """
+    Evaluate centered Fourier coefficients (last three axes) on a real-space grid of shape M.
+    norm='forward' keeps Ck as physical amplitudes, i.e. f(x) = sum_k Ck exp(ikx).
+    """
+
+    return ifftn(uncenter_spectrum(pad_spectrum(Ck, M)), axes=(-3, -2, -1), norm='forward')
+
+
+def grid_to_spectrum(C, N):
+    """
+    Inverse of spectrum_to_grid: centered Fourier coefficients of C, truncated to shape N.
+    """
+
+    return truncate_spectrum(center_spectrum(fftn(C, axes=(-3, -2, -1), norm='forward')), N)
+
+
+def pad_spectrum(Ck, M):
+    """
+    Zero-pad centered Fourier coefficients along the last three axes so that the k = 0 mode
+    (index (N - 1) // 2) ends up at index (M - 1) // 2 of the padded array.
+    """
+
+    pad_width = [(0, 0)] * (Ck.ndim - 3) + [((Mi - 1) // 2 - (Ni - 1) // 2, Mi - Ni - ((Mi - 1) // 2 - (Ni - 1) // 2))
+                                            for Ni, Mi in zip(Ck.shape[-3:], M)]
+
+    return jnp.pad(Ck, pad_width)
+
+
+def truncate_spectrum(Ck, N):
+    """
+    Inverse of pad_spectrum: keep the N modes centered around k = 0 along the last three axes.
+    """
+
+    start = [(Mi - 1) // 2 - (Ni - 1) // 2 for Ni, Mi in zip(N, Ck.shape[-3:])]
+
+    return Ck[..., start[0]:start[0] + N[0], start[1]:start[1] + N[1], start[2]:start[2] + N[2]]
+
+
+def half_spectrum(Ck):
+    """
+    Keep the kx >= 0 half of centered Fourier coefficients (last three axes, odd Nx). Since f, E and B are
+    real, C(-k) = conj(C(k)) and the other half is redundant (see full_spectrum).
+    """
+
+    return Ck[..., Ck.shape[-3] // 2:, :, :]
+
+
+def full_spectrum(Ck):
+    """
+    Inverse of half_spectrum: rebuild the kx < 0 modes from C(-kx, -ky, -kz) = conj(C(kx, ky, kz)).
+    Flipping a centered axis of odd length maps k to -k, so Ny and Nz must be odd as well.
+    """
+
+    return jnp.concatenate([jnp.conj(jnp.flip(Ck[..., 1:, :, :], axis=(-3, -2, -1))), Ck], axis=-3)
+
+
+def full_spectrum_shape(N, spectrum):
+    """
+    Shape (Nx, Ny, Nz) of the full spectrum whose stored part has shape N ('full' or 'half' spectrum).
+    """
+
+    return tuple(N) if spectrum == 'full' else (2 * N[0] - 1, N[1], N[2])
+
+
+def half_spectrum_to_grid(Ck, M):
+    """
+    spectrum_to_grid for the kx >= 0 half of a Hermitian spectrum, with a real-to-complex inverse FFT along x.
+    The result is real.
+    """
+
+    Ck = jnp.pad(Ck, [(0, 0)] * (Ck.ndim - 3) + [(0, M[0] // 2 + 1 - Ck.shape[-3]), (0, 0), (0, 0)])
+    Ck = uncenter_spectrum(pad_spectrum(Ck, (M[0] // 2 + 1, M[1], M[2])), axes=(-2, -1))
+    
+    # The last of axes is the halved one, so x is listed last.
+    return irfftn(Ck, s=(M[1], M[2], M[0]), axes=(-2, -1, -3), norm='forward')
+
+
+def grid_to_half_spectrum(C, N):
+    """
+    Inverse of half_spectrum_to_grid: the kx >= 0 half of the centered Fourier coefficients of the real C,
+    truncated to the half of a spectrum of shape N.
+    """
+
+    Ck = center_spectrum(rfftn(C, axes=(-2, -1, -3), norm='forward'), axes=(-2, -1))
+
+    return truncate_spectrum(Ck[..., :N[0] // 2 + 1, :, :], (N[0] // 2 + 1, N[1], N[2]))
+
+
+# Transforms (Ck_to_grid, Fk_to_grid, to_spectrum) of the pseudospectral products for each spectrum storage.
+SPECTRUM_TRANSFORMS = {'full': (spectrum_to_grid, spectrum_to_grid, grid_to_spectrum),
+                       'half': (half_spectrum_to_grid, half_spectrum_to_grid, grid_to_half_spectrum)}
+
+
+def two_thirds_mask(N):
+    """
+    Mask of centered Fourier modes retained by the 2/3 dealiasing rule on a grid of shape N.
+    """
+
+    kx, ky, kz = [jnp.abs(jnp.arange(Ni) - (Ni - 1) // 2) <= (Ni - 1) // 3 for Ni in N]
+
+    return kx[:, None, None] & ky[None, :, None] & kz[None, None, :]
+
+
+def Fourier_mode_set(modes, N):
+    """
+    Sparse set of Fourier modes evolved instead of the full centered grid of odd shape N = (Nx, Ny, Nz): the
+    integer wave vectors (kx, ky, kz) of modes (in units of 2 * pi / L), closed under k -> -k so that the
+    fields stay real and always holding k = 0. Returned as a tuple of tuples sorted like the flattened grid.
+    """
+
+    modes = {tuple(int(k) for k in mode) for mode in modes} | {(0, 0, 0)}
+    modes |= {tuple(-k for k in mode) for mode in modes}
+    if any(abs(k) > Ni // 2 for mode in modes for k, Ni in zip(mode, N)):
+        raise ValueError(f"Fourier modes must lie within the grid of shape {tuple(N)}.")
+    
+    return tuple(sorted(modes))
+
+
+def Fourier_mode_fringe(mode_set, N):
+    """
+    Modes k_a + k_b (a, b in mode_set) inside the grid of shape N that are not in mode_set, i.e. the modes
+    the quadratic nonlinearity feeds first when the active set is truncated.
+    """
+
+    fringe = {tuple(int(k) for k in np.add(a, b)) for a in mode_set for b in mode_set} - set(mode_set)
+    
+    return tuple(sorted(mode for mode in fringe if all(abs(k) <= Ni // 2 for k, Ni in zip(mode, N))))
+
+
+@lru_cache
+def Fourier_mode_pairs(mode_set):
+    """
+    Triads (out, a, b) of positions in mode_set with k_out = k_a + k_b, i.e. the products of a convolution
+    that land back in the set. Cached, so the returned arrays must not be modified in place.
+    """
+
+    position = {mode: i for i, mode in enumerate(mode_set)}
+    triads = [(position[tuple(np.add(a, b))], i, j) for i, a in enumerate(mode_set) for j, b in enumerate(mode_set)
+              if tuple(np.add(a, b)) in position]
+    
+    return tuple(np.array(column) for column in zip(*triads))
+
+
+def restrict_Fourier(Ck, mode_set):
+    """
+    Keep the modes of mode_set of centered Fourier coefficients (..., Nx, Ny, Nz) (odd shape): shape (..., Q, 1, 1),
+    with the Q modes along the first Fourier axis so that all elementwise Fourier-space operations apply unchanged.
+    """
+
+    kx, ky, kz = [np.array(k) + Ni // 2 for k, Ni in zip(zip(*mode_set), Ck.shape[-3:])]
+    
+    return Ck[..., kx, ky, kz][..., None, None]
+
+
+def expand_Fourier(Ck, mode_set, N):
+    """
+    Inverse of restrict_Fourier onto the centered grid of shape N, with zeros for the modes outside mode_set.
+    """
+
+    kx, ky, kz = [np.array(k) + Ni // 2 for k, Ni in zip(zip(*mode_set), N)]
+    
+    return jnp.zeros(Ck.shape[:-3] + tuple(N), dtype=Ck.dtype).at[..., kx, ky, kz].set(Ck[..., 0, 0])
+
+
+def compute_dCk_s_dt(Ck, Fk, kx_grid, ky_grid, kz_grid, Lx, Ly, Lz, nu, alpha_s, u_s, qs, Omega_cs, Nn, Nm, Np, indices,
+                     convolution='direct', dealiasing='padding'):
     """
     I have to add docstrings!
+
+    convolution='direct' evaluates the E/B-Hermite coupling terms with Fourier-space convolutions (O(N_k^2));
+    convolution='pseudospectral' evaluates them with FFTs (O(N_k log N_k)) using the given dealiasing
+    (see convolve_pseudospectral).
     """
     
     # Species. s = 0 corresponds to electrons and s = 1 corresponds to ions.
@@ -210,6 +616,25 @@ def compute_dCk_s_dt(Ck, Fk, kx_grid, ky_grid, kz_grid, Lx, Ly, Lz, nu, alpha_s,
     
     # Col = 0
     
+    # Hermite coefficients multiplying each component of E and B in the Vlasov equation.
+    Ck_E = jnp.array([(jnp.sqrt(2 * n) / alpha[0]) * Ck[n-1 + m * Nn + p * Nn * Nm + s * Nn * Nm * Np, ...] * jnp.sign(n),
+                      (jnp.sqrt(2 * m) / alpha[1]) * Ck[n + (m-1) * Nn + p * Nn * Nm + s * Nn * Nm * Np, ...] * jnp.sign(m),
+                      (jnp.sqrt(2 * p) / alpha[2]) * Ck[n + m * Nn + (p-1) * Nn * Nm + s * Nn * Nm * Np, ...] * jnp.sign(p)])
+    Ck_B = jnp.array([Ck_aux_x, Ck_aux_y, Ck_aux_z])
+    
+    # Convolve fields with Hermite terms (product in real space).
+    if convolution == 'direct':
+        coupling = (convolve(Fk[0, ...], Ck_E[0], mode='same') + 
+                    convolve(Fk[1, ...], Ck_E[1], mode='same') + 
+                    convolve(Fk[2, ...], Ck_E[2], mode='same') + 
+                    convolve(Fk[3, ...], Ck_B[0], mode='same') + 
+                    convolve(Fk[4, ...], Ck_B[1], mode='same') + 
+                    convolve(Fk[5, ...], Ck_B[2], mode='same'))
+    elif convolution == 'pseudospectral':
+        coupling = convolve_pseudospectral(Fk, jnp.concatenate([Ck_E, Ck_B]), dealiasing=dealiasing, axis=0)
+    else:
+        raise ValueError(f"Unknown convolution '{convolution}'. Use 'direct' or 'pseudospectral'.")
+    
     # Define ODEs for Hermite-Fourier coefficients.
     # Clossure is achieved by setting to zero coefficients with index out of range.
     dCk_s_dt = (- (kx_grid * 1j / Lx) * alpha[0] * (
@@ -224,20 +649,12 @@ def compute_dCk_s_dt(Ck, Fk, kx_grid, ky_grid, kz_grid, Lx, Ly, Lz, nu, alpha_s,
         jnp.sqrt((p + 1) / 2) * Ck[n + m * Nn + (p+1) * Nn * Nm + s * Nn * Nm * Np, ...] * jnp.sign(Np - p - 1) +
         jnp.sqrt(p / 2) * Ck[n + m * Nn + (p-1) * Nn * Nm + s * Nn * Nm * Np, ...] * jnp.sign(p) +
         (u[2] / alpha[2]) * Ck[n + m * Nn + p * Nn * Nm + s * Nn * Nm * Np, ...]
-    ) + q * Omega_c * (
-        (jnp.sqrt(2 * n) / alpha[0]) * convolve(Fk[0, ...], Ck[n-1 + m * Nn + p * Nn * Nm + s * Nn * Nm * Np, ...] * jnp.sign(n), mode='same') +
-        (jnp.sqrt(2 * m) / alpha[1]) * convolve(Fk[1, ...], Ck[n + (m-1) * Nn + p * Nn * Nm + s * Nn * Nm * Np, ...] * jnp.sign(m), mode='same') +
-        (jnp.sqrt(2 * p) / alpha[2]) * convolve(Fk[2, ...], Ck[n + m * Nn + (p-1) * Nn * Nm + s * Nn * Nm * Np, ...] * jnp.sign(p), mode='same')
-    ) + q * Omega_c * (
-        convolve(Fk[3, ...], Ck_aux_x, mode='same') + 
-        convolve(Fk[4, ...], Ck_aux_y, mode='same') + 
-        convolve(Fk[5, ...], Ck_aux_z, mode='same')
-    ) + Col)
+    ) + q * Omega_c * coupling + Col)
     
     return dCk_s_dt
 
 # @partial(jax.jit, static_argnums=[10, 11, 12, 13, 14, 15, 16])
-def ode_system(Ck_Fk, t, qs, nu, Omega_cs, alpha_s, u_s, Lx, Ly, Lz, Nx, Ny, Nz, Nn, Nm, Np, Ns):     
+def ode_system(Ck_Fk, t, qs, nu, Omega_cs, alpha_s, u_s, Lx, Ly, Lz, Nx, Ny, Nz, Nn, Nm, Np, Ns, convolution='direct', dealiasing='padding'):     
     
     # Define wave vectors.
     kx = (jnp.arange(-Nx//2, Nx//2) + 1) * 2 * jnp.pi
@@ -248,6 +665,9 @@ def ode_system(Ck_Fk, t, qs, nu, Omega_cs, alpha_s, u_s, Lx, Ly, Lz, Nx, Ny, Nz,
     # Create 3D grids of kx, ky, kz.
     kx_grid, ky_grid, kz_grid = jnp.meshgrid(kx, ky, kz, indexing='ij')
     
+    # Flat Hermite scalings and shifts, indexed by species below.
+    alpha_s, u_s = jnp.ravel(alpha_s), jnp.ravel(u_s)
+    
     # Separate between initial conditions for distribution functions (coefficients Ck)
     # and electric and magnetic fields (coefficients Fk).
     Ck = Ck_Fk[:(-6 * Nx * Ny * Nz)].reshape(Ns * Nn * Nm * Np, Nx, Ny, Nz)
@@ -255,490 +675,1669 @@ def ode_system(Ck_Fk, t, qs, nu, Omega_cs, alpha_s, u_s, Lx, Ly, Lz, Nx, Ny, Nz,
     
     # Vectorize over n, m, p, and s to generate ODEs for all coefficients Ck.
     dCk_s_dt = (jax.vmap(
-        compute_dCk_s_dt, 
+        partial(compute_dCk_s_dt, convolution=convolution, dealiasing=dealiasing), 
         in_axes=(None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, 0))
         (Ck, Fk, kx_grid, ky_grid, kz_grid, Lx, Ly, Lz, nu, alpha_s, u_s, qs, Omega_cs, Nn, Nm, Np, jnp.arange(Nn * Nm * Np * Ns)))
         
-    # Generate ODEs for Bk and Ek.
-    dBk_dt = - 1j * cross_product(jnp.array([kx_grid/Lx, ky_grid/Ly, kz_grid/Lz]), Fk[:3, ...])
-    dEk_dt = 1j * cross_product(jnp.array([kx_grid/Lx, ky_grid/Ly, kz_grid/Lz]), Fk[3:, ...]) - \
-            (1 / Omega_cs[0]) * (qs[0] * alpha_s[0] * alpha_s[1] * alpha_s[2] * (
-            (1 / jnp.sqrt(2)) * jnp.array([alpha_s[0] * Ck[1, ...] * jnp.sign(Nn - 1),
-                                           alpha_s[1] * Ck[Nn + 1, ...] * jnp.sign(Nm - 1),
-                                           alpha_s[2] * Ck[Nn * Nm + 1, ...] * jnp.sign(Np - 1)]) + 
-                                jnp.array([u_s[0] * Ck[0, ...],
-                                           u_s[1] * Ck[0, ...],
-                                           u_s[2] * Ck[0, ...]])) + \
-                                qs[1] * alpha_s[3] * alpha_s[4] * alpha_s[5] * (
-            (1 / jnp.sqrt(2)) * jnp.array([alpha_s[3] * Ck[Nn * Nm * Np + 1, ...] * jnp.sign(Nn - 1),
-                                           alpha_s[4] * Ck[Nn + Nn * Nm * Np + 1, ...] * jnp.sign(Nm - 1),
-                                           alpha_s[5] * Ck[Nn * Nm + Nn * Nm * Np + 1, ...] * jnp.sign(Np - 1)]) + 
-                                jnp.array([u_s[3] * Ck[Nn * Nm * Np, ...],
-                                           u_s[4] * Ck[Nn * Nm * Np, ...],
-                                           u_s[5] * Ck[Nn * Nm * Np, ...]])))
+    # Generate ODEs for Ek and Bk, with the current density of all species as one reduction over the species axis.
+    dFk_dt = maxwell_term(Ck.reshape(Ns, Np, Nm, Nn, Nx, Ny, Nz), Fk, kx_grid, ky_grid, kz_grid, Lx, Ly, Lz,
+                          alpha_s.reshape(Ns, 3), u_s.reshape(Ns, 3), qs, Omega_cs)
 
     # Combine dC/dt and dF/dt into a single array and flatten it into a 1D array for an ODE solver.
-    dFk_dt = jnp.concatenate([dEk_dt, dBk_dt])
     dy_dt = jnp.concatenate([dCk_s_dt.flatten(), dFk_dt.flatten()])
     
     return dy_dt
 
-# @partial(jax.jit, static_argnums=[7, 8, 9, 10, 11, 12, 13, 14, 15])
-def anti_transform(Ck, Fk, Omega_ce, mi_me, alpha_s, u_s, Lx, Ly, Lz, Nx, Ny, Nz, Nvx, Nvy, Nvz, Nn, Nm, Np):
-    
-    F = ifftn(ifftshift(Fk, axes=(-3, -2, -1)), axes=(-3, -2, -1))
-    E, B = F[:, :3, ...].real, F[:, 3:, ...].real
-        
-    C = ifftn(ifftshift(Ck, axes=(-3, -2, -1)), axes=(-3, -2, -1))
-    
-    Ce = C[:, :(Nn * Nm * Np), ...].real
-    Ci = C[:, (Nn * Nm * Np):, ...].real
-    
-    # x = jnp.linspace(0, Lx, Nx)
-    # y = jnp.linspace(0, Ly, Ny)
-    # z = jnp.linspace(0, Lz, Nz)
-    # vx = jnp.linspace(-10*alpha_s[0], 10*alpha_s[0], Nvx)
-    # vy = jnp.linspace(-10*alpha_s[1], 10*alpha_s[1], Nvy)
-    # vz = jnp.linspace(-10*alpha_s[2], 10*alpha_s[2], Nvz)
-    # X, Y, Z, Vx, Vy, Vz = jnp.meshgrid(x, y, z, vx, vy, vz, indexing='ij')
-    
-    # xi_x = (Vx - u_s[0]) / alpha_s[0]
-    # xi_y = (Vy - u_s[1]) / alpha_s[1]
-    # xi_z = (Vz - u_s[2]) / alpha_s[2]
-    
-    # full_Hermite_basis_e = jax.vmap(generate_Hermite_basis, in_axes=(None, None, None, None, None, None, 0))(xi_x, xi_y, xi_z, Nn, Nm, Np, jnp.arange(Nn * Nm * Np))
-    
-# 	vx = jnp.linspace(-10*alpha_s[3], 10*alpha_s[3], Nvx)
-# 	vy = jnp.linspace(-10*alpha_s[4], 10*alpha_s[4], Nvy)
-# 	vz = jnp.linspace(-10*alpha_s[5], 10*alpha_s[5], Nvz)
-# 	X, Y, Z, Vx, Vy, Vz = jnp.meshgrid(x, y, z, vx, vy, vz, indexing='ij')
-    
-# 	xi_x = (Vx - u_s[3]) / alpha_s[3]
-# 	xi_y = (Vy - u_s[4]) / alpha_s[4]
-# 	xi_z = (Vz - u_s[5]) / alpha_s[5]
-# 	
-# 	full_Hermite_basis_i = jax.vmap(generate_Hermite_basis, in_axes=(None, None, None, None, None, None, 0))(xi_x, xi_y, xi_z, Nn, Nm, Np, jnp.arange(Nn * Nm * Np))
-    
-    # shape_C_expanded = Ce.shape + (Nvx, Nvy, Nvz)
-    
-    # Ce_expanded = jnp.expand_dims(Ce, (4, 5, 6))
-# 	Ci_expanded = jnp.expand_dims(Ci, (4, 5, 6))
-    
-    # Ce_expanded = jnp.broadcast_to(Ce_expanded, shape_C_expanded)
-# 	Ci_expanded = jnp.broadcast_to(Ci_expanded, shape_C_expanded)
+@lru_cache
+def wave_vector_grids(Nx, Ny, Nz):
+    """
+    3D grids of the wave vectors kx, ky, kz (in units of 2 * pi / L), centered with k = 0 at index (N - 1) // 2 (see
+    center_spectrum).
+    Cached, so the returned arrays must not be modified in place.
+    """
+
+    # Define wave vectors.
+    kx = (np.arange(-Nx//2, Nx//2) + 1) * 2 * np.pi
+    ky = (np.arange(-Ny//2, Ny//2) + 1) * 2 * np.pi
+    kz = (np.arange(-Nz//2, Nz//2) + 1) * 2 * np.pi
     
-    # fe = jnp.array([jnp.sum(Ce_expanded[i, ...] * full_Hermite_basis_e, axis=0) for i in jnp.arange(Ce.shape[0])])
-# 	fi = jnp.array([jnp.sum(Ci_expanded[i, ...] * full_Hermite_basis_i, axis=0) for i in jnp.arange(Ce.shape[0])])
+    # Create 3D grids of kx, ky, kz.
+    return tuple(np.meshgrid(kx, ky, kz, indexing='ij'))
 
 
-        
-    # entropy_e = (trapezoid(trapezoid(trapezoid(trapezoid(
-    #         (fe[:, :, 1, 1, ...] * jnp.log(fe[:, :, 1, 1, ...])),
-    #         x, axis=-4), (vx - u_s[0]) / alpha_s[0], axis=-3),
-    #         (vy - u_s[1]) / alpha_s[1], axis=-2), (vz - u_s[2]) / alpha_s[2], axis=-1))
-    
-    # entropy_e = 0
+def shift_Hermite(Ck, axis, offset):
+    """
+    Shift Ck along a Hermite axis so that the result at index n holds Ck at index n + offset,
+    with zeros where n + offset is out of range (closure by truncation).
+    """
 
-    # The electron and ion energy formulas below assume that us = 0. Generalize them.
-    
-    
-    
-    electron_energy_dens = 0.5 * ((0.5 * (alpha_s[0] ** 2 + alpha_s[1] ** 2 + alpha_s[2] ** 2) + 
-                                         (u_s[0] ** 2 + u_s[1] ** 2 + u_s[2] ** 2)) * 
-                                         alpha_s[0] * alpha_s[1] * alpha_s[2] * Ce[:, 0, ...] + 
-                                  jnp.sqrt(2) * (alpha_s[0] * u_s[0] * Ce[:, 1, ...] * jnp.sign(Nn - 1) + 
-                                                 alpha_s[1] * u_s[1] * Ce[:, Nn, ...] * jnp.sign(Nm - 1) + 
-                                                 alpha_s[2] * u_s[2] * Ce[:, Nn * Nm, ...] * jnp.sign(Np - 1)) *
-                                                alpha_s[0] * alpha_s[1] * alpha_s[2] + 
-                                  (1 / jnp.sqrt(2)) * ((alpha_s[0] ** 2) * Ce[:, 2, ...] * jnp.sign(Nn - 1) * jnp.sign(Nn - 2) + 
-                                                       (alpha_s[1] ** 2) * Ce[:, 2 * Nn, ...] * jnp.sign(Nm - 1) * jnp.sign(Nm - 2) + 
-                                                       (alpha_s[2] ** 2) * Ce[:, 2 * Nn * Nm, ...] * jnp.sign(Np - 1) * jnp.sign(Np - 2)) * 
-                                                      alpha_s[0] * alpha_s[1] * alpha_s[2])
+    N = Ck.shape[axis]
     
-    ion_energy_dens = 0.5 * mi_me * ((0.5 * (alpha_s[3] ** 2 + alpha_s[4] ** 2 + alpha_s[5] ** 2) + 
-                                         (u_s[3] ** 2 + u_s[4] ** 2 + u_s[5] ** 2)) * 
-                                         alpha_s[3] * alpha_s[4] * alpha_s[5] * Ci[:, 0, ...] + 
-                                  jnp.sqrt(2) * (alpha_s[3] * u_s[3] * Ci[:, 1, ...] * jnp.sign(Nn - 1) + 
-                                                 alpha_s[4] * u_s[4] * Ci[:, Nn, ...] * jnp.sign(Nm - 1) + 
-                                                 alpha_s[5] * u_s[5] * Ci[:, Nn * Nm, ...] * jnp.sign(Np - 1)) *
-                                                alpha_s[3] * alpha_s[4] * alpha_s[5] + 
-                                  (1 / jnp.sqrt(2)) * ((alpha_s[3] ** 2) * Ci[:, 2, ...] * jnp.sign(Nn - 1) * jnp.sign(Nn - 2) + 
-                                                       (alpha_s[4] ** 2) * Ci[:, 2 * Nn, ...] * jnp.sign(Nm - 1) * jnp.sign(Nm - 2) + 
-                                                       (alpha_s[5] ** 2) * Ci[:, 2 * Nn * Nm, ...] * jnp.sign(Np - 1) * jnp.sign(Np - 2)) * 
-                                                      alpha_s[3] * alpha_s[4] * alpha_s[5])
-                                
-                                
+    # Zero-pad on the side the shift moves away from and slice back to the original length.
+    pad_width = [(0, 0)] * Ck.ndim
+    pad_width[axis] = (max(-offset, 0), max(offset, 0))
     
-    plasma_energy = jnp.mean(electron_energy_dens[:, ...], axis=(-3, -2, -1)) + jnp.mean(ion_energy_dens[:, ...], axis=(-3, -2, -1))
-    
-    EM_energy = (jnp.mean((E[:, 0, ...] ** 2 + E[:, 1, ...] ** 2 + E[:, 2, ...] ** 2 + 
-                           B[:, 0, ...] ** 2 + B[:, 1, ...] ** 2 + B[:, 2, ...] ** 2), axis=(-3, -2, -1)) * Omega_ce ** 2 / 2)
+    return jax.lax.slice_in_dim(jnp.pad(Ck, pad_width), max(offset, 0), max(offset, 0) + N, axis=axis)
+
+
+@lru_cache
+def Hermite_weights(Nn, Nm, Np):
+    """
+    Precompute the Hermite orders n, m, p as vectors that broadcast against Ck of shape
+    (Ns, Np, Nm, Nn, Nx, Ny, Nz), together with the hypercollision profile in n. Cached, so the
+    returned arrays must not be modified in place.
+    """
+
+    n = np.arange(Nn, dtype=float).reshape(1, 1, 1, Nn, 1, 1, 1)
+    m = np.arange(Nm, dtype=float).reshape(1, 1, Nm, 1, 1, 1, 1)
+    p = np.arange(Np, dtype=float).reshape(1, Np, 1, 1, 1, 1, 1)
     
+    # Hypercollision profile n(n-1)(n-2)/((Nn-1)(Nn-2)(Nn-3)), which vanishes identically for Nn <= 3.
+    col = n * (n - 1) * (n - 2) / ((Nn - 1) * (Nn - 2) * (Nn - 3)) if Nn > 3 else np.zeros_like(n)
     
-    return B, E, Ce, Ci, plasma_energy, EM_energy
+    return n, m, p, col
 
 
-def moving_average(data, window_size):
+@lru_cache
+def Hermite_index_set(Nn, Nm, Np, truncation='tensor', N=None):
+    """
+    Set of Hermite multi-indices (n, m, p) with n < Nn, m < Nm, p < Np kept by a truncation, as a tuple of
+    tuples sorted like the flat index n + m * Nn + p * Nn * Nm.
+
+    truncation:
+    'tensor': All Nn * Nm * Np indices.
+    'total_degree': n + m + p <= N.
+    'hyperbolic_cross': (n + 1) * (m + 1) * (p + 1) <= N + 1.
+    N defaults to max(Nn, Nm, Np) - 1. Both sets are downward closed, so every ladder neighbor of a retained
+    index that is dropped lies outside the set in the direction of higher order.
     """
-    Compute the moving average using NumPy's convolution function.
 
-    Parameters:
-    data (list or array-like): The input data.
-    window_size (int): The number of data points to include in each average.
+    N = max(Nn, Nm, Np) - 1 if N is None else N
+    keep = {'tensor': lambda n, m, p: True,
+            'total_degree': lambda n, m, p: n + m + p <= N,
+            'hyperbolic_cross': lambda n, m, p: (n + 1) * (m + 1) * (p + 1) <= N + 1}[truncation]
+    
+    return tuple((n, m, p) for p in range(Np) for m in range(Nm) for n in range(Nn) if keep(n, m, p))
 
-    Returns:
-    numpy.ndarray: An array containing the moving averages.
-    """
-    # if not data:
-    #     raise ValueError("Data array is empty.")
-    # if window_size <= 0:
-    #     raise ValueError("Window size must be a positive integer.")
-    # if window_size > len(data):
-    #     raise ValueError("Window size cannot be larger than the data length.")
 
-    data_array = np.array(data)
-    kernel = np.ones(window_size) / window_size
-    return np.convolve(data_array, kernel, mode='valid')
+def check_Hermite_index_set(index_set, Nn, Nm, Np):
+    """
+    Raise ValueError unless index_set is a non-empty set of distinct Hermite multi-indices (n, m, p) inside the
+    (Nn, Nm, Np) box that is downward closed (with every index, its lower neighbors (n - 1, m, p), (n, m - 1, p)
+    and (n, m, p - 1)), as the closure of the ladder terms and rescale_Hermite assume.
+    """
 
+    if not index_set:
+        raise ValueError('The Hermite index set is empty.')
+    if len(set(index_set)) != len(index_set):
+        raise ValueError('The Hermite index set has repeated indices.')
+    outside = [index for index in index_set if not all(0 <= i < N for i, N in zip(index, (Nn, Nm, Np)))]
+    if outside:
+        raise ValueError(f"The Hermite indices {outside} lie outside 0 <= (n, m, p) < ({Nn}, {Nm}, {Np}).")
+    lower = lambda index, axis: tuple(i - (j == axis) for j, i in enumerate(index))
+    missing = sorted({lower(index, axis) for index in index_set for axis in range(3) if index[axis] > 0} - set(index_set))
+    if missing:
+        raise ValueError(f"The Hermite index set is not downward closed: {missing} are missing.")
+
+
+@lru_cache
+def Hermite_neighbor_table(index_set, offset):
+    """
+    Position in index_set of (n, m, p) + offset for every (n, m, p) of index_set, or len(index_set)
+    where the neighbor is not in the set. Cached, so the returned array must not be modified in place.
+    """
 
-def main():
-    # Load simulation parameters.
-    with open('plasma_parameters_Landau_damping_HF_1D.json', 'r') as file:
-        parameters = json.load(file)
-    
-    # Unpack parameters.
-    Nx, Ny, Nz = parameters['Nx'], parameters['Ny'], parameters['Nz']
-    Nvx, Nvy, Nvz = parameters['Nvx'], parameters['Nvy'], parameters['Nvz']
-    Lx, Ly, Lz = parameters['Lx'], parameters['Ly'], parameters['Lz']
-    Nn, Nm, Np, Ns = parameters['Nn'], parameters['Nm'], parameters['Np'], parameters['Ns']
-    mi_me = parameters['mi_me']
-    Omega_cs = parameters['Omega_ce'] * jnp.array([1.0, 1.0 / mi_me])
-    qs = jnp.array(parameters['qs'])
-    alpha_s = jnp.array(parameters['alpha_s'])
-    u_s = jnp.array(parameters['u_s'])
-    nu = parameters['nu']
-    t_steps, t_max = parameters['t_steps'], parameters['t_max']
+    position = {index: i for i, index in enumerate(index_set)}
     
-    # Save parameters into txt.
-    with open('C:\Cristian\Postdoc\Madison\Code\Simulations\Landau_damping_1D_HF_ini\Landau_damping_1D_S8.txt', 'w') as file:
-        file.write(f"Nx, Ny, Nz: {Nx}, {Ny}, {Nz}\n")
-        file.write(f"Nvx, Nvy, Nvz: {Nvx}, {Nvy}, {Nvz}\n")
-        file.write(f"Lx, Ly, Lz: {Lx}, {Ly}, {Lz}\n")
-        file.write(f"Nn, Nm, Np, Ns: {Nn}, {Nm}, {Np}, {Ns}\n")
-        file.write(f"mi_me: {mi_me}\n")
-        file.write(f"Omega_cs: {Omega_cs.tolist()}\n")
-        file.write(f"qs: {qs.tolist()}\n")
-        file.write(f"alpha_s: {alpha_s.tolist()}\n")
-        file.write(f"u_s: {u_s.tolist()}\n")
-        file.write(f"nu: {nu}\n")
-        file.write(f"t_steps, t_max: {t_steps}, {t_max}\n")
+    return np.array([position.get(tuple(np.add(index, offset)), len(index_set)) for index in index_set])
 
-    # Load initial conditions.
-    # Ck_0, Fk_0 = initialize_system(Omega_cs[0], mi_me, alpha_s, u_s, Lx, Ly, Lz, Nx, Ny, Nz, Nn, Nm, Np)
-    
-    
-    # Load initial conditions in Hermite-Fourier space.
-    Ck_0, Fk_0 = Landau_damping_HF_1D(Lx, Omega_cs[0], alpha_s[0], alpha_s[3], Nn)
-    
 
-    # Combine initial conditions.
-    initial_conditions = jnp.concatenate([Ck_0.flatten(), Fk_0.flatten()])
+@lru_cache
+def reduced_Hermite_weights(index_set):
+    """
+    Hermite_weights for Ck of shape (Ns, K, Nx, Ny, Nz) holding the K multi-indices of index_set. The
+    hypercollision profile uses the highest n of the set in place of Nn - 1.
+    """
 
-    # Define the time array.
-    t = jnp.linspace(0, t_max, t_steps)
-    x = jnp.linspace(0, Lx, Nx)
-    T, X = jnp.meshgrid(t, x, indexing='ij')
+    n, m, p = [np.array(orders, dtype=float).reshape(1, -1, 1, 1, 1) for orders in zip(*index_set)]
+    Nn = int(n.max()) + 1
+    col = n * (n - 1) * (n - 2) / ((Nn - 1) * (Nn - 2) * (Nn - 3)) if Nn > 3 else np.zeros_like(n)
+    
+    return n, m, p, col
 
-    dy_dt = partial(ode_system, qs=qs, nu=nu, Omega_cs=Omega_cs, alpha_s=alpha_s, u_s=u_s, Lx=Lx, Ly=Ly, Lz=Lz, Nx=Nx, Ny=Ny, Nz=Nz, Nn=Nn, Nm=Nm, Np=Np, Ns=Ns)
 
-    # Solve the ODE system (I have to rewrite this part of the code).
-    result = odeint(dy_dt, initial_conditions, t)
-    
-    Ck = result[:,:(-6 * Nx * Ny * Nz)].reshape(len(t), Ns * Nn * Nm * Np, Nx, Ny, Nz)
-    Fk = result[:,(-6 * Nx * Ny * Nz):].reshape(len(t), 6, Nx, Ny, Nz)
+def Hermite_orders(Ck, index_set=None):
+    """
+    Hermite orders n, m, p and hypercollision profile that broadcast against Ck, either structured as
+    (Ns, Np, Nm, Nn, Nx, Ny, Nz) (index_set None) or reduced to (Ns, K, Nx, Ny, Nz) over index_set.
+    """
+
+    weights = Hermite_weights(*Ck.shape[3:0:-1]) if index_set is None else reduced_Hermite_weights(index_set)
     
-    # Define wave vectors.
-    # kx = (jnp.arange(-Nx//2, Nx//2) + 1) * 2 * jnp.pi
-    # ky = (jnp.arange(-Ny//2, Ny//2) + 1) * 2 * jnp.pi
-    # kz = (jnp.arange(-Nz//2, Nz//2) + 1) * 2 * jnp.pi
+    # In the precision of Ck, so that the tables do not promote single-precision terms.
+    return tuple(np.asarray(w, dtype=jnp.finfo(Ck.dtype).dtype) for w in weights)
+
+
+def Hermite_neighbor(Ck, offset, index_set=None):
+    """
+    Ck at the Hermite index (n, m, p) + offset, with zeros where the neighbor is not retained (closure by
+    truncation). Structured Ck is shifted along its n, m, p axes (see shift_Hermite), reduced Ck is gathered
+    with Hermite_neighbor_table.
+    """
+
+    if index_set is None:
+        for axis, axis_offset in zip((3, 2, 1), offset):
+            Ck = shift_Hermite(Ck, axis, axis_offset) if axis_offset else Ck
+        return Ck
     
-    # Create 3D grids of kx, ky, kz.
-    # kx_grid, ky_grid, kz_grid = jnp.meshgrid(kx, ky, kz, indexing='ij')
-    
-    # divBk2_mean = jnp.mean(jnp.array([kx_grid * Fk[i, 3, ...] + ky_grid * Fk[i, 4, ...] + kz_grid * Fk[i, 5, ...] for i in jnp.arange(len(t))]) ** 2, axis=[1, 2, 3])
-    
-    B, E, Ce, Ci, plasma_energy, EM_energy = anti_transform(Ck, Fk, Omega_cs[0], mi_me, alpha_s, u_s, Lx, Ly, Lz, Nx, Ny, Nz, Nvx, Nvy, Nvz, Nn, Nm, Np)
-    
-    # Cn002 = jnp.mean(Ce[:, :Nn, ...], axis=[2, 3, 4])
-    
-    # B_exact, E_exact, fe_exact_0, fe_exact_2, fe_exact_5, C0_exact= density_perturbation_solution(Lx, Omega_cs[0], mi_me)    
-    # C0_x_t_exact = C0_exact(T, X)
-    # C1_x_t_exact = C1_exact(T, X)
-    
-    # Ce_exact_0 = (jax.vmap(
-    #     compute_C_nmp, in_axes=(
-    #         None, None, None, None, None, None, None, None, None, None, None, None, 0))
-    #     (fe_exact_0, alpha_s[:3], u_s[:3], Nx, Ny, Nz, Lx, Ly, Lz, Nn, Nm, Np, jnp.arange(Nn * Nm * Np)))
-    
-    # Ce_exact_2 = (jax.vmap(
-    #     compute_C_nmp, in_axes=(
-    #         None, None, None, None, None, None, None, None, None, None, None, None, 0))
-    #     (fe_exact_2, alpha_s[:3], u_s[:3], Nx, Ny, Nz, Lx, Ly, Lz, Nn, Nm, Np, jnp.arange(Nn * Nm * Np)))
-    
-    # Ce_exact_5 = (jax.vmap(
-    #     compute_C_nmp, in_axes=(
-    #         None, None, None, None, None, None, None, None, None, None, None, None, 0))
-    #     (fe_exact_5, alpha_s[:3], u_s[:3], Nx, Ny, Nz, Lx, Ly, Lz, Nn, Nm, Np, jnp.arange(Nn * Nm * Np)))
-    
-    # Plot magnetic field.
-    plt.plot(t, jnp.sqrt(jnp.mean(E[:, 0, :, 0, 0].real ** 2, axis=1)), label='$B_{x,rms}$', linestyle='-', color='red')
-    plt.plot(t, jnp.sqrt(jnp.mean(E[:, 1, :, 0, 0].real ** 2, axis=1)), label='$B_{y,rms}$', linestyle='--', color='blue')
-    plt.plot(t, jnp.sqrt(jnp.mean(E[:, 2, :, 0, 0].real ** 2, axis=1)), label='$B_{z,rms}$', linestyle='-.', color='green')
-
-    plt.xlabel('$t\omega_{pe}$')
-    plt.ylabel('$B_{rms}$')
-    plt.title('Magnetic field vs. Time')
-
-    plt.legend()
-
-    plt.show()
-    
-    # C0e vs C0i.
-    plt.figure(figsize=(8, 6))
-    plt.plot(x, Ce[0, :, 0, 0], label='$C_{e,0}$, $t\omega_{pe} = 0$', linestyle='-', color='red', linewidth=3.0)
-    plt.plot(x, Ci[0, :, 0, 0], label='$C_{i,0}$, $t\omega_{pe} = 0$', linestyle='--', color='blue', linewidth=3.0)
-    plt.xlabel(r'$x/d_e$', fontsize=16)
-    plt.ylabel(r'$C_0$', fontsize=16)
-    plt.xlim((0,3))
-    # plt.ylim((4,12))
-    plt.title(rf'$\nu ={nu}, N_x = {Nx}, N_n = {Nn}$', fontsize=16)
-    plt.legend().set_draggable(True)
-
-    plt.show()
-    
-    # C0 vs t.
-    plt.figure(figsize=(8, 6))
-    plt.plot(x, Ce[0, 0, :, 0, 0], label='Approx. solution, $t\omega_{pe} = 0$', linestyle='-', color='red', linewidth=3.0)
-    # plt.plot(x, C0_x_t_exact[0, :].real, label='Exact solution, $t\omega_{pe} = 0$', linestyle='--', color='black', linewidth=3.0)
-    plt.plot(x, Ce[20, 0, :, 0, 0], label='Approx. solution, $t\omega_{pe} = 2$', linestyle='-', color='blue', linewidth=3.0)
-    # plt.plot(x, C0_x_t_exact[20, :].real, label='Exact solution, $t\omega_{pe} = 2$', linestyle=':', color='black', linewidth=3.0)
-    plt.plot(x, Ce[50, 0, :, 0, 0], label='Approx. solution, $t\omega_{pe} = 5$', linestyle='-', color='green', linewidth=3.0)
-    # plt.plot(x, C0_x_t_exact[50, :].real, label='Exact solution, $t\omega_{pe} = 5$', linestyle='-.', color='black', linewidth=3.0)
-
-    plt.xlabel(r'$x/d_e$', fontsize=16)
-    plt.ylabel(r'$C_{e, 0}$', fontsize=16)
-    plt.xlim((0,3))
-    # plt.ylim((4,12))
-    plt.title(rf'$\nu ={nu}, N_x = {Nx}, N_n = {Nn}$', fontsize=16)
-    plt.legend().set_draggable(True)
-
-    plt.show()
-    
-    # Charge density vs t. Fix plot labels.
-    plt.figure(figsize=(8, 6))
-    plt.plot(x, (Ci[0, 0, :, 0, 0] * alpha_s[3] * alpha_s[4] * alpha_s[5] - 
-                 Ce[0, 0, :, 0, 0] * alpha_s[0] * alpha_s[1] * alpha_s[2]), 
-             label='Approx. solution, $t\omega_{pe} = 0$', linestyle='-', color='red', linewidth=3.0)
-    plt.plot(x, (Ci[200, 0, :, 0, 0] * alpha_s[3] * alpha_s[4] * alpha_s[5] - 
-                 Ce[200, 0, :, 0, 0] * alpha_s[0] * alpha_s[1] * alpha_s[2]), 
-             label='Approx. solution, $t\omega_{pe} = 20$', linestyle='-', color='blue', linewidth=3.0)
-    plt.plot(x, (Ci[500, 0, :, 0, 0] * alpha_s[3] * alpha_s[4] * alpha_s[5] - 
-                 Ce[500, 0, :, 0, 0] * alpha_s[0] * alpha_s[1] * alpha_s[2]), 
-             label='Approx. solution, $t\omega_{pe} = 50$', linestyle='-', color='green', linewidth=3.0)
-    plt.plot(x, (Ci[1000, 0, :, 0, 0] * alpha_s[3] * alpha_s[4] * alpha_s[5] - 
-                 Ce[1000, 0, :, 0, 0] * alpha_s[0] * alpha_s[1] * alpha_s[2]), 
-             label='Approx. solution, $t\omega_{pe} = 100$', linestyle='-', color='magenta', linewidth=3.0)
-
-    plt.xlabel(r'$x/d_e$', fontsize=16)
-    plt.ylabel(r'Charge density', fontsize=16)
-    plt.xlim((0,3))
-    # plt.ylim((4,12))
-    plt.title(rf'$\nu ={nu}, N_x = {Nx}, N_n = {Nn}$', fontsize=16)
-    plt.legend().set_draggable(True)
-
-    plt.show()
-    
-    # Electric field vs t. Fix plot labels.
-    plt.figure(figsize=(8, 6))
-    plt.plot(x, E[0, 0, :, 0, 0], label='Approx. solution, $t\omega_{pe} = 0$', linestyle='-', color='red', linewidth=3.0)
-    plt.plot(x, E[200, 0, :, 0, 0], label='Approx. solution, $t\omega_{pe} = 20$', linestyle='-', color='blue', linewidth=3.0)
-    plt.plot(x, E[500, 0, :, 0, 0], label='Approx. solution, $t\omega_{pe} = 50$', linestyle='-', color='green', linewidth=3.0)
-    plt.plot(x, E[1000, 0, :, 0, 0], label='Approx. solution, $t\omega_{pe} = 100$', linestyle='-', color='magenta', linewidth=3.0)
-
-    plt.xlabel(r'$x/d_e$', fontsize=16)
-    plt.ylabel(r'Electric field', fontsize=16)
-    plt.xlim((0,2.5))
-    # plt.ylim((4,12))
-    plt.title(rf'$\nu ={nu}, N_x = {Nx}, N_n = {Nn}$', fontsize=16)
-    plt.legend().set_draggable(True)
-
-    plt.show()
-    
-    # Derivative of Electric field vs t. Fix plot labels.
-    plt.figure(figsize=(8, 6))
-    plt.plot(x, jnp.gradient(E[0, 0, :, 0, 0], x[1]-x[0]), label='Approx. solution, $t\omega_{pe} = 0$', linestyle='-', color='red', linewidth=3.0)
-    plt.plot(x, jnp.gradient(E[200, 0, :, 0, 0], x[1]-x[0]), label='Approx. solution, $t\omega_{pe} = 20$', linestyle='-', color='blue', linewidth=3.0)
-    plt.plot(x, jnp.gradient(E[500, 0, :, 0, 0], x[1]-x[0]), label='Approx. solution, $t\omega_{pe} = 50$', linestyle='-', color='green', linewidth=3.0)
-    plt.plot(x, jnp.gradient(E[1000, 0, :, 0, 0], x[1]-x[0]), label='Approx. solution, $t\omega_{pe} = 100$', linestyle='-', color='magenta', linewidth=3.0)
-
-    plt.xlabel(r'$x/d_e$', fontsize=16)
-    plt.ylabel(r'$\partial_xE_x$', fontsize=16)
-    plt.xlim((0,2.5))
-    # plt.ylim((4,12))
-    plt.title(rf'$\nu ={nu}, N_x = {Nx}, N_n = {Nn}$', fontsize=16)
-    plt.legend().set_draggable(True)
-
-    plt.show()
-    
-    # C0 period.
-    plt.figure(figsize=(8, 6))
-    plt.plot(x, Ce[0 ,0, :, 0, 0], label='Approx. solution, $t\omega_{pe} = 0$', linestyle='-', color='red', linewidth=3.0)
-    plt.plot(x, Ce[243 ,0, :, 0, 0], label='Approx. solution, $t\omega_{pe} = 24.3$', linestyle='--', color='black', linewidth=3.0)
-    plt.plot(x, Ce[245 ,0, :, 0, 0], label='Approx. solution, $t\omega_{pe} = 24.5$', linestyle=':', color='blue', linewidth=3.0)
-    # plt.plot(x, Ce[113 ,0, :, 1, 1].real, label='Approx. solution, $t\omega_{pe} = 10$', linestyle='--', color='green', linewidth=3.0)
-    # plt.plot(x, Ce[64 ,0, :, 1, 1].real, label='Approx. solution, t\omega_{pe} = 6.4', linestyle='-', color='magenta', linewidth=3.0)
-    plt.xlabel(r'$x/d_e$', fontsize=16)
-    plt.ylabel(r'$C_{e, 0}$', fontsize=16)
-    plt.xlim((0,3))
-    # plt.ylim((4,12))
-    plt.title(rf'$\nu ={nu}, N_x = {Nx}, N_n = {Nn}$' + r'$, T_{theo}\omega_{pe} = 24.5$', fontsize=16)
-    plt.legend().set_draggable(True)
-
-    plt.show()
-    
-    # Hermite coefficients at fixed times.
-    plt.figure(figsize=(8, 6))
-    plt.plot(jnp.arange(Nn), jnp.mean(jnp.abs(Ci[0 , :, ...]) ** 2, axis=[-3, -2, -1]), label='Approx. solution, $t\omega_{pe} = 0$', linestyle='-', color='red', linewidth=3.0)
-    # plt.plot(jnp.arange(Nn), jnp.mean(jnp.abs(Ce_exact_0) ** 2, axis=[-3, -2, -1]), label='Exact solution, $t\omega_{pe} = 0$', linestyle='--', color='black', linewidth=3.0)
-    plt.plot(jnp.arange(Nn), jnp.mean(jnp.abs(Ci[20 , :, ...]) ** 2, axis=[-3, -2, -1]), label='Approx. solution, $t\omega_{pe} = 2$', linestyle='-', color='blue', linewidth=3.0)
-    # plt.plot(jnp.arange(Nn), jnp.mean(jnp.abs(Ce_exact_2) ** 2, axis=[-3, -2, -1]), label='Exact solution, $t\omega_{pe} = 2$', linestyle=':', color='black', linewidth=3.0)
-    plt.plot(jnp.arange(Nn), jnp.mean(jnp.abs(Ci[50 , :, ...]) ** 2, axis=[-3, -2, -1]), label='Approx. solution, $t\omega_{pe} = 5$', linestyle='-', color='green', linewidth=3.0)
-    # plt.plot(jnp.arange(Nn), jnp.mean(jnp.abs(Ce_exact_5) ** 2, axis=[-3, -2, -1]), label='Exact solution, $t\omega_{pe} = 5$', linestyle='-.', color='black', linewidth=3.0)
-    plt.plot(jnp.arange(Nn), jnp.mean(jnp.abs(Ci[100 , :, ...]) ** 2, axis=[-3, -2, -1]), label='Approx. solution, $t\omega_{pe} = 10$', linestyle='-', color='magenta', linewidth=3.0)
-    plt.xlabel(r'$n$', fontsize=16)
-    plt.ylabel(r'$\langle|C_{i, n}|^2\rangle$', fontsize=16)
-    plt.title(rf'$\nu ={nu}, N_x = {Nx}, N_n = {Nn}$', fontsize=16)
-    plt.legend().set_draggable(True)
-    plt.yscale('log')
-    plt.show()
-    
-    # Energy vs t.
-    
-    plasma_energy_0 = jnp.mean(0.5 * ((0.5 * (alpha_s[0] ** 2 + alpha_s[1] ** 2 + alpha_s[2] ** 2)) * 
-                                         alpha_s[0] * alpha_s[1] * alpha_s[2] * Ce[:, 0, ...]) + 
-                               0.5 * mi_me * ((0.5 * (alpha_s[3] ** 2 + alpha_s[4] ** 2 + alpha_s[5] ** 2)) * 
-                                                  alpha_s[3] * alpha_s[4] * alpha_s[5] * Ci[:, 0, ...]), axis=(-3, -2, -1))
-    
-    plasma_energy_2 = jnp.mean(0.5 * (1 / jnp.sqrt(2)) * (alpha_s[0] ** 2) * Ce[:, 2, ...] * jnp.sign(Nn - 1) * jnp.sign(Nn - 2) * 
-                                                      alpha_s[0] * alpha_s[1] * alpha_s[2] + 
-                               0.5 * mi_me * (1 / jnp.sqrt(2)) * (alpha_s[3] ** 2) * Ci[:, 2, ...] * jnp.sign(Nn - 1) * jnp.sign(Nn - 2) * 
-                                                              alpha_s[3] * alpha_s[4] * alpha_s[5], axis=(-3, -2, -1))
-    
-    
-    plasma_energy_0_Ck = (0.5 * ((0.5 * (alpha_s[0] ** 2 + alpha_s[1] ** 2 + alpha_s[2] ** 2)) * 
-                                         alpha_s[0] * alpha_s[1] * alpha_s[2] * Ck[:, 0, 1, 0, 0].real) + 
-                                  0.5 * mi_me * ((0.5 * (alpha_s[3] ** 2 + alpha_s[4] ** 2 + alpha_s[5] ** 2)) * 
-                                                  alpha_s[3] * alpha_s[4] * alpha_s[5] * Ck[:, Nn, 1, 0, 0].real))
-    
-    plasma_energy_2_Ck = (0.5 * (1 / jnp.sqrt(2)) * (alpha_s[0] ** 2) * Ck[:, 2, 1, 0, 0].real * alpha_s[0] * alpha_s[1] * alpha_s[2] + 
-                                  0.5 * mi_me * (1 / jnp.sqrt(2)) * (alpha_s[3] ** 2) * Ck[:, Nn + 2, 1, 0, 0].real * alpha_s[3] * alpha_s[4] * alpha_s[5])
-    
-    electric_energy_Fk = 0.5 * jnp.mean(Fk[:, 0, :, 0, 0] ** 2, axis=-1) * Omega_cs[0] ** 2
-    
-    plasma_energy_mov_avg = moving_average(plasma_energy_2_Ck / 3, 101)
-    electric_energy_mov_avg = moving_average(electric_energy_Fk, 101)
-    
-    plt.figure(figsize=(8, 6))
-    # plt.yscale("log")
-    # plt.plot(t, plasma_energy, label='Plasma energy', linestyle='-', color='red', linewidth=3.0)
-    # plt.plot(t, (plasma_energy_2_Ck) / 3, label='Plasma energy ($C_{200}$)', linestyle='-', color='red', linewidth=3.0)
-    # plt.plot(t, (plasma_energy_0_Ck) / 3, label='Plasma energy ($C_{000}$)', linestyle='-', color='red', linewidth=3.0)
-
-    # plt.plot(t[9:992], plasma_energy_mov_avg, label='mov_avg(Plasma energy)', linestyle='-', color='black', linewidth=3.0)
-    plt.plot(t, electric_energy_Fk, label='Electric energy', linestyle='-', color='blue', linewidth=3.0)
-    # plt.plot(t, electric_energy_Fk + plasma_energy_2_Ck / 3, label='Total energy ($C_{200}$)', linestyle='-', color='red', linewidth=3.0)
-    # plt.plot(t[:100], plasma_energy_2[:100] / Nx + 
-    #          jnp.mean(E[:100, 0, ...] ** 2 + E[:100, 1, ...] ** 2 + E[:100, 2, ...] ** 2, 
-    #                   axis=(-3, -2, -1)) * Omega_cs[0] ** 2 / 2, label='(Plasma energy ($C_{200}$))/Nx + Electric energy', 
-    #          linestyle='-', color='red', linewidth=3.0)
-    # plt.plot(t, jnp.mean(E[:, 0, ...] ** 2 + E[:, 1, ...] ** 2 + E[:, 2, ...] ** 2, axis=(-3, -2, -1)) * Omega_cs[0] ** 2 / 2, label='Electric energy', linestyle='-', color='blue', linewidth=3.0)
-    # plt.plot(t[5:996], electric_energy_mov_avg, label='mov_avg(Electric energy)', linestyle='-', color='black', linewidth=3.0)
-    # plt.plot(t[:100], EM_energy[:100], label='EM energy', linestyle='-', color='blue', linewidth=3.0)
-    # plt.plot(t, plasma_energy + EM_energy, label='Total energy', linestyle='-', color='green', linewidth=3.0)
-
-    plt.xlabel(r'$t\omega_{pe}$', fontsize=16)
-    plt.ylabel(r'Energy', fontsize=16)
-    # plt.xlim((0,t_max))
-    # plt.ylim((4,12))
-    # plt.title(rf'$\nu = {nu}, N_x = {Nx}, N_n = {Nn}$', fontsize=16)
-    plt.title(rf'$\nu = {nu}, L_x = {Lx}, N_n = {Nn}$', fontsize=16)
-    plt.legend().set_draggable(True)
-
-    plt.show()
-    
-    # Ck, Fk vs time.
-    plt.figure(figsize=(8, 6))
-    plt.plot(t, Ck[:, 0, 1, 0, 0].imag, label='Ck', linestyle='-', color='blue', linewidth=3.0)
-
-    plt.xlabel(r'$t\omega_{pe}$', fontsize=16)
-    plt.ylabel(r'Energy', fontsize=16)
-    # plt.xlim((0,t_max))
-    # plt.ylim((4,12))
-    plt.title(rf'$\nu = {nu}, N_x = {Nx}, N_n = {Nn}$', fontsize=16)
-    plt.legend().set_draggable(True)
-
-    plt.show()
-    
-    # Entropy vs t.
-    plt.figure(figsize=(8, 6))
-    # plt.yscale("log")
-    plt.plot(t, entropy_e, label='Plasma energy', linestyle='-', color='red', linewidth=3.0)
-
-    plt.xlabel(r'$t\omega_{pe}$', fontsize=16)
-    plt.ylabel(r'Energy', fontsize=16)
-    plt.xlim((0,t_max))
-    # plt.ylim((4,12))
-    plt.title(rf'$\nu ={nu}, N_x = {Nx}, N_n = {Nn}$', fontsize=16)
-    plt.legend()
-
-    plt.show()
-    
-    # C vs n vs t.
-
-    Ce2 = jnp.mean(jnp.abs(Ce.at[:, 0, ...].add(-1 / (alpha_s[0] * alpha_s[1] * alpha_s[2]))) ** 2, axis=[-3, -2, -1])
-
-    plt.imshow(jnp.log10(Ce2), aspect='auto', cmap='viridis', interpolation='none', origin='lower', extent=(0, Nn, 0, t_max))
-    plt.colorbar(label=r'$log_{10}(\langle |C_{e,n}|^2\rangle (t))$').ax.yaxis.label.set_size(16)
-    # plt.colorbar(label=r'$\langle |C_{e,n}|^2\rangle (t)$').ax.yaxis.label.set_size(16)
-    # plt.plot(jnp.arange(Nn) + 0.5, 3.6*jnp.sqrt(jnp.arange(Nn)), label='$3.60\sqrt{n}$', linestyle='-', color='black', linewidth=3.0)
-    plt.xlabel('n', fontsize=16)
-    plt.ylabel('t', fontsize=16)
-    plt.title(rf'$\nu ={nu}, N_x = {Nx}, N_n = {Nn}$', fontsize=16)
-    # plt.legend()
-    plt.show()
-    
-    
-    Ci2 = jnp.mean(jnp.abs(Ci.at[:, 0, ...].add(-1 / (alpha_s[3] * alpha_s[4] * alpha_s[5]))) ** 2, axis=[-3, -2, -1])
-
-    plt.imshow(jnp.log10(Ci2), aspect='auto', cmap='viridis', interpolation='none', origin='lower', extent=(0, Nn, 0, t_max))
-    plt.colorbar(label=r'$log_{10}(\langle |C_{i,n}|^2\rangle (t))$').ax.yaxis.label.set_size(16)
-    # plt.colorbar(label=r'$\langle |C_{i,n}|^2\rangle (t)$').ax.yaxis.label.set_size(16)
-    # plt.plot(jnp.arange(Nn) + 0.5, 3.6*jnp.sqrt(jnp.arange(Nn)), label='$3.60\sqrt{n}$', linestyle='-', color='black', linewidth=3.0)
-    plt.xlabel('n', fontsize=16)
-    plt.ylabel('t', fontsize=16)
-    plt.title(rf'$\nu ={nu}, N_x = {Nx}, N_n = {Nn}$', fontsize=16)
-    # plt.legend()
-    plt.show()
-    
-
-    # C vs n vs k.
-    plt.imshow(jnp.transpose(jnp.log10(Ck[100, :Nn * Nm * Np, :, 1, 1].real)), aspect='auto', cmap='viridis', 
-            interpolation='none', origin='lower', extent=(0, Nn, jnp.min(kx), jnp.max(kx)))
-    plt.colorbar(label=r'$log_{10}(Real(C_{n, k}))$').ax.yaxis.label.set_size(16)  # Add a color bar to show the mapping of values to colors
-    plt.xlabel('n', fontsize=16)
-    plt.ylabel('k', fontsize=16)
-    plt.title(rf'$\nu ={nu}, N_x = {Nx}, N_n = {Nn}$' + r'$, t\omega_{pe}=10$', fontsize=16)
-    plt.show()
+    pad_width = [(0, 0), (0, 1)] + [(0, 0)] * (Ck.ndim - 2)
+    
+    return jnp.take(jnp.pad(Ck, pad_width), Hermite_neighbor_table(index_set, tuple(offset)), axis=1)
+
+
+def Hermite_mode(Ck, index, index_set=None):
+    """
+    Coefficients of the Hermite mode index = (n, m, p) of every species, or zeros if it is not retained.
+    """
+
+    if index_set is None:
+        n, m, p = index
+        in_range = n < Ck.shape[3] and m < Ck.shape[2] and p < Ck.shape[1]
+        return Ck[:, p, m, n] if in_range else jnp.zeros_like(Ck[:, 0, 0, 0])
+    
+    return Ck[:, index_set.index(index)] if index in index_set else jnp.zeros_like(Ck[:, 0])
+
+
+def restrict_Hermite(Ck, index_set):
+    """
+    Keep the Hermite modes of index_set of structured Ck (..., Np, Nm, Nn, Nx, Ny, Nz): shape (..., K, Nx, Ny, Nz).
+    """
+
+    n, m, p = [np.array(orders) for orders in zip(*index_set)]
+    
+    return Ck[..., p, m, n, :, :, :]
+
+
+def expand_Hermite(Ck, index_set, Nn, Nm, Np):
+    """
+    Inverse of restrict_Hermite, with zeros for the modes outside index_set.
+    """
+
+    n, m, p = [np.array(orders) for orders in zip(*index_set)]
+    
+    return jnp.zeros(Ck.shape[:-4] + (Np, Nm, Nn) + Ck.shape[-3:], dtype=Ck.dtype).at[..., p, m, n, :, :, :].set(Ck)
+
+
+def species_column(x, ndim):
+    """
+    Reshape a per-species vector x (Ns,) to broadcast along the leading axis of an array with ndim dimensions.
+    """
+
+    return x.reshape((-1,) + (1,) * (ndim - 1))
+
+
+def species_masses(Ns, mi_me, ms=None):
+    """
+    Masses of the Ns species in units of the electron mass: ms if given, otherwise electrons followed by
+    Ns - 1 species of mass mi_me.
+    """
+
+    if ms is not None:
+        return jnp.asarray(ms, dtype=float)
+    
+    return jnp.concatenate([jnp.ones(1), jnp.full(Ns - 1, mi_me, dtype=float)])
+
+
+def Hermite_moments(Ck, index_set=None):
+    """
+    Hermite modes of order 0, 1 and 2 along each velocity axis, which give the density, flow and energy moments
+    of every species, for Ck of shape (Ns, Np, Nm, Nn, ...) or (Ns, K, ...) over index_set.
+
+    Returns:
+    tuple: C0 of shape (Ns, ...), and C1, C2 of shape (Ns, 3, ...).
+    """
+
+    C0 = Hermite_mode(Ck, (0, 0, 0), index_set)
+    C1 = jnp.stack([Hermite_mode(Ck, index, index_set) for index in ((1, 0, 0), (0, 1, 0), (0, 0, 1))], axis=1)
+    C2 = jnp.stack([Hermite_mode(Ck, index, index_set) for index in ((2, 0, 0), (0, 2, 0), (0, 0, 2))], axis=1)
+    
+    return C0, C1, C2
+
+
+def kinetic_energy_density(C0, C1, C2, alpha, u, ms):
+    """
+    Kinetic energy 1/2 m_s int |v|^2 f_s dv of every species from its Hermite moments (see Hermite_moments), as
+    one reduction over the velocity components, with alpha and u of shape (Ns, 3) and masses ms of length Ns.
+
+    Returns:
+    jax.Array: Energy density, shape of C0.
+    """
+
+    a, w = [x.reshape(x.shape + (1,) * (C0.ndim - 1)) for x in (alpha, u)]
+    column = lambda x: species_column(x, C0.ndim)
+    
+    return 0.5 * column(ms * jnp.prod(alpha, axis=1)) * (
+        column(0.5 * jnp.sum(alpha ** 2, axis=1) + jnp.sum(u ** 2, axis=1)) * C0 + 
+        jnp.sqrt(2) * jnp.sum(a * w * C1, axis=1) + (1 / jnp.sqrt(2)) * jnp.sum(a ** 2 * C2, axis=1))
+
+
+def Hermite_scales(C0, C1, C2, alpha, u):
+    """
+    Hermite scaling and shift of shape (Ns, 3) matched to the mean velocity and temperature of every species along
+    each axis, from its space-averaged Hermite moments (see Hermite_moments) in the basis alpha, u:
+    u_new = u + alpha C1 / (sqrt(2) C0) and alpha_new^2 = alpha^2 (1 + sqrt(2) C2 / C0 - C1^2 / C0^2), i.e.
+    alpha_new^2 / 2 is the variance of the velocity. Where the estimate is not positive the old values are kept.
+    """
+
+    C0 = C0[:, None]
+    valid = C0 > 0
+    u_new = jnp.where(valid, u + alpha * C1 / (jnp.sqrt(2) * jnp.where(valid, C0, 1)), u)
+    alpha2 = alpha ** 2 * (1 + jnp.sqrt(2) * C2 / jnp.where(valid, C0, 1) - (C1 / jnp.where(valid, C0, 1)) ** 2)
+    valid = valid & (alpha2 > 0)
+    
+    return jnp.where(valid, jnp.sqrt(jnp.where(valid, alpha2, 1)), alpha), u_new
+
+
+def Hermite_rescaling_matrix(N, alpha, u, alpha_new, u_new):
+    """
+    Matrix T of shape (..., N, N) that re-projects the AW Hermite coefficients of one velocity axis from the basis
+    with scaling alpha and shift u onto the basis with alpha_new and u_new (of any matching shapes): C_new = T @ C.
+
+    For f = sum_n C_n psi_n(xi), xi = (v - u) / alpha, C_new_m = int f h_m((v - u_new) / alpha_new) dv / alpha_new
+    = a sum_n C_n R_mn, where R_mn are the coefficients of h_m(a xi + b) (a = alpha / alpha_new,
+    b = (u - u_new) / alpha_new) in the h_n(xi). The rows follow from the recurrence of normalized_Hermite, with
+    xi h_n = sqrt((n + 1) / 2) h_{n+1} + sqrt(n / 2) h_{n-1}. T is lower triangular, so the first N coefficients in
+    the new basis are exact: only the orders >= N of f in the new basis are dropped.
+    """
+
+    a, b = [jnp.asarray(x)[..., None] for x in (alpha / alpha_new, (u - u_new) / alpha_new)]
+    k = jnp.arange(N, dtype=a.dtype)
+    
+    # Multiplication by xi of the coefficients (last axis) of a polynomial of degree < N - 1.
+    times_xi = lambda r: (jnp.sqrt(k / 2) * jnp.pad(r[..., :-1], [(0, 0)] * (r.ndim - 1) + [(1, 0)]) + 
+                          jnp.sqrt((k + 1) / 2) * jnp.pad(r[..., 1:], [(0, 0)] * (r.ndim - 1) + [(0, 1)]))
+    
+    def next_order(r, m):
+        r_m, r_m_minus_1 = r
+        return (jnp.sqrt(2 / (m + 1)) * (a * times_xi(r_m) + b * r_m) - jnp.sqrt(m / (m + 1)) * r_m_minus_1, r_m), r_m
+    
+    r_0 = jnp.zeros(jnp.broadcast_shapes(a.shape, b.shape)[:-1] + (N,), dtype=a.dtype).at[..., 0].set(1)
+    R = jax.lax.scan(next_order, (r_0, jnp.zeros_like(r_0)), k)[1]
+    
+    return a[..., None] * jnp.moveaxis(R, 0, -2)
+
+
+def rescale_Hermite(Ck, alpha, u, alpha_new, u_new, index_set=None):
+    """
+    Re-project Ck of shape (Ns, Np, Nm, Nn, ...), or (Ns, K, ...) over a downward-closed index_set, from the Hermite
+    bases alpha, u onto alpha_new, u_new (all of shape (Ns, 3)), one velocity axis at a time with
+    Hermite_rescaling_matrix. The matrices are lower triangular, so the retained coefficients of a downward-closed
+    set only depend on retained ones and are exact.
+    """
+
+    if index_set is not None:
+        Nn, Nm, Np = [max(orders) + 1 for orders in zip(*index_set)]
+        Ck = expand_Hermite(Ck, index_set, Nn, Nm, Np)
+    
+    Np, Nm, Nn = Ck.shape[1:4]
+    T_n, T_m, T_p = [Hermite_rescaling_matrix(N, alpha[:, i], u[:, i], alpha_new[:, i], u_new[:, i]).astype(Ck.real.dtype)
+                     for i, N in enumerate((Nn, Nm, Np))]
+    Ck = jnp.einsum('sab,spmb...->spma...', T_n, Ck)
+    Ck = jnp.einsum('sab,spbn...->span...', T_m, Ck)
+    Ck = jnp.einsum('sab,sbmn...->samn...', T_p, Ck)
+    
+    return Ck if index_set is None else restrict_Hermite(Ck, index_set)
+
+
+def streaming_term(Ck, kx_grid, ky_grid, kz_grid, Lx, Ly, Lz, alpha, u, index_set=None):
+    """
+    Free-streaming term -(ik/L) . (alpha * ladder + u) Ck of the Vlasov equation for Ck of shape
+    (Ns, Np, Nm, Nn, Nx, Ny, Nz), or (Ns, K, Nx, Ny, Nz) over index_set, with alpha and u of shape (Ns, 3).
+    """
+
+    n, m, p, _ = Hermite_orders(Ck, index_set)
+    a0, a1, a2 = [species_column(alpha[:, i], Ck.ndim) for i in range(3)]
+    u0, u1, u2 = [species_column(u[:, i], Ck.ndim) for i in range(3)]
+    C = lambda offset: Hermite_neighbor(Ck, offset, index_set)
+    
+    return (- (kx_grid * 1j / Lx) * (a0 * (
+        jnp.sqrt((n + 1) / 2) * C((1, 0, 0)) + jnp.sqrt(n / 2) * C((-1, 0, 0))) + u0 * Ck
+    ) - (ky_grid * 1j / Ly) * (a1 * (
+        jnp.sqrt((m + 1) / 2) * C((0, 1, 0)) + jnp.sqrt(m / 2) * C((0, -1, 0))) + u1 * Ck
+    ) - (kz_grid * 1j / Lz) * (a2 * (
+        jnp.sqrt((p + 1) / 2) * C((0, 0, 1)) + jnp.sqrt(p / 2) * C((0, 0, -1))) + u2 * Ck))
+
+
+def collision_term(Ck, nu, index_set=None):
+    """
+    "Unphysical" hypercollision term that damps the highest Hermite orders in n to eliminate recurrence.
+    """
+
+    _, _, _, col = Hermite_orders(Ck, index_set)
+    
+    return -nu * col * Ck
+
+
+def Hermite_coupling_terms(Ck, alpha, u, index_set=None):
+    """
+    Hermite terms multiplying each component of E and B in the Vlasov equation, for Ck of shape
+    (Ns, Np, Nm, Nn, Nx, Ny, Nz), or (Ns, K, Nx, Ny, Nz) over index_set, in either Fourier or real space
+    (the terms act on Hermite indices only).
+
+    Returns:
+    tuple: (Ck_E, Ck_B), each of shape (3,) + Ck.shape.
+    """
+
+    n, m, p, _ = Hermite_orders(Ck, index_set)
+    a0, a1, a2 = [species_column(alpha[:, i], Ck.ndim) for i in range(3)]
+    u0, u1, u2 = [species_column(u[:, i], Ck.ndim) for i in range(3)]
+    C = lambda offset: Hermite_neighbor(Ck, offset, index_set)
+    
+    # Neighbors along each Hermite axis.
+    Cn_m, Cm_m, Cp_m = C((-1, 0, 0)), C((0, -1, 0)), C((0, 0, -1))
+    
+    Ck_E = jnp.array([(jnp.sqrt(2 * n) / a0) * Cn_m,
+                      (jnp.sqrt(2 * m) / a1) * Cm_m,
+                      (jnp.sqrt(2 * p) / a2) * Cp_m])
+    
+    Ck_aux_x = (jnp.sqrt(m * p) * (a2 / a1 - a1 / a2) * C((0, -1, -1)) + 
+        jnp.sqrt(m * (p + 1)) * (a2 / a1) * C((0, -1, 1)) - 
+        jnp.sqrt((m + 1) * p) * (a1 / a2) * C((0, 1, -1)) + 
+        jnp.sqrt(2 * m) * (u2 / a1) * Cm_m - 
+        jnp.sqrt(2 * p) * (u1 / a2) * Cp_m)
+    
+    Ck_aux_y = (jnp.sqrt(n * p) * (a0 / a2 - a2 / a0) * C((-1, 0, -1)) + 
+        jnp.sqrt((n + 1) * p) * (a0 / a2) * C((1, 0, -1)) - 
+        jnp.sqrt(n * (p + 1)) * (a2 / a0) * C((-1, 0, 1)) + 
+        jnp.sqrt(2 * p) * (u0 / a2) * Cp_m - 
+        jnp.sqrt(2 * n) * (u2 / a0) * Cn_m)
+    
+    Ck_aux_z = (jnp.sqrt(n * m) * (a1 / a0 - a0 / a1) * C((-1, -1, 0)) + 
+        jnp.sqrt(n * (m + 1)) * (a1 / a0) * C((-1, 1, 0)) - 
+        jnp.sqrt((n + 1) * m) * (a0 / a1) * C((1, -1, 0)) + 
+        jnp.sqrt(2 * n) * (u1 / a0) * Cn_m - 
+        jnp.sqrt(2 * m) * (u0 / a1) * Cm_m)
+    
+    return Ck_E, jnp.array([Ck_aux_x, Ck_aux_y, Ck_aux_z])
+
+
+def convolve_direct(Fk, Ck):
+    """
+    Fourier-space convolution of Fk (Nx, Ny, Nz) with every (Nx, Ny, Nz) block of Ck (..., Nx, Ny, Nz).
+    """
+
+    FCk = jax.vmap(partial(convolve, Fk, mode='same'))(Ck.reshape(-1, *Ck.shape[-3:]))
+    
+    return FCk.reshape(Ck.shape)
+
+
+def convolve_sparse(Fk, Ck, mode_set):
+    """
+    Fourier-space convolution of Fk (Q, 1, 1) with every (Q, 1, 1) block of Ck (..., Q, 1, 1) over the sparse
+    mode_set (see restrict_Fourier), keeping only the products that land back in the set.
+    """
+
+    out, a, b = Fourier_mode_pairs(mode_set)
+    
+    return jnp.zeros_like(Ck).at[..., out, :, :].add(Fk[a] * Ck[..., b, :, :])
+
+
+def field_coupling_term(Ck, Fk, alpha, u, qs, Omega_cs, convolution='direct', dealiasing='padding', transforms=None,
+                        spectrum='full', index_set=None, mode_set=None, fields='EB'):
+    """
+    E and v x B coupling terms q * Omega_c * (E . d/dv + (v x B) . d/dv) of the Vlasov equation for
+    Ck of shape (Ns, Np, Nm, Nn, Nx, Ny, Nz), or (Ns, K, Nx, Ny, Nz) over index_set (see Hermite_index_set).
+
+    transforms is an optional triple (Ck_to_grid, Fk_to_grid, to_spectrum) replacing the transforms of
+    SPECTRUM_TRANSFORMS in the pseudospectral products (see shard_transforms). With spectrum='half', Ck and Fk
+    hold only the kx >= 0 modes (see half_spectrum), and so does the result. With a sparse mode_set (see
+    Fourier_mode_set) Ck and Fk hold only those modes, and the products are convolve_sparse over the set
+    (convolution and dealiasing are then ignored). fields selects the E ('E') and v x B ('B') couplings evaluated,
+    e.g. to time them separately.
+    """
+
+    # Components of Fk = (Ex, Ey, Ez, Bx, By, Bz) coupled, and their Hermite terms in (Ck_E, Ck_B).
+    components = [i for i in range(6) if 'EB'[i // 3] in fields]
+    term = lambda Ck_E, Ck_B, i: (Ck_E, Ck_B)[i // 3][i % 3]
+
+    if mode_set is not None:
+        Ck_E, Ck_B = Hermite_coupling_terms(Ck, alpha, u, index_set)
+        coupling = sum(convolve_sparse(Fk[i], term(Ck_E, Ck_B, i), mode_set) for i in components)
+    elif convolution == 'direct':
+        if spectrum == 'half':
+            Ck, Fk = full_spectrum(Ck), full_spectrum(Fk)
+        Ck_E, Ck_B = Hermite_coupling_terms(Ck, alpha, u, index_set)
+        coupling = sum(convolve_direct(Fk[i], term(Ck_E, Ck_B, i)) for i in components)
+        if spectrum == 'half':
+            coupling = half_spectrum(coupling)
+    elif convolution == 'pseudospectral':
+        N = full_spectrum_shape(Ck.shape[-3:], spectrum)
+        mask = two_thirds_mask(N) if spectrum == 'full' else half_spectrum(two_thirds_mask(N))
+        if dealiasing == '2/3':
+            Ck, Fk = Ck * mask, Fk * mask
+        
+        # The Hermite ladder terms do not act on x, so they are built once from the real-space Ck
+        # and the six products are summed before a single forward FFT.
+        Ck_to_grid, Fk_to_grid, to_spectrum = transforms or SPECTRUM_TRANSFORMS[spectrum]
+        M = dealiased_grid_shape(N, dealiasing)
+        C, F = Ck_to_grid(Ck, M), Fk_to_grid(Fk, M)
+        C_E, C_B = Hermite_coupling_terms(C, alpha, u, index_set)
+        coupling = to_spectrum(sum(F[i] * term(C_E, C_B, i) for i in components), N)
+        
+        if dealiasing == '2/3':
+            coupling = coupling * mask
+    else:
+        raise ValueError(f"Unknown convolution '{convolution}'. Use 'direct' or 'pseudospectral'.")
+    
+    return species_column(qs * Omega_cs, coupling.ndim) * coupling
+
+
+def current_density(Ck, qs, alpha, u, index_set=None):
+    """
+    Current density sum_s q_s * int v f_s dv in Fourier space, shape (3, Nx, Ny, Nz), for Ck of shape
+    (Ns, Np, Nm, Nn, Nx, Ny, Nz), or (Ns, K, Nx, Ny, Nz) over index_set.
+    """
+
+    # Zeroth and first Hermite moments of each species, reduced over the species axis.
+    C0, C1, _ = Hermite_moments(Ck, index_set)
+    
+    return jnp.sum((qs * jnp.prod(alpha, axis=1))[:, None, None, None, None] * (
+        (1 / jnp.sqrt(2)) * alpha[:, :, None, None, None] * C1 + u[:, :, None, None, None] * C0[:, None]), axis=0)
+
+
+def zero_mode(shape_k, spectrum='full', mode_set=None):
+    """
+    Position of the k = 0 mode in the stored Fourier axes of shape shape_k (centered full grid, kx >= 0 half, or the
+    (Q, 1, 1) layout over mode_set).
+    """
+
+    Nx, Ny, Nz = shape_k
+    
+    return ((Nx - 1) // 2 if spectrum == 'full' else 0, (Ny - 1) // 2, (Nz - 1) // 2) if mode_set is None else (mode_set.index((0, 0, 0)), 0, 0)
+
+
+# Diagnostics available from compute_diagnostics (and as snapshot outputs of VlasovMaxwellSolver).
+DIAGNOSTICS = ('kinetic_energy', 'EM_energy', 'momentum', 'Hermite_spectrum', 'k_spectrum')
+
+
+def compute_diagnostics(Ck, Fk, alpha, u, qs, Omega_cs, names=DIAGNOSTICS, spectrum='full', index_set=None, mode_set=None):
+    """
+    Volume-averaged diagnostics computed directly in Fourier-Hermite space, without transforming to real space.
+
+    The space average of a field is its k = 0 mode, and the space average of a product of real fields is
+    sum_k Ak conj(Bk) (Parseval's identity for the physical amplitudes used by spectrum_to_grid); with
+    spectrum='half' the kx > 0 modes are counted twice for their missing conjugates. A sparse mode_set (see
+    Fourier_mode_set) holds its conjugates and k = 0, and the sums run over its modes only. Masses are
+    m_s / m_0 = Omega_c0 / Omega_cs (see VlasovMaxwellSolver.make_params), i.e. in units of the mass of the first species.
+
+    Diagnostics (keys of the returned dictionary, a subset selected by names):
+    kinetic_energy (Ns,): 1/2 m_s <int |v|^2 f_s dv>.
+    EM_energy (): Omega_c0^2 / 2 <|E|^2 + |B|^2>, as from the real-space fields of anti_transform_species.
+    momentum (Ns, 3): m_s <int v f_s dv>.
+    Hermite_spectrum (Ns, Np, Nm, Nn) or (Ns, K): <|C_nmp|^2>, the energy in each Hermite mode.
+    k_spectrum (Ns, Nx, Ny, Nz) or (Ns, Q, 1, 1): sum_nmp |Ck_nmp|^2, the energy in each Fourier mode (only the stored modes).
+
+    Parameters:
+    Ck (jax.Array): Hermite-Fourier coefficients, shape (Ns, Np, Nm, Nn, Nx, Ny, Nz), or (Ns, K, Nx, Ny, Nz)
+                    over index_set.
+    Fk (jax.Array): Fourier coefficients of (E, B), shape (6, Nx, Ny, Nz).
+    alpha, u (jax.Array): Hermite scaling and shift, shape (Ns, 3).
+    qs, Omega_cs (jax.Array): Charges and cyclotron frequencies, length Ns.
+
+    Returns:
+    dict: Selected diagnostics.
+    """
+
+    Nx, Ny, Nz = Ck.shape[-3:]
+    
+    # Parseval weights of the stored modes, and the k = 0 mode.
+    weights = jnp.ones((Nx, Ny, Nz)) if spectrum == 'full' else jnp.ones((Nx, Ny, Nz)).at[1:].set(2.0)
+    k0 = zero_mode((Nx, Ny, Nz), spectrum, mode_set)
+    
+    # Space averages of the Hermite moments of order 0, 1 and 2 along each velocity axis.
+    C0, C1, C2 = Hermite_moments(Ck[..., k0[0], k0[1], k0[2]].real, index_set)
+    ms = Omega_cs[0] / Omega_cs
+    
+    diagnostics = {}
+    if 'kinetic_energy' in names:
+        diagnostics['kinetic_energy'] = kinetic_energy_density(C0, C1, C2, alpha, u, ms)
+    if 'EM_energy' in names:
+        diagnostics['EM_energy'] = jnp.sum(weights * jnp.abs(Fk) ** 2) * Omega_cs[0] ** 2 / 2
+    if 'momentum' in names:
+        diagnostics['momentum'] = (ms * jnp.prod(alpha, axis=1))[:, None] * ((1 / jnp.sqrt(2)) * alpha * C1 + u * C0[:, None])
+    if 'Hermite_spectrum' in names:
+        diagnostics['Hermite_spectrum'] = jnp.sum(weights * jnp.abs(Ck) ** 2, axis=(-3, -2, -1))
+    if 'k_spectrum' in names:
+        diagnostics['k_spectrum'] = jnp.sum(jnp.abs(Ck) ** 2, axis=tuple(range(1, Ck.ndim - 3)))
+    
+    return diagnostics
+
+
+def maxwell_term(Ck, Fk, kx_grid, ky_grid, kz_grid, Lx, Ly, Lz, alpha, u, qs, Omega_cs, index_set=None):
+    """
+    Right-hand side of Faraday's and Ampere's laws for Fk = (Ek, Bk) of shape (6, Nx, Ny, Nz).
+    """
+
+    k_vec = jnp.array([kx_grid / Lx, ky_grid / Ly, kz_grid / Lz])
+    
+    dBk_dt = - 1j * cross_product(k_vec, Fk[:3, ...])
+    dEk_dt = 1j * cross_product(k_vec, Fk[3:, ...]) - (1 / Omega_cs[0]) * current_density(Ck, qs, alpha, u, index_set)
+    
+    return jnp.concatenate([dEk_dt, dBk_dt])
+
+
+def compute_dCk_dt(Ck, Fk, kx_grid, ky_grid, kz_grid, Lx, Ly, Lz, nu, alpha_s, u_s, qs, Omega_cs, convolution='direct', dealiasing='padding',
+                   transforms=None, spectrum='full', index_set=None, mode_set=None):
+    """
+    Tensor-stencil right-hand side of the Vlasov equation.
+
+    Ck is stored as a structured array of shape (Ns, Np, Nm, Nn, Nx, Ny, Nz) (a free reshape of the flat
+    (Ns * Nn * Nm * Np, Nx, Ny, Nz) layout), and every Hermite ladder term is built from zero-padded shifted
+    slices along the n, m, p axes instead of gathers, so out-of-range neighbors are never read. With a reduced
+    index_set (see Hermite_index_set) Ck has shape (Ns, K, Nx, Ny, Nz) instead, and the neighbors are gathered
+    with precomputed tables (see Hermite_neighbor).
+
+    Parameters:
+    Ck (jax.Array): Hermite-Fourier coefficients, shape (Ns, Np, Nm, Nn, Nx, Ny, Nz).
+    Fk (jax.Array): Fourier coefficients of (E, B), shape (6, Nx, Ny, Nz).
+    kx_grid, ky_grid, kz_grid (jax.Array): Wave-vector grids (times L), shape (Nx, Ny, Nz).
+    alpha_s, u_s (jax.Array): Hermite scaling and shift, shape (Ns, 3) (or flat of length 3 * Ns).
+    qs, Omega_cs (jax.Array): Charges and cyclotron frequencies, length Ns.
+    convolution, dealiasing (str): See compute_dCk_s_dt.
+    transforms (tuple or None), spectrum (str): See field_coupling_term. With spectrum='half' the k grids hold the
+                                                kx >= 0 half as well.
+    index_set (tuple or None): Retained Hermite multi-indices, or None for the full tensor basis.
+    mode_set (tuple or None): Evolved Fourier modes (see Fourier_mode_set), with Ck, Fk and the k grids restricted
+                              to them (see restrict_Fourier), or None for the full grid.
+
+    Returns:
+    jax.Array: dCk/dt, same shape as Ck.
+    """
+
+    Ns = Ck.shape[0]
+    alpha, u = alpha_s.reshape(Ns, 3), u_s.reshape(Ns, 3)
+    
+    return (streaming_term(Ck, kx_grid, ky_grid, kz_grid, Lx, Ly, Lz, alpha, u, index_set) + 
+            field_coupling_term(Ck, Fk, alpha, u, qs, Omega_cs, convolution, dealiasing, transforms, spectrum, index_set, mode_set) + 
+            collision_term(Ck, nu, index_set))
+
+
+def linear_Hermite_operators(kx_grid, ky_grid, kz_grid, Lx, Ly, Lz, nu, alpha_s, u_s, Nn, Nm, Np, separable=True):
+    """
+    Stiff linear part of the Vlasov equation (free streaming and hypercollisions) as small dense matrices.
+
+    The operator acting on Ck is the Kronecker sum L_n + L_m + L_p, where L_n acts on the n index only and
+    depends on the species and kx, and likewise for L_m (ky) and L_p (kz). The three parts commute, so
+    exp(h * L) is the product of their exponentials (see apply_Hermite_propagators).
+
+    With separable=False the k grids are those of a sparse mode set (see restrict_Fourier), and all three
+    operators are built for each of the Q modes along the first Fourier axis.
+
+    Returns:
+    tuple: (L_n, L_m, L_p) with shapes (Ns, Nx, Nn, Nn), (Ns, Ny, Nm, Nm), (Ns, Nz, Np, Np), or (Ns, Q, N, N)
+    for separable=False.
+    """
+
+    alpha, u = alpha_s.reshape(-1, 3), u_s.reshape(-1, 3)
+    
+    def streaming_matrix(k, L, alpha, u, N):
+        # Symmetric tridiagonal Hermite ladder matrix: (J C)[n] = sqrt((n+1)/2) C[n+1] + sqrt(n/2) C[n-1].
+        J = np.diag(np.sqrt(np.arange(1, N) / 2), 1)
+        J = J + J.T
+        return -1j * (k / L)[None, :, None, None] * (alpha[:, None, None, None] * J + u[:, None, None, None] * np.eye(N))
+    
+    _, _, _, col = Hermite_weights(Nn, Nm, Np)
+    
+    ky, kz = (ky_grid[0, :, 0], kz_grid[0, 0, :]) if separable else (ky_grid[:, 0, 0], kz_grid[:, 0, 0])
+    
+    L_n = streaming_matrix(kx_grid[:, 0, 0], Lx, alpha[:, 0], u[:, 0], Nn) - nu * np.diag(col.flatten())
+    L_m = streaming_matrix(ky, Ly, alpha[:, 1], u[:, 1], Nm)
+    L_p = streaming_matrix(kz, Lz, alpha[:, 2], u[:, 2], Np)
+    
+    return L_n, L_m, L_p
+
+
+def apply_Hermite_propagators(propagators, Ck, separable=True):
+    """
+    Apply exp(h * L) = exp(h * L_n) exp(h * L_m) exp(h * L_p) (see linear_Hermite_operators) to Ck of shape
+    (Ns, Np, Nm, Nn, Nx, Ny, Nz), or (Ns, Np, Nm, Nn, Q, 1, 1) for separable=False.
+    """
+
+    E_n, E_m, E_p = propagators
+    
+    Ck = jnp.einsum('sxab,spmbxyz->spmaxyz', E_n, Ck)
+    Ck = jnp.einsum('syab,spbnxyz->spanxyz' if separable else 'sxab,spbnxyz->spanxyz', E_m, Ck)
+    Ck = jnp.einsum('szab,sbmnxyz->samnxyz' if separable else 'sxab,sbmnxyz->samnxyz', E_p, Ck)
+    
+    return Ck
+
+
+# @partial(jax.jit, static_argnums=[10, 11, 12, 13, 14, 15, 16])
+def ode_system_tensor(Ck_Fk, t, qs, nu, Omega_cs, alpha_s, u_s, Lx, Ly, Lz, Nx, Ny, Nz, Nn, Nm, Np, Ns, convolution='direct', dealiasing='padding'):
+    """
+    Drop-in replacement for ode_system built on the tensor-stencil right-hand side compute_dCk_dt.
+    """
+    
+    kx_grid, ky_grid, kz_grid = wave_vector_grids(Nx, Ny, Nz)
+    
+    # Separate distribution functions (coefficients Ck, structured as (s, p, m, n, x, y, z))
+    # and electric and magnetic fields (coefficients Fk).
+    Ck = Ck_Fk[:(-6 * Nx * Ny * Nz)].reshape(Ns, Np, Nm, Nn, Nx, Ny, Nz)
+    Fk = Ck_Fk[(-6 * Nx * Ny * Nz):].reshape(6, Nx, Ny, Nz)
+    
+    dCk_dt = compute_dCk_dt(Ck, Fk, kx_grid, ky_grid, kz_grid, Lx, Ly, Lz, nu, alpha_s, u_s, qs, Omega_cs, convolution, dealiasing)
+    dFk_dt = maxwell_term(Ck, Fk, kx_grid, ky_grid, kz_grid, Lx, Ly, Lz, alpha_s.reshape(Ns, 3), u_s.reshape(Ns, 3), qs, Omega_cs)
+    
+    # Flatten into a 1D array for an ODE solver.
+    return jnp.concatenate([dCk_dt.flatten(), dFk_dt.flatten()])
+
+def enable_compilation_cache(cache_dir):
+    """
+    Store compiled XLA executables in JAX's persistent compilation cache under cache_dir, so that a repeat
+    run with the same shapes loads them from disk instead of recompiling. This sets jax_compilation_cache_dir for
+    the whole process, and is only done on request (compilation_cache_dir of VlasovMaxwellSolver, or main); the
+    thresholds of JAX on the compile time and size of the cached entries are kept.
+    """
+
+    os.makedirs(cache_dir, exist_ok=True)
+    jax.config.update('jax_compilation_cache_dir', cache_dir)
+
+
+# Axes of Ck, shape (Ns, Np, Nm, Nn, Nx, Ny, Nz), that can be split across devices.
+SHARDING_AXES = {'species': 0, 'p': 1, 'm': 2, 'n': 3, 'x': 4, 'y': 5, 'z': 6}
+
+
+def shard_mesh(shape_Ck, axis, devices=None):
+    """
+    Shardings that split Ck along one of SHARDING_AXES over a 1D mesh of devices (all devices by default, e.g.
+    the host CPU cores exposed with XLA_FLAGS=--xla_force_host_platform_device_count=N). Fk is split along the
+    same Fourier axis when axis is 'x', 'y' or 'z', and replicated otherwise.
+
+    Returns:
+    tuple: (Ck_sharding, Fk_sharding), jax.sharding.NamedSharding objects.
+    """
+
+    devices = jax.devices() if devices is None else devices
+    mesh = Mesh(np.array(devices), ('devices',))
+    
+    if shape_Ck[SHARDING_AXES[axis]] % len(devices) != 0:
+        raise ValueError(f"Axis '{axis}' of size {shape_Ck[SHARDING_AXES[axis]]} cannot be split over {len(devices)} devices.")
+    
+    Ck_spec = [None] * 7
+    Ck_spec[SHARDING_AXES[axis]] = 'devices'
+    Fk_spec = [None, None, None, None]
+    if axis in ('x', 'y', 'z'):
+        Fk_spec[SHARDING_AXES[axis] - 3] = 'devices'
+    
+    return NamedSharding(mesh, PartitionSpec(*Ck_spec)), NamedSharding(mesh, PartitionSpec(*Fk_spec))
+
+
+def shard_transforms(shape_Ck, axis, Ck_sharding, Fk_sharding, spectrum='full'):
+    """
+    Versions of the transforms of SPECTRUM_TRANSFORMS[spectrum] for Ck and Fk laid out with the shardings of
+    shard_mesh, run block by block on each device with jax.shard_map, for use in field_coupling_term.
+
+    When Ck is split along a Hermite or species axis the FFTs are local to each device. When it is split along a
+    Fourier axis, the blocks are first transposed with an all-to-all so that the devices split a Hermite (or the
+    species) axis instead while the FFTs run, and transposed back after the forward FFT; the much smaller Fk is
+    gathered on every device.
+
+    Returns:
+    tuple: (Ck_to_grid, Fk_to_grid, to_spectrum) with the signatures of spectrum_to_grid and grid_to_spectrum.
+    """
+
+    to_grid, from_grid = SPECTRUM_TRANSFORMS[spectrum][1:]
+    mesh, n_devices = Ck_sharding.mesh, Ck_sharding.mesh.devices.size
+    sharded = SHARDING_AXES[axis]
+    
+    if axis in ('x', 'y', 'z'):
+        transposed = next((i for i in (3, 2, 1, 0) if shape_Ck[i] % n_devices == 0), None)
+        if transposed is None:
+            raise ValueError(f"FFTs along the sharded axis '{axis}' need Ns, Np, Nm or Nn divisible by {n_devices} devices.")
+    else:
+        transposed = sharded
+    grid_spec = PartitionSpec(*['devices' if i == transposed else None for i in range(7)])
+    
+    def Ck_to_grid(M, Ck):
+        if transposed != sharded:
+            Ck = jax.lax.all_to_all(Ck, 'devices', transposed, sharded, tiled=True)
+        return to_grid(Ck, M)
+    
+    def Fk_to_grid(M, Fk):
+        if transposed != sharded:
+            Fk = jax.lax.all_gather(Fk, 'devices', axis=sharded - 3, tiled=True)
+        return to_grid(Fk, M)
+    
+    def to_spectrum(N, C):
+        Ck = from_grid(C, N)
+        if transposed != sharded:
+            Ck = jax.lax.all_to_all(Ck, 'devices', sharded, transposed, tiled=True)
+        return Ck
+    
+    def per_device(function, in_spec, out_spec, check_vma=True):
+        return lambda X, shape: jax.shard_map(partial(function, shape), mesh=mesh, in_specs=in_spec, out_specs=out_spec,
+                                              check_vma=check_vma)(X)
+    
+    # The gathered fields are identical on every device, which shard_map cannot infer through the FFTs.
+    return (per_device(Ck_to_grid, Ck_sharding.spec, grid_spec),
+            per_device(Fk_to_grid, Fk_sharding.spec, PartitionSpec(), check_vma=False),
+            per_device(to_spectrum, grid_spec, Ck_sharding.spec))
+
+
+def in_precision(method):
+    """
+    Run a VlasovMaxwellSolver method within the precision_scope of the solver.
+    """
+
+    @wraps(method)
+    def scoped(self, *args, **kwargs):
+        with self.precision_scope():
+            return method(self, *args, **kwargs)
+    
+    return scoped
+
+
+class VlasovMaxwellSolver:
+    """
+    Hermite-Fourier Vlasov-Maxwell solver built from a parameter dictionary (the contents of a
+    plasma_parameters*.json file).
+
+    At construction the wave-vector grids and Hermite coefficient tables are computed once, and a single
+    jitted right-hand side with static shapes is exposed as self.rhs(Ck_Fk, t, params). The physical
+    parameters are kept in the pytree self.params and passed as a traced argument, so changing their
+    values does not trigger recompilation.
+
+    The methods run in the precision of the solver without changing the global JAX configuration (see
+    precision_scope); self.rhs and the integrators of Integrators applied to it must be called within
+    solver.precision_scope(), as run() does.
+
+    Options read from the parameters (with defaults):
+    convolution ('direct'), dealiasing ('padding'): See compute_dCk_s_dt.
+    compilation_cache_dir (None): Directory of the persistent compilation cache (see enable_compilation_cache); with
+                                  None the JAX configuration of the process is left as it is.
+    sharding (None): Axis of Ck split across all devices (a key of SHARDING_AXES), see shard_mesh.
+    spectrum ('full'): 'half' stores and evolves only the kx >= 0 Fourier modes of Ck and Fk (Nx // 2 + 1 of them,
+                       see half_spectrum), which halves the state and the work; Nx, Ny and Nz must then be odd.
+                       Use from_full_spectrum and to_full_spectrum to convert states.
+    Hermite_truncation ('tensor'), Hermite_degree (None): Hermite multi-indices evolved, see Hermite_index_set.
+                       'total_degree' and 'hyperbolic_cross' keep only the low orders of the (Nn, Nm, Np) box, and
+                       Ck is then stored as (Ns, K, Nx, Ny, Nz) over the K retained indices; from_full_spectrum and
+                       to_full_spectrum also convert between this layout and the tensor layout. An explicit list of
+                       [n, m, p] indices can be given instead as Hermite_indices, which must be downward closed
+                       (see check_Hermite_index_set).
+    Fourier_modes (None): List of integer wave vectors [kx, ky, kz] evolved instead of the full Fourier grid (which
+                       must have odd sizes), see Fourier_mode_set. Ck and Fk are then stored as (..., Q, 1, 1) over
+                       the Q modes, and the E/B products are restricted to the set (see convolve_sparse), so the
+                       cost scales with the number of modes instead of the bounding box.
+    Fourier_activation_threshold (None): If given, the fringe of the modes (see Fourier_mode_fringe) is evolved as
+                       well, and activate_Fourier_modes promotes the fringe modes whose amplitude exceeds it.
+    precision ('double'): Floating-point precision, a key of PRECISIONS. 'double' evolves a complex128 state.
+                       'single' evolves a complex64 state with 64-bit types disabled, halving the memory and traffic.
+                       'mixed' evolves a complex64 state and computes the Vlasov terms in single precision, but
+                       accumulates the current density, the Maxwell update and the diagnostics in double precision.
+    Hermite_rescaling (False): Adapt alpha_s and u_s to the mean velocity and temperature of every species between
+                       the segments of run() (see rescale_basis), so that a heating or drifting plasma keeps a compact
+                       Hermite spectrum. The snapshots then also hold alpha_s and u_s.
+    """
+
+    def __init__(self, parameters):
+        self.parameters = dict(parameters)
+        
+        self.precision = parameters.get('precision', 'double')
+        if self.precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision '{self.precision}'. Use 'double', 'single' or 'mixed'.")
+        self.real_dtype, self.complex_dtype, self.accumulation_dtype = PRECISIONS[self.precision]
+        
+        # Grid sizes, which fix the shapes of the compiled program.
+        self.Nx, self.Ny, self.Nz = parameters['Nx'], parameters['Ny'], parameters['Nz']
+        self.Nn, self.Nm, self.Np, self.Ns = parameters['Nn'], parameters['Nm'], parameters['Np'], parameters['Ns']
+        
+        # Number of stored kx modes.
+        self.spectrum = parameters.get('spectrum', 'full')
+        if self.spectrum == 'half' and not (self.Nx % 2 and self.Ny % 2 and self.Nz % 2):
+            raise ValueError("spectrum='half' requires odd Nx, Ny and Nz.")
+        elif self.spectrum not in ('full', 'half'):
+            raise ValueError(f"Unknown spectrum '{self.spectrum}'. Use 'full' or 'half'.")
+        self.Nkx = self.Nx if self.spectrum == 'full' else self.Nx // 2 + 1
+        
+        # Sparse set of evolved Fourier modes (None for the full grid): the active modes plus, with an activation
+        # threshold, their fringe.
+        self.active_modes, self.mode_set = None, None
+        self.activation_threshold = parameters.get('Fourier_activation_threshold')
+        if parameters.get('Fourier_modes') is not None:
+            if self.spectrum == 'half' or not (self.Nx % 2 and self.Ny % 2 and self.Nz % 2):
+                raise ValueError("Fourier_modes requires spectrum='full' and odd Nx, Ny and Nz.")
+            self.active_modes = Fourier_mode_set(parameters['Fourier_modes'], (self.Nx, self.Ny, self.Nz))
+            self.mode_set = self.active_modes
+            if self.activation_threshold is not None:
+                self.mode_set = tuple(sorted(self.active_modes + Fourier_mode_fringe(self.active_modes, (self.Nx, self.Ny, self.Nz))))
+        
+        # Retained Hermite multi-indices (None for the full tensor basis).
+        self.Hermite_truncation = parameters.get('Hermite_truncation', 'tensor')
+        if self.Hermite_truncation not in ('tensor', 'total_degree', 'hyperbolic_cross'):
+            raise ValueError(f"Unknown Hermite_truncation '{self.Hermite_truncation}'. Use 'tensor', 'total_degree' or 'hyperbolic_cross'.")
+        if 'Hermite_indices' in parameters:
+            self.index_set = tuple(sorted(map(tuple, parameters['Hermite_indices']), key=lambda index: index[::-1]))
+            check_Hermite_index_set(self.index_set, self.Nn, self.Nm, self.Np)
+        elif self.Hermite_truncation != 'tensor':
+            self.index_set = Hermite_index_set(self.Nn, self.Nm, self.Np, self.Hermite_truncation, parameters.get('Hermite_degree'))
+        else:
+            self.index_set = None
+        
+        self.shape_Hermite = (self.Np, self.Nm, self.Nn) if self.index_set is None else (len(self.index_set),)
+        self.shape_k = (self.Nkx, self.Ny, self.Nz) if self.mode_set is None else (len(self.mode_set), 1, 1)
+        self.shape_Ck = (self.Ns,) + self.shape_Hermite + self.shape_k
+        self.shape_Fk = (6,) + self.shape_k
+        self.size_Ck = int(np.prod(self.shape_Ck))
+        
+        self.convolution = parameters.get('convolution', 'direct')
+        self.dealiasing = parameters.get('dealiasing', 'padding')
+        
+        # Optional multi-device sharding of Ck.
+        self.sharding = parameters.get('sharding')
+        if self.sharding is not None and (self.index_set is not None or self.mode_set is not None):
+            raise ValueError("sharding requires Hermite_truncation='tensor' and the full Fourier grid.")
+        if self.sharding is not None:
+            self.Ck_sharding, self.Fk_sharding = shard_mesh(self.shape_Ck, self.sharding)
+        self.transforms = None
+        if self.sharding is not None and self.convolution == 'pseudospectral':
+            self.transforms = shard_transforms(self.shape_Ck, self.sharding, self.Ck_sharding, self.Fk_sharding, self.spectrum)
+        
+        # Physical parameters.
+        self.params = self.make_params()
+        
+        # Precompute wave vectors and Hermite coefficient tables (cached, and reused by the term functions at trace time).
+        self.kx_grid, self.ky_grid, self.kz_grid = wave_vector_grids(self.Nx, self.Ny, self.Nz)
+        if self.spectrum == 'half':
+            self.kx_grid, self.ky_grid, self.kz_grid = [grid[self.Nx // 2:] for grid in (self.kx_grid, self.ky_grid, self.kz_grid)]
+        elif self.mode_set is not None:
+            self.kx_grid, self.ky_grid, self.kz_grid = [restrict_Fourier(grid, self.mode_set) for grid in (self.kx_grid, self.ky_grid, self.kz_grid)]
+        self.Hermite_weights = Hermite_weights(self.Nn, self.Nm, self.Np)
+        
+        cache_dir = parameters.get('compilation_cache_dir')
+        if cache_dir is not None:
+            enable_compilation_cache(cache_dir)
+        
+        self.rhs = jax.jit(self.ode_system)
+        self.rescale = jax.jit(self.rescale_basis)
+        self.Hermite_rescaling = parameters.get('Hermite_rescaling', False)
+        self._snapshot_outputs = {}
+        self._steppers = {}
+
+    def precision_scope(self):
+        """
+        Context manager in which the computations of this solver run: 64-bit types are enabled unless
+        precision='single'. The setting is local to the context (and thread), so the global jax_enable_x64 flag
+        seen by other code in the process is unchanged.
+        """
+        
+        return jax.enable_x64(self.precision != 'single')
+
+    @in_precision
+    def make_params(self, **overrides):
+        """
+        Pytree of physical parameters passed to self.rhs, built from self.parameters with the given values overridden.
+        Accepts the JSON keys qs, nu, alpha_s, u_s, Lx, Ly, Lz, Omega_ce, mi_me and ms (possibly as traced values).
+        The parameters are float64 unless precision='single' (see vlasov_params).
+
+        All per-species parameters have a leading species axis: qs and the cyclotron frequencies
+        Omega_cs = Omega_ce / m_s are of length Ns, and alpha_s and u_s (flat lists of 3 * Ns values in the JSON) are
+        of shape (Ns, 3). The masses m_s are the optional list ms (in units of the electron mass), and default to
+        electrons followed by Ns - 1 species of mass mi_me (see species_masses).
+        """
+        
+        parameters = dict(self.parameters, **overrides)
+        
+        return {
+            'qs': jnp.asarray(parameters['qs'], dtype=float),
+            'nu': jnp.asarray(parameters['nu'], dtype=float),
+            'Omega_cs': parameters['Omega_ce'] / species_masses(self.Ns, parameters['mi_me'], parameters.get('ms')),
+            'alpha_s': jnp.asarray(parameters['alpha_s'], dtype=float).reshape(self.Ns, 3),
+            'u_s': jnp.asarray(parameters['u_s'], dtype=float).reshape(self.Ns, 3),
+            'Lx': jnp.asarray(parameters['Lx'], dtype=float),
+            'Ly': jnp.asarray(parameters['Ly'], dtype=float),
+            'Lz': jnp.asarray(parameters['Lz'], dtype=float)}
+
+    def vlasov_params(self, params):
+        """
+        params in the real dtype of the state, for the Vlasov terms (which then stay in single precision with
+        precision='mixed').
+        """
+        
+        return jax.tree_util.tree_map(lambda x: jnp.asarray(x, dtype=self.real_dtype), params)
+
+    def wave_vectors(self, dtype=None):
+        """
+        Wave-vector grids in the real dtype of the state, or in the real dtype of the complex dtype given.
+        """
+        
+        dtype = self.real_dtype if dtype is None else jnp.finfo(dtype).dtype
+        
+        return [np.asarray(grid, dtype=dtype) for grid in (self.kx_grid, self.ky_grid, self.kz_grid)]
+
+    @in_precision
+    def ensemble_params(self, **sweeps):
+        """
+        Parameters of an ensemble of runs with the same grid shapes, stacked along a leading ensemble axis.
+        Each keyword (as in make_params) is an array of values, one per member, e.g.
+        solver.ensemble_params(nu=jnp.array([0.1, 1.0, 10.0]), Lx=jnp.array([4.0, 8.0, 16.0])).
+        """
+        
+        return jax.vmap(lambda sweep: self.make_params(**sweep))({name: jnp.asarray(value) for name, value in sweeps.items()})
+
+    @classmethod
+    def from_json(cls, path):
+        """
+        Build a solver from a plasma_parameters*.json file.
+        """
+        
+        with open(path, 'r') as file:
+            return cls(json.load(file))
+
+    def pack(self, Ck, Fk):
+        """
+        Flatten Ck and Fk into the 1D state vector Ck_Fk used by the ODE solvers.
+        """
+        
+        Ck, Fk = self.constrain(Ck, Fk)
+        
+        return jnp.concatenate([Ck.flatten(), Fk.flatten()]).astype(self.complex_dtype)
+
+    def unpack(self, Ck_Fk):
+        """
+        Split the 1D state vector Ck_Fk into Ck, shape (Ns, Np, Nm, Nn, Nx, Ny, Nz), and Fk, shape (6, Nx, Ny, Nz).
+        """
+        
+        return self.constrain(Ck_Fk[:self.size_Ck].reshape(self.shape_Ck), Ck_Fk[self.size_Ck:].reshape(self.shape_Fk))
+
+    @in_precision
+    def from_full_spectrum(self, Ck_Fk):
+        """
+        Convert a state vector holding all Fourier modes and the full tensor Hermite basis (e.g. from
+        initialize_system) to the storage of this solver (dropping the modes outside Fourier_modes).
+        """
+        
+        if self.spectrum == 'full' and self.index_set is None and self.mode_set is None:
+            return jnp.asarray(Ck_Fk, dtype=self.complex_dtype)
+        
+        size_Ck = self.Ns * self.Np * self.Nm * self.Nn * self.Nx * self.Ny * self.Nz
+        Ck = Ck_Fk[:size_Ck].reshape(self.Ns, self.Np, self.Nm, self.Nn, self.Nx, self.Ny, self.Nz)
+        Fk = Ck_Fk[size_Ck:].reshape(6, self.Nx, self.Ny, self.Nz)
+        if self.index_set is not None:
+            Ck = restrict_Hermite(Ck, self.index_set)
+        if self.spectrum == 'half':
+            Ck, Fk = half_spectrum(Ck), half_spectrum(Fk)
+        if self.mode_set is not None:
+            Ck, Fk = restrict_Fourier(Ck, self.mode_set), restrict_Fourier(Fk, self.mode_set)
+        
+        return self.pack(Ck, Fk)
+
+    @in_precision
+    def to_full_spectrum(self, Ck_Fk):
+        """
+        Inverse of from_full_spectrum (the Hermite and Fourier modes outside the retained sets are zero).
+        """
+        
+        if self.spectrum == 'full' and self.index_set is None and self.mode_set is None:
+            return Ck_Fk
+        
+        Ck, Fk = self.unpack(Ck_Fk)
+        if self.spectrum == 'half':
+            Ck, Fk = full_spectrum(Ck), full_spectrum(Fk)
+        if self.mode_set is not None:
+            N = (self.Nx, self.Ny, self.Nz)
+            Ck, Fk = expand_Fourier(Ck, self.mode_set, N), expand_Fourier(Fk, self.mode_set, N)
+        if self.index_set is not None:
+            Ck = expand_Hermite(Ck, self.index_set, self.Nn, self.Nm, self.Np)
+        
+        return jnp.concatenate([Ck.flatten(), Fk.flatten()])
+
+    @in_precision
+    def activate_Fourier_modes(self, Ck_Fk):
+        """
+        Promote the fringe modes (see Fourier_activation_threshold) whose largest |Ck| or |Fk| exceeds the threshold
+        to the active set. The shapes of the compiled program change with the set, so this returns a new solver
+        together with Ck_Fk converted to its storage, or self and Ck_Fk unchanged when no mode crossed the threshold.
+        Call it between integrations, e.g. at every snapshot.
+        """
+        
+        if self.activation_threshold is None:
+            return self, Ck_Fk
+        
+        Ck, Fk = self.unpack(Ck_Fk)
+        amplitude = jnp.maximum(jnp.max(jnp.abs(Ck), axis=tuple(range(Ck.ndim - 3))), jnp.max(jnp.abs(Fk), axis=0))
+        amplitude = np.asarray(amplitude[:, 0, 0])
+        activated = [mode for mode, a in zip(self.mode_set, amplitude)
+                     if mode not in self.active_modes and a > self.activation_threshold]
+        if not activated:
+            return self, Ck_Fk
+        
+        solver = VlasovMaxwellSolver(dict(self.parameters, Fourier_modes=[list(mode) for mode in self.active_modes + tuple(activated)]))
+        
+        return solver, solver.from_full_spectrum(self.to_full_spectrum(Ck_Fk))
+
+    def constrain(self, Ck, Fk):
+        """
+        Lay out Ck and Fk across devices according to self.sharding (no-op without sharding). XLA then partitions
+        every operation on them, inserting the halo exchanges needed by the Hermite ladder shifts and the
+        direct convolutions; the FFTs of the pseudospectral products are run per device (see shard_transforms).
+        """
+        
+        if self.sharding is None:
+            return Ck, Fk
+        
+        return jax.lax.with_sharding_constraint(Ck, self.Ck_sharding), jax.lax.with_sharding_constraint(Fk, self.Fk_sharding)
+
+    def ode_system(self, Ck_Fk, t, params):
+        """
+        Right-hand side d(Ck_Fk)/dt of the Vlasov-Maxwell system (not jitted; see self.rhs).
+        """
+        
+        Ck, Fk = self.unpack(Ck_Fk)
+        vlasov = self.vlasov_params(params)
+        
+        dCk_dt = compute_dCk_dt(Ck, Fk, *self.wave_vectors(), vlasov['Lx'], vlasov['Ly'], vlasov['Lz'], vlasov['nu'], 
+                                vlasov['alpha_s'], vlasov['u_s'], vlasov['qs'], vlasov['Omega_cs'], self.convolution, self.dealiasing,
+                                self.transforms, self.spectrum, self.index_set, self.mode_set)
+        
+        return self.pack(dCk_dt, self.maxwell_update(Ck, Fk, params))
+
+    def maxwell_update(self, Ck, Fk, params):
+        """
+        dFk/dt (see maxwell_term), with the current density accumulated in the accumulation dtype of the precision.
+        """
+        
+        Ck, Fk = Ck.astype(self.accumulation_dtype), Fk.astype(self.accumulation_dtype)
+        alpha, u = params['alpha_s'], params['u_s']
+        
+        return maxwell_term(Ck, Fk, *self.wave_vectors(self.accumulation_dtype), params['Lx'], params['Ly'], params['Lz'], 
+                            alpha, u, params['qs'], params['Omega_cs'], self.index_set)
+
+    def nonlinear_rhs(self, Ck_Fk, t, params):
+        """
+        Right-hand side without the stiff linear streaming and collision terms, i.e. the E/B coupling and
+        the Maxwell update, which are treated explicitly by the integrating-factor integrators.
+        """
+        
+        Ck, Fk = self.unpack(Ck_Fk)
+        vlasov = self.vlasov_params(params)
+        alpha, u = vlasov['alpha_s'], vlasov['u_s']
+        
+        dCk_dt = field_coupling_term(Ck, Fk, alpha, u, vlasov['qs'], vlasov['Omega_cs'], self.convolution, self.dealiasing,
+                                     self.transforms, self.spectrum, self.index_set, self.mode_set)
+        
+        return self.pack(dCk_dt, self.maxwell_update(Ck, Fk, params))
+
+    def rhs_terms(self):
+        """
+        The separate pieces of the right-hand side, as functions of (Ck_Fk, params) returning their contribution
+        to dCk/dt or dFk/dt: streaming, E_coupling (E . grad_v), B_coupling ((v x B) . grad_v), collisions and
+        maxwell. Used to profile where the time goes (see Benchmarks.profile_rhs).
+        """
+        
+        def term(function):
+            def evaluate(Ck_Fk, params):
+                Ck, Fk = self.unpack(Ck_Fk)
+                params = self.vlasov_params(params)
+                alpha, u = params['alpha_s'], params['u_s']
+                return function(Ck, Fk, alpha, u, params)
+            return evaluate
+        
+        coupling = lambda fields: term(lambda Ck, Fk, alpha, u, params: field_coupling_term(
+            Ck, Fk, alpha, u, params['qs'], params['Omega_cs'], self.convolution, self.dealiasing, self.transforms, self.spectrum,
+            self.index_set, self.mode_set, fields))
+        
+        return {
+            'streaming': term(lambda Ck, Fk, alpha, u, params: streaming_term(
+                Ck, *self.wave_vectors(), params['Lx'], params['Ly'], params['Lz'], alpha, u, self.index_set)),
+            'E_coupling': coupling('E'),
+            'B_coupling': coupling('B'),
+            'collisions': term(lambda Ck, Fk, alpha, u, params: collision_term(Ck, params['nu'], self.index_set)),
+            'maxwell': lambda Ck_Fk, params: self.maxwell_update(*self.unpack(Ck_Fk), params)}
+
+    def linear_propagator(self, h, params):
+        """
+        Exponentials exp(h * L_n), exp(h * L_m), exp(h * L_p) of the linear streaming and collision operators
+        (see linear_Hermite_operators).
+        """
+        
+        if self.index_set is not None:
+            # The product of the per-direction exponentials is only the exact propagator on the tensor basis.
+            raise ValueError("The integrating-factor integrators require Hermite_truncation='tensor'.")
+        
+        L_n, L_m, L_p = linear_Hermite_operators(self.kx_grid, self.ky_grid, self.kz_grid, params['Lx'], params['Ly'], params['Lz'], 
+                                                 params['nu'], params['alpha_s'], params['u_s'], self.Nn, self.Nm, self.Np,
+                                                 self.mode_set is None)
+        
+        return tuple(expm(h * L).astype(self.complex_dtype) for L in (L_n, L_m, L_p))
+
+    def apply_linear_propagator(self, propagator, Ck_Fk):
+        """
+        Advance Ck_Fk exactly under the linear streaming and collision terms (the fields are left unchanged).
+        """
+        
+        Ck, Fk = self.unpack(Ck_Fk)
+        
+        return self.pack(apply_Hermite_propagators(propagator, Ck, self.mode_set is None), Fk)
+
+    def Fourier_blocks(self, Ck_Fk):
+        """
+        Rearrange Ck_Fk into one vector per stored Fourier mode: shape (Nk, M), with M = Ns * K + 6 Hermite and field
+        components (K Hermite modes per species) at each of the Nk modes. Inverse of from_Fourier_blocks.
+        """
+        
+        Ck, Fk = self.unpack(Ck_Fk)
+        Nk = int(np.prod(self.shape_k))
+        
+        return jnp.concatenate([Ck.reshape(-1, Nk), Fk.reshape(6, Nk)]).T
+
+    def from_Fourier_blocks(self, blocks):
+        """
+        Inverse of Fourier_blocks.
+        """
+        
+        blocks = blocks.T
+        
+        return self.pack(blocks[:-6].reshape(self.shape_Ck), blocks[-6:].reshape(self.shape_Fk))
+
+    def jacobian_blocks(self, Ck_Fk, params):
+        """
+        Jacobian of the right-hand side about the spatially uniform part (the k = 0 mode) of Ck_Fk, as one block of
+        shape (M, M) per stored Fourier mode (in the layout of Fourier_blocks): shape (Nk, M, M).
+
+        About a uniform state the Fourier modes decouple (see linearized_rhs), so every block holds the streaming,
+        collisions, cyclotron rotation in the uniform B, plasma oscillation (E . grad_v f_0 and the current) and
+        light waves of its mode exactly. All blocks are probed at once with M Jacobian-vector products, each
+        perturbing one Hermite or field component at every k.
+        """
+        
+        Ck, Fk = self.unpack(Ck_Fk)
+        k0 = zero_mode(self.shape_k, self.spectrum, self.mode_set)
+        uniform = lambda F: jnp.zeros_like(F).at[..., k0[0], k0[1], k0[2]].set(F[..., k0[0], k0[1], k0[2]])
+        Ck_Fk_uniform = self.pack(uniform(Ck), uniform(Fk))
+        
+        Nk, M = int(np.prod(self.shape_k)), self.size_Ck // int(np.prod(self.shape_k)) + 6
+        probes = jax.vmap(self.from_Fourier_blocks)(jnp.broadcast_to(jnp.eye(M, dtype=self.complex_dtype)[:, None, :], (M, Nk, M)))
+        columns = jax.vmap(lambda v: jax.jvp(lambda y: self.ode_system(y, 0.0, params), (Ck_Fk_uniform,), (v,))[1])(probes)
+        
+        return jnp.moveaxis(jax.vmap(self.Fourier_blocks)(columns), 0, -1)
+
+    def rescale_basis(self, Ck_Fk, params):
+        """
+        Adapt the Hermite bases to the plasma (not jitted; see self.rescale): estimate the mean velocity and
+        temperature of every species from the space-averaged moments of order 0, 1 and 2 of Ck_Fk (see Hermite_scales)
+        and re-project Ck exactly onto the shifted and scaled bases (see rescale_Hermite). The fields are unchanged,
+        and so are the shapes, so the new params are passed to the compiled rhs and integrators without recompiling.
+
+        Returns:
+        tuple: (Ck_Fk, params) in the new bases.
+        """
+        
+        Ck, Fk = self.unpack(Ck_Fk)
+        alpha, u = params['alpha_s'], params['u_s']
+        
+        k0 = zero_mode(self.shape_k, self.spectrum, self.mode_set)
+        moments = Hermite_moments(Ck[..., k0[0], k0[1], k0[2]].real.astype(alpha.dtype), self.index_set)
+        alpha_new, u_new = Hermite_scales(*moments, alpha, u)
+        
+        return self.pack(rescale_Hermite(Ck, alpha, u, alpha_new, u_new, self.index_set), Fk), dict(params, alpha_s=alpha_new, u_s=u_new)
+
+    def snapshot_output(self, variables=('Ck', 'Fk')):
+        """
+        Output function for Integrators.integrate that saves only the selected variables ('Ck', 'Fk', 'Ek', 'Bk',
+        the Hermite bases 'alpha_s' and 'u_s', or any of DIAGNOSTICS, see compute_diagnostics, evaluated in the
+        accumulation dtype of the precision) of each snapshot, as a dictionary. The returned function takes the state
+        and the params of the integration (self.params by default).
+        Cached per selection so that repeated calls do not recompile. Also usable as the per-step diagnostics of
+        Integrators.integrate.
+        """
+        
+        variables = tuple(variables)
+        if variables not in self._snapshot_outputs:
+            def output(Ck_Fk, params=None):
+                params = self.params if params is None else params
+                Ck, Fk = self.unpack(Ck_Fk)
+                fields = {'Ck': Ck, 'Fk': Fk, 'Ek': Fk[:3], 'Bk': Fk[3:], 'alpha_s': params['alpha_s'], 'u_s': params['u_s']}
+                if any(name in DIAGNOSTICS for name in variables):
+                    Ck, Fk = Ck.astype(self.accumulation_dtype), Fk.astype(self.accumulation_dtype)
+                    fields.update(compute_diagnostics(Ck, Fk, params['alpha_s'], params['u_s'],
+                                                      params['qs'], params['Omega_cs'], variables, self.spectrum, self.index_set,
+                                                      self.mode_set))
+                return {name: fields[name] for name in variables}
+            self._snapshot_outputs[variables] = output
+        
+        return self._snapshot_outputs[variables]
+
+    @in_precision
+    def distribution(self, Ck, species, x, y, z, vx, vy, vz, times=slice(None), time_chunk=16, alpha_s=None, u_s=None):
+        """
+        Evaluate the distribution function of one species (see evaluate_distribution) from saved snapshots.
+
+        Ck may be any array-like of snapshots of shape (Nt,) + shape_Ck in the storage of this solver, e.g. the memmapped Ck.npy, HDF5 dataset or zarr array written by run(). Only the selected times
+        are read, time_chunk snapshots at a time, so e.g. a 1D1V movie (y, z, vy and vz of length one) needs
+        memory for time_chunk snapshots of one species and the requested points only.
+        Runs with Hermite_rescaling save the Hermite basis of every snapshot: pass the saved alpha_s and u_s
+        (e.g. from Plotting.load_run), which are read for the same times; otherwise those of self.params are used.
+
+        Parameters:
+        species (int): Index of the species.
+        x, y, z, vx, vy, vz (array-like): 1D coordinates at which f is evaluated.
+        times (slice): Selection of snapshots.
+        time_chunk (int): Number of snapshots contracted at once.
+        alpha_s, u_s (array-like or None): Hermite scalings and shifts of the snapshots, shape (Nt, Ns, 3).
+
+        Returns:
+        numpy.ndarray: f, shape (number of selected times, len(x), len(y), len(z), len(vx), len(vy), len(vz)).
+        """
+        
+        times = range(Ck.shape[0])[times]
+        evaluate = lambda Ck, alpha, u: evaluate_distribution(Ck, alpha, u, self.params['Lx'], self.params['Ly'], self.params['Lz'],
+                                                              x, y, z, vx, vy, vz)
+        
+        f = []
+        for i in range(0, len(times), time_chunk):
+            chunk = times[i:i + time_chunk]
+            selection = slice(chunk.start, chunk.stop if chunk.stop >= 0 else None, chunk.step)
+            Ck_chunk = jnp.asarray(Ck[selection, species])
+            if self.spectrum == 'half':
+                Ck_chunk = full_spectrum(Ck_chunk)
+            if self.index_set is not None:
+                Ck_chunk = expand_Hermite(Ck_chunk, self.index_set, self.Nn, self.Nm, self.Np)
+            if self.mode_set is not None:
+                Ck_chunk = expand_Fourier(Ck_chunk, self.mode_set, (self.Nx, self.Ny, self.Nz))
+            if alpha_s is None and u_s is None:
+                f.append(np.asarray(evaluate(Ck_chunk, self.params['alpha_s'][species], self.params['u_s'][species])))
+            else:
+                alpha, u = [jnp.broadcast_to(jnp.asarray(self.params[name][species] if value is None else value[selection, species]), (len(chunk), 3))
+                            for name, value in (('alpha_s', alpha_s), ('u_s', u_s))]
+                f.append(np.asarray(jax.vmap(evaluate)(Ck_chunk, alpha, u)))
+        
+        return np.concatenate(f)
+
+    @in_precision
+    def solve(self, Ck_Fk_0, t, rtol=1.4e-8, atol=1.4e-8):
+        """
+        Integrate from Ck_Fk_0 over the times t with adaptive Dormand-Prince (jax.experimental.ode.odeint).
+        """
+        
+        Ck_Fk_0, t = jnp.asarray(Ck_Fk_0, dtype=self.complex_dtype), jnp.asarray(t, dtype=float)
+        
+        return odeint(self.rhs, Ck_Fk_0, t, self.params, rtol=rtol, atol=atol)
+
+    @in_precision
+    def solve_adaptive(self, Ck_Fk_0, t, rtol=1.4e-8, atol=1.4e-8, max_steps=10000, params=None):
+        """
+        Integrate like solve(), with the instrumented Dormand-Prince integrator of Integrators.dormand_prince, which
+        also returns the accepted and rejected steps, the step-size trace and the number of right-hand side evaluations.
+
+        Returns:
+        tuple: (states, stats), see Integrators.dormand_prince.
+        """
+        
+        Ck_Fk_0, t = jnp.asarray(Ck_Fk_0, dtype=self.complex_dtype), jnp.asarray(t, dtype=float)
+        
+        return dormand_prince(self.rhs, Ck_Fk_0, t, self.params if params is None else params, rtol, atol, max_steps)
+
+    @in_precision
+    def solve_differentiable(self, Ck_Fk_0, dt, n_steps, save_every=1, params=None, integrator='rk4', output=None,
+                             gradient='checkpoint', memory_budget=None):
+        """
+        Integrate with the fixed-step integrator (see Integrators.make_stepper) in a form that jax.grad can
+        differentiate through with a bounded memory, e.g. to fit nu (through params, see make_params) and the initial
+        perturbation amplitudes (through Ck_Fk_0) to reference data. gradient selects the 'checkpoint' or 'binomial'
+        discrete adjoint or the 'continuous' adjoint, and memory_budget the number of stored states; see
+        Integrators.integrate_adjoint. An output function reducing the snapshots (e.g. snapshot_output(('EM_energy',)))
+        keeps the stored snapshots small.
+
+        Returns:
+        tuple: (Ck_Fk, t, snapshots), see Integrators.integrate.
+        """
+        
+        # One stepper per integrator and dt, so that repeated calls do not recompile.
+        if (integrator, dt) not in self._steppers:
+            self._steppers[integrator, dt] = make_stepper(self, integrator, dt)
+        
+        return integrate_adjoint(self._steppers[integrator, dt], jnp.asarray(Ck_Fk_0, dtype=self.complex_dtype),
+                                 self.params if params is None else params, dt, n_steps, save_every, output=output,
+                                 gradient=gradient, memory_budget=memory_budget, rhs=self.rhs)
+
+    @in_precision
+    def solve_ensemble(self, Ck_Fk_0, t, params, rtol=1.4e-8, atol=1.4e-8):
+        """
+        Integrate all members of an ensemble (params from ensemble_params) in one vmapped, jitted odeint program.
+        Ck_Fk_0 is either a single initial state shared by all members or one state per member (2D array).
+        
+        Returns:
+        jax.Array: States of shape (n_members, len(t), size of Ck_Fk).
+        """
+        
+        Ck_Fk_0, t = jnp.asarray(Ck_Fk_0, dtype=self.complex_dtype), jnp.asarray(t, dtype=float)
+        solve = lambda Ck_Fk_0, params: odeint(self.rhs, Ck_Fk_0, t, params, rtol=rtol, atol=atol)
+        
+        return jax.jit(jax.vmap(solve, in_axes=(0 if Ck_Fk_0.ndim == 2 else None, 0)))(Ck_Fk_0, params)
+
+    def linearized_rhs(self, Ck_Fk_eq, mode):
+        """
+        Right-hand side for perturbations of the single wave vector mode = (kx, ky, kz) (integers, in units of
+        2 * pi / L) about the spatially uniform equilibrium Ck_Fk_eq (all Fourier modes and the tensor Hermite
+        basis, as for from_full_spectrum; only its k = 0 part is used).
+
+        About a uniform equilibrium the Fourier modes evolve independently, so the perturbation is the vector of
+        the Ns * K + 6 coefficients of Ck and Fk at k (K Hermite modes per species), evolved by a solver restricted
+        to the modes (-k, 0, k) (see Fourier_modes). The returned function rhs(delta, params) is affine in delta.
+
+        Returns:
+        tuple: (rhs, size of delta).
+        """
+        
+        solver = VlasovMaxwellSolver(dict(self.parameters, Fourier_modes=[list(mode)], Fourier_activation_threshold=None,
+                                          spectrum='full', sharding=None))
+        k, k0 = solver.mode_set.index(tuple(mode)), solver.mode_set.index((0, 0, 0))
+        Ck_eq, Fk_eq = solver.unpack(solver.from_full_spectrum(Ck_Fk_eq))
+        Ck_eq, Fk_eq = [jnp.zeros_like(F).at[..., k0, :, :].set(F[..., k0, :, :]) for F in (Ck_eq, Fk_eq)]
+        shape_Ck, shape_Fk = solver.shape_Ck[:-3], solver.shape_Fk[:-3]
+        size_Ck = int(np.prod(shape_Ck))
+        
+        def rhs(delta, params):
+            Ck = Ck_eq.at[..., k, 0, 0].add(delta[:size_Ck].reshape(shape_Ck))
+            Fk = Fk_eq.at[..., k, 0, 0].add(delta[size_Ck:].reshape(shape_Fk))
+            dCk_dt, dFk_dt = solver.unpack(solver.ode_system(solver.pack(Ck, Fk), 0.0, params))
+            return jnp.concatenate([dCk_dt[..., k, 0, 0].flatten(), dFk_dt[..., k, 0, 0].flatten()])
+        
+        return rhs, size_Ck + 6
+
+    @in_precision
+    def linear_operator(self, Ck_Fk_eq, mode, params=None):
+        """
+        Matrix of the linearized right-hand side at the wave vector mode (see linearized_rhs), assembled with
+        jax.jacfwd. params may be an ensemble (see ensemble_params), giving one matrix per member.
+
+        Returns:
+        jax.Array: Operator of shape (M, M), or (n_members, M, M), with M = Ns * K + 6.
+        """
+        
+        params = self.params if params is None else params
+        rhs, size = self.linearized_rhs(Ck_Fk_eq, mode)
+        operator = lambda params: jax.jacfwd(rhs, holomorphic=True)(jnp.zeros(size, dtype=self.complex_dtype), params)
+        
+        return jax.jit(jax.vmap(operator) if jnp.ndim(params['nu']) else operator)(params)
+
+    @in_precision
+    def linear_eigenvalues(self, Ck_Fk_eq, mode, params=None, n_eigs=1, method='dense', component=None, null_tol=1e-10, sigma=None):
+        """
+        Least-damped eigenmodes exp(-i * omega * t + gamma * t) of the linearized system at the wave vector mode
+        (see linearized_rhs), e.g. the Landau damping rate of a small-amplitude run, without time stepping.
+
+        method='dense' diagonalizes the assembled linear_operator (best for the usual few hundred unknowns per k);
+        method='arnoldi' runs ARPACK (scipy.sparse.linalg.eigs) on matrix-free Jacobian-vector products for large
+        Hermite bases. ARPACK converges poorly to the eigenvalues of largest gamma, which crowd near the imaginary
+        axis, so with a guess sigma = gamma - i * omega it finds the eigenvalues nearest sigma instead by shift-invert,
+        solving (A - sigma) x = b with GMRES. params may be an ensemble (see ensemble_params), e.g. a sweep over
+        Lx (i.e. k) and nu that gives a whole dispersion curve.
+
+        The spectrum also holds the undamped light waves and the null modes (omega = gamma = 0) of the constraints and
+        invariants, e.g. an Ex inconsistent with the charge density (i k . E != sum_s q_s n_s), a mismatch that the
+        equations conserve, or a Bx violating div B = 0. Being undamped they would outrank every physical mode, so the
+        eigenvalues with |gamma - i omega| <= null_tol times the largest computed one are dropped (and so would be
+        physical modes that slow). With component (an index of (Ex, Ey, Ez, Bx, By, Bz)) only the eigenmodes with a
+        nonzero amplitude in that field are kept, e.g. component=0 for the electrostatic (Langmuir, ion-acoustic)
+        modes of a kx perturbation.
+
+        Returns:
+        tuple: (omega, gamma), real frequencies and growth rates (negative for damping), sorted by decreasing
+               gamma, of shape (n_eigs,) or (n_members, n_eigs) (NaN where fewer modes were found).
+        """
+        
+        params = self.params if params is None else params
+        members = [params] if not jnp.ndim(params['nu']) else [jax.tree_util.tree_map(lambda x: x[i], params)
+                                                                 for i in range(len(params['nu']))]
+        rhs, size = self.linearized_rhs(Ck_Fk_eq, mode)
+        
+        if method == 'dense':
+            operators = np.asarray(self.linear_operator(Ck_Fk_eq, mode, params))
+            eigenpairs = [np.linalg.eig(operator) for operator in operators.reshape((len(members),) + operators.shape[-2:])]
+        elif method == 'arnoldi':
+            from scipy.sparse.linalg import LinearOperator, eigs
+            from jax.scipy.sparse.linalg import gmres
+            jvp = lambda v, params: jax.jvp(lambda delta: rhs(delta, params), (jnp.zeros(size, dtype=self.complex_dtype),), (v,))[1]
+            apply = jax.jit(jvp)
+            solve = jax.jit(lambda b, params: gmres(lambda v: jvp(v, params) - sigma * v, b, tol=1e-12, restart=min(size, 100), maxiter=size)[0])
+            operator = lambda function, member: LinearOperator(
+                (size, size), matvec=lambda v: np.asarray(function(jnp.asarray(v, dtype=self.complex_dtype), member)), dtype=complex)
+            k = n_eigs if component is None else min(size - 2, 3 * n_eigs + 8)
+            eigenpairs = [eigs(operator(apply, member), k=k, which='LR') if sigma is None else
+                          eigs(operator(apply, member), k=k, sigma=sigma, OPinv=operator(solve, member)) for member in members]
+        else:
+            raise ValueError(f"Unknown method '{method}'. Use 'dense' or 'arnoldi'.")
+        
+        omega, gamma = np.full((len(members), n_eigs), np.nan), np.full((len(members), n_eigs), np.nan)
+        for i, (eigenvalues, eigenvectors) in enumerate(eigenpairs):
+            keep = np.abs(eigenvalues) > null_tol * np.abs(eigenvalues).max()
+            if component is not None:
+                keep &= np.abs(eigenvectors[size - 6 + component]) / np.linalg.norm(eigenvectors, axis=0) > 1e-8
+            eigenvalues = eigenvalues[keep]
+            eigenvalues = eigenvalues[np.argsort(-eigenvalues.real)][:n_eigs]
+            omega[i, :len(eigenvalues)], gamma[i, :len(eigenvalues)] = -eigenvalues.imag, eigenvalues.real
+        
+        return (omega, gamma) if jnp.ndim(params['nu']) else (omega[0], gamma[0])
+
+
+# @partial(jax.jit, static_argnums=[7, 8, 9, 10, 11, 12, 13, 14, 15])
+def anti_transform(Ck, Fk, Omega_ce, mi_me, alpha_s, u_s, Lx, Ly, Lz, Nx, Ny, Nz, Nvx, Nvy, Nvz, Nn, Nm, Np):
+    """
+    anti_transform_species for the two species (electrons and ions of mass mi_me) of the original interface,
+    which this keeps: alpha_s and u_s are flat of length 6, and the Hermite coefficients are returned per species.
+
+    Returns:
+    tuple: B, E (Nt, 3, Nx, Ny, Nz), Ce, Ci (Nt, Nn * Nm * Np, Nx, Ny, Nz), plasma_energy and EM_energy (Nt,).
+    """
+    
+    B, E, C, plasma_energy, EM_energy = anti_transform_species(Ck, Fk, Omega_ce, species_masses(2, mi_me), alpha_s, u_s, Lx, Ly, Lz,
+                                                               Nx, Ny, Nz, Nvx, Nvy, Nvz, Nn, Nm, Np)
+    
+    return B, E, C[:, 0], C[:, 1], plasma_energy, EM_energy
+
+
+def anti_transform_species(Ck, Fk, Omega_ce, ms, alpha_s, u_s, Lx, Ly, Lz, Nx, Ny, Nz, Nvx, Nvy, Nvz, Nn, Nm, Np):
+    """
+    Real-space fields and Hermite coefficients of a series of snapshots, with the space-averaged plasma and
+    electromagnetic energies. Ck and Fk hold the physical amplitudes of their Fourier modes, as everywhere in the
+    solver, and are evaluated on the grid by spectrum_to_grid, so the energies equal those of compute_diagnostics.
+
+    Parameters:
+    Ck (jax.Array): Hermite-Fourier coefficients, shape (Nt, Ns * Nn * Nm * Np, Nx, Ny, Nz).
+    Fk (jax.Array): Fourier coefficients of (E, B), shape (Nt, 6, Nx, Ny, Nz).
+    ms (array-like): Masses of the Ns species in units of the electron mass (see species_masses).
+    alpha_s, u_s (array-like): Hermite scaling and shift, shape (Ns, 3) or flat of length 3 * Ns.
+
+    Returns:
+    tuple: B, E (Nt, 3, Nx, Ny, Nz), C (Nt, Ns, Nn * Nm * Np, Nx, Ny, Nz), plasma_energy (the kinetic energy
+           summed over species) and EM_energy (Nt,).
+    """
+    
+    F = spectrum_to_grid(Fk, (Nx, Ny, Nz))
+    E, B = F[:, :3, ...].real, F[:, 3:, ...].real
+        
+    C = spectrum_to_grid(Ck, (Nx, Ny, Nz)).real
+    C = C.reshape(C.shape[0], -1, Nn * Nm * Np, *C.shape[-3:])
+    Ns = C.shape[1]
+    
+    # Energy density of every species, with the snapshots moved behind the Hermite axes of (Ns, Np, Nm, Nn, Nt, x, y, z).
+    C_s = jnp.moveaxis(C.reshape(C.shape[:2] + (Np, Nm, Nn) + C.shape[-3:]), 0, 4)
+    energy_density = kinetic_energy_density(*Hermite_moments(C_s), jnp.reshape(jnp.asarray(alpha_s), (Ns, 3)), jnp.reshape(jnp.asarray(u_s), (Ns, 3)),
+                                            jnp.asarray(ms, dtype=float))
+    
+    plasma_energy = jnp.mean(jnp.sum(energy_density, axis=0), axis=(-3, -2, -1))
+    
+    EM_energy = (jnp.mean((E[:, 0, ...] ** 2 + E[:, 1, ...] ** 2 + E[:, 2, ...] ** 2 + 
+                           B[:, 0, ...] ** 2 + B[:, 1, ...] ** 2 + B[:, 2, ...] ** 2), axis=(-3, -2, -1)) * Omega_ce ** 2 / 2)
+    
+    
+    return B, E, C, plasma_energy, EM_energy
+
+
+def run_stepper(solver, integrator, dt, diagnostics=()):
+    """
+    Stepper of run() and restart(), and the output function of the selected diagnostics (None without any): the
+    INTEGRATOR_STATISTICS among them come from the adaptive steps of 'odeint', the others from the state.
+
+    Returns:
+    tuple: (stepper, diagnostics).
+    """
+    
+    statistics = [name for name in diagnostics if name in INTEGRATOR_STATISTICS]
+    if statistics and integrator != 'odeint':
+        raise ValueError(f"The diagnostics {statistics} require integrator='odeint'.")
+    
+    stepper = (adaptive_stepper(solver, dt, statistics=True, **solver.parameters.get('odeint_options', {})) if statistics else
+               make_stepper(solver, integrator, dt))
+    
+    return stepper, solver.snapshot_output(tuple(name for name in diagnostics if name not in statistics)) if diagnostics else None
+
+
+def run(parameters, Ck_Fk_0, output_dir, variables=('Ck', 'Fk'), chunk_size=100, checkpoint_every=1, diagnostics=()):
+    """
+    Integrate Ck_Fk_0 with the integrator parameters['integrator'] ('odeint' by default, see make_stepper) and step
+    parameters['dt'] up to parameters['t_max'], streaming parameters['t_steps'] snapshots of the selected variables to output_dir
+    (in the format parameters['output_format'], 'npy' by default) and checkpointing to output_dir/checkpoint.npz.
+    Ck_Fk_0 holds all Fourier modes; snapshots and checkpoints are in the storage of parameters['spectrum'] and
+    the precision of parameters['precision'].
+    With 'odeint' each step, of adaptive internal steps, spans one snapshot interval, which is the default dt.
+    The selected DIAGNOSTICS are written after every step to output_dir/diagnostics, in the same format, and so are
+    the selected INTEGRATOR_STATISTICS of the adaptive steps with 'odeint' (see Integrators.adaptive_stepper).
+    With parameters['Hermite_rescaling'] the Hermite bases are adapted before every chunk (see
+    VlasovMaxwellSolver.rescale_basis), and alpha_s and u_s are saved with the snapshots.
+
+    Returns:
+    jax.Array: Final state Ck_Fk (in the storage of parameters['spectrum']).
+    """
+    
+    solver = VlasovMaxwellSolver(parameters)
+    
+    # Number of steps between snapshots so that t_steps snapshots span [0, t_max].
+    integrator, t_max, t_steps = parameters.get('integrator', 'odeint'), parameters['t_max'], parameters['t_steps']
+    dt = parameters['dt'] if 'dt' in parameters or integrator != 'odeint' else t_max / (t_steps - 1)
+    save_every = round(t_max / (t_steps - 1) / dt)
+    
+    stepper, diagnostics_output = run_stepper(solver, integrator, dt, diagnostics)
+    if solver.Hermite_rescaling:
+        variables = tuple(variables) + tuple(name for name in ('alpha_s', 'u_s') if name not in variables)
+    metadata = {'parameters': parameters, 'variables': list(variables), 'chunk_size': chunk_size, 'diagnostics': list(diagnostics)}
+    output_format, n_steps = parameters.get('output_format', 'npy'), (t_steps - 1) * save_every
+    
+    with (solver.precision_scope(), open_writer(output_format, output_dir, t_steps) as writer, 
+          open_writer(output_format, os.path.join(output_dir, 'diagnostics'), n_steps + 1) if diagnostics else nullcontext() as diagnostics_writer):
+        return integrate_chunked(stepper, solver.from_full_spectrum(Ck_Fk_0), solver.params, dt, n_steps, writer, save_every, chunk_size,
+                                 output=solver.snapshot_output(variables), checkpoint_path=os.path.join(output_dir, 'checkpoint.npz'),
+                                 checkpoint_every=checkpoint_every, metadata=metadata,
+                                 diagnostics=diagnostics_output, diagnostics_writer=diagnostics_writer,
+                                 rescale=solver.rescale if solver.Hermite_rescaling else None)
+
+
+def restart(output_dir, t_max=None, checkpoint_every=1):
+    """
+    Resume a run() from output_dir/checkpoint.npz, bit-for-bit, optionally extending it to a later t_max
+    (the step size and save cadence are kept, and the snapshot files are enlarged).
+
+    Returns:
+    jax.Array: Final state Ck_Fk.
+    """
+    
+    checkpoint_path = os.path.join(output_dir, 'checkpoint.npz')
+    checkpoint = load_checkpoint(checkpoint_path)
+    metadata = checkpoint['metadata']
+    parameters = metadata['parameters']
+    save_every, dt = checkpoint['save_every'], checkpoint['dt']
+    
+    if t_max is not None:
+        parameters['t_steps'] = round(t_max / (save_every * dt)) + 1
+        parameters['t_max'] = t_max
+    
+    solver = VlasovMaxwellSolver(parameters)
+    diagnostics = tuple(metadata.get('diagnostics', ()))
+    stepper, diagnostics_output = run_stepper(solver, parameters.get('integrator', 'odeint'), dt, diagnostics)
+    output_format, n_steps = parameters.get('output_format', 'npy'), (parameters['t_steps'] - 1) * save_every
+    
+    with (solver.precision_scope(), open_writer(output_format, output_dir, parameters['t_steps'], mode='a') as writer, 
+          open_writer(output_format, os.path.join(output_dir, 'diagnostics'), n_steps + 1, mode='a') if diagnostics else nullcontext() as diagnostics_writer):
+        return resume_chunked(checkpoint_path, stepper, solver.params, n_steps, writer, metadata['chunk_size'], 
+                              solver.snapshot_output(metadata['variables']), checkpoint_every, metadata,
+                              diagnostics_output, diagnostics_writer,
+                              solver.rescale if solver.Hermite_rescaling else None)
+
+
+def initial_condition(parameters):
+    """
+    Initial state Ck_Fk_0, holding all Fourier modes, of the example selected by parameters['initial_condition']:
+    'Landau_damping_HF_1D' (the default), given directly in Hermite-Fourier space, or 'Landau_damping_1D',
+    projected onto the Hermite basis by initialize_system. The state is built with 64-bit types enabled unless
+    precision='single' (as in VlasovMaxwellSolver.precision_scope), so that it has the complex dtype of
+    parameters['precision'] (see PRECISIONS) whether or not the caller enabled them.
+    """
+    
+    precision = parameters.get('precision', 'double')
+    Lx, Ly, Lz = parameters['Lx'], parameters['Ly'], parameters['Lz']
+    Nx, Ny, Nz = parameters['Nx'], parameters['Ny'], parameters['Nz']
+    Nn, Nm, Np = parameters['Nn'], parameters['Nm'], parameters['Np']
+    name = parameters.get('initial_condition', 'Landau_damping_HF_1D')
+    
+    with jax.enable_x64(precision != 'single'):
+        alpha_s, u_s = jnp.array(parameters['alpha_s']), jnp.array(parameters['u_s'])
+        if name == 'Landau_damping_HF_1D':
+            Ck_0, Fk_0 = Landau_damping_HF_1D(Lx, parameters['Omega_ce'], alpha_s[0], alpha_s[3], Nn)
+        elif name == 'Landau_damping_1D':
+            Ck_0, Fk_0 = initialize_system(parameters['Omega_ce'], parameters['mi_me'], alpha_s, u_s, Lx, Ly, Lz, Nx, Ny, Nz,
+                                           Nn, Nm, Np, memory_budget=parameters.get('memory_budget'))
+        else:
+            raise ValueError(f"Unknown initial condition '{name}'.")
+        
+        return jnp.concatenate([Ck_0.flatten(), Fk_0.flatten()]).astype(PRECISIONS[precision][1])
+
+
+def main(argv=None):
+    """
+    Headless entry point: integrate the initial_condition of a plasma_parameters*.json file and write the
+    snapshots, diagnostics, checkpoint and a copy of the parameters into an output directory. Figures are made
+    afterwards, from the output directory, by Plotting.py.
+    """
+    
+    parser = argparse.ArgumentParser(description='Run a Vlasov-Maxwell simulation without plotting.')
+    parser.add_argument('config', nargs='?', help='plasma_parameters*.json file (not needed with --restart).')
+    parser.add_argument('output_dir', help='Directory of the snapshots, diagnostics and checkpoint.')
+    parser.add_argument('--variables', nargs='+', default=['Ck', 'Fk'], help='Saved variables, see snapshot_output.')
+    parser.add_argument('--diagnostics', nargs='*', default=[], choices=DIAGNOSTICS + INTEGRATOR_STATISTICS,
+                        help='Diagnostics saved after every step (the statistics of the adaptive steps with odeint).')
+    parser.add_argument('--chunk-size', type=int, default=100, help='Snapshots held in memory between writes.')
+    parser.add_argument('--checkpoint-every', type=int, default=1, help='Chunks between checkpoints.')
+    parser.add_argument('--t-max', type=float, help='Override t_max (or extend the run with --restart).')
+    parser.add_argument('--restart', action='store_true', help='Resume the run in output_dir from its checkpoint.')
+    parser.add_argument('--compilation-cache-dir', default=DEFAULT_CACHE_DIR,
+                        help='Directory of the persistent compilation cache (default: %(default)s).')
+    parser.add_argument('--no-compilation-cache', action='store_true', help='Leave the compilation cache unset.')
+    args = parser.parse_args(argv)
+    
+    if not args.no_compilation_cache:
+        enable_compilation_cache(args.compilation_cache_dir)
+    if args.restart:
+        restart(args.output_dir, args.t_max, args.checkpoint_every)
+        print(f"Resumed the run in {args.output_dir}.")
+        return
+    if args.config is None:
+        parser.error('config is required unless --restart is given.')
+    
+    with open(args.config, 'r') as file:
+        parameters = json.load(file)
+    if args.t_max is not None:
+        parameters['t_max'] = args.t_max
+    
+    os.makedirs(args.output_dir, exist_ok=True)
+    with open(os.path.join(args.output_dir, 'parameters.json'), 'w') as file:
+        json.dump(parameters, file, indent=4)
+    
+    Ck_Fk_0 = initial_condition(parameters)
+    run(parameters, Ck_Fk_0, args.output_dir, args.variables, args.chunk_size, args.checkpoint_every, args.diagnostics)
+    
+    print(f"Wrote {parameters['t_steps']} snapshots to {args.output_dir}.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,196 @@
+"""
+On-disk snapshot writers for Integrators.integrate_chunked, and checkpoint files for restarts.
+
+Every writer receives chunks of snapshots through write(index, t, snapshots), where snapshots is a dictionary
+of arrays whose first axis runs over the snapshots of the chunk, and stores them in preallocated arrays of
+n_snapshots entries (allocated on the first write). With mode='a' the arrays of a previous run are reopened,
+and enlarged if n_snapshots grew, so that a restarted run keeps writing into the same files. HDF5 and zarr
+are optional dependencies and are only imported when the corresponding writer is created.
+"""
+
+import os
+import json
+import numpy as np
+
+
+class NpyWriter:
+    """
+    Write each variable into its own .npy file in directory (t.npy for the times), filled through a memmap.
+    The files can be read back lazily with np.load(path, mmap_mode='r').
+    """
+
+    def __init__(self, directory, n_snapshots, mode='w'):
+        self.directory = directory
+        self.n_snapshots = n_snapshots
+        self.mode = mode
+        self.arrays = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _array(self, name, chunk):
+        if name not in self.arrays:
+            path = os.path.join(self.directory, name + '.npy')
+            shape = (self.n_snapshots,) + chunk.shape[1:]
+            if self.mode == 'a' and os.path.exists(path):
+                old = np.load(path, mmap_mode='r')
+                if len(old) < self.n_snapshots:
+                    # Enlarge the file: copy the existing snapshots into a new file and swap it in atomically.
+                    new = np.lib.format.open_memmap(path + '.tmp', mode='w+', dtype=old.dtype, shape=shape)
+                    new[:len(old)] = old
+                    new.flush()
+                    del new, old
+                    os.replace(path + '.tmp', path)
+                self.arrays[name] = np.lib.format.open_memmap(path, mode='r+')
+            else:
+                self.arrays[name] = np.lib.format.open_memmap(path, mode='w+', dtype=chunk.dtype, shape=shape)
+        return self.arrays[name]
+
+    def write(self, index, t, snapshots):
+        for name, chunk in dict(snapshots, t=t).items():
+            chunk = np.asarray(chunk)
+            self._array(name, chunk)[index:index + len(chunk)] = chunk
+
+    def flush(self):
+        for array in self.arrays.values():
+            array.flush()
+
+    def close(self):
+        self.flush()
+        self.arrays = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class HDF5Writer(NpyWriter):
+    """
+    Write each variable into a resizable dataset of the HDF5 file path (requires h5py).
+    """
+
+    def __init__(self, path, n_snapshots, mode='w'):
+        import h5py
+        self.file = h5py.File(path, mode)
+        self.n_snapshots = n_snapshots
+        self.arrays = {}
+
+    def _array(self, name, chunk):
+        if name not in self.arrays:
+            if name in self.file:
+                self.arrays[name] = self.file[name]
+                if self.arrays[name].shape[0] < self.n_snapshots:
+                    self.arrays[name].resize(self.n_snapshots, axis=0)
+            else:
+                self.arrays[name] = self.file.create_dataset(name, shape=(self.n_snapshots,) + chunk.shape[1:], dtype=chunk.dtype,
+                                                             maxshape=(None,) + chunk.shape[1:],
+                                                             chunks=(min(len(chunk), self.n_snapshots),) + chunk.shape[1:])
+        return self.arrays[name]
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+        self.arrays = {}
+
+
+class ZarrWriter(NpyWriter):
+    """
+    Write each variable into an array of the zarr group at path (requires zarr).
+    """
+
+    def __init__(self, path, n_snapshots, mode='w'):
+        import zarr
+        self.group = zarr.open_group(path, mode=mode)
+        self.n_snapshots = n_snapshots
+        self.arrays = {}
+
+    def _array(self, name, chunk):
+        if name not in self.arrays:
+            if name in self.group:
+                self.arrays[name] = self.group[name]
+                if self.arrays[name].shape[0] < self.n_snapshots:
+                    self.arrays[name].resize((self.n_snapshots,) + chunk.shape[1:])
+            else:
+                self.arrays[name] = self.group.zeros(name=name, shape=(self.n_snapshots,) + chunk.shape[1:], dtype=chunk.dtype,
+                                                     chunks=(min(len(chunk), self.n_snapshots),) + chunk.shape[1:])
+        return self.arrays[name]
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.arrays = {}
+
+
+# Writers selectable by name, e.g. from the 'output_format' key of the parameter JSON.
+WRITERS = {'npy': NpyWriter, 'hdf5': HDF5Writer, 'zarr': ZarrWriter}
+
+
+def open_writer(output_format, output_dir, n_snapshots, mode='w'):
+    """
+    Open the writer of the given format for a run stored in output_dir: the .npy files go directly into
+    output_dir, the HDF5 file and zarr group are output_dir/snapshots.h5 and output_dir/snapshots.zarr.
+    """
+
+    os.makedirs(output_dir, exist_ok=True)
+    path = {'npy': output_dir, 'hdf5': os.path.join(output_dir, 'snapshots.h5'),
+            'zarr': os.path.join(output_dir, 'snapshots.zarr')}[output_format]
+
+    return WRITERS[output_format](path, n_snapshots, mode)
+
+
+def open_snapshots(output_format, output_dir):
+    """
+    Reopen the snapshots written by open_writer for reading: a dictionary of the stored variables (and t), as
+    memmapped .npy arrays, HDF5 datasets or zarr arrays, so that only the snapshots that are indexed are read.
+    """
+
+    if output_format == 'npy':
+        return {name[:-4]: np.load(os.path.join(output_dir, name), mmap_mode='r')
+                for name in sorted(os.listdir(output_dir)) if name.endswith('.npy')}
+    elif output_format == 'hdf5':
+        import h5py
+        return dict(h5py.File(os.path.join(output_dir, 'snapshots.h5'), 'r'))
+    elif output_format == 'zarr':
+        import zarr
+        return dict(zarr.open_group(os.path.join(output_dir, 'snapshots.zarr'), mode='r').arrays())
+    else:
+        raise ValueError(f"Unknown output format '{output_format}'.")
+
+
+def save_checkpoint(path, Ck_Fk, index, t0, dt, save_every, metadata=None, params=None):
+    """
+    Atomically write a checkpoint: the state Ck_Fk after index saved snapshots of a run started at t0 with
+    step dt and save cadence save_every, plus a JSON-serializable metadata dictionary (e.g. the parameters) and
+    optionally a dictionary of arrays params (e.g. VlasovMaxwellSolver.params, when they evolve during the run).
+
+    The checkpoint is written to a temporary file, synced to disk and then renamed over path, so that path
+    always holds either the previous or the new complete checkpoint.
+    """
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        np.savez(file, Ck_Fk=np.asarray(Ck_Fk), index=index, t0=t0, dt=dt, save_every=save_every,
+                 t=t0 + index * save_every * dt, metadata=json.dumps(metadata or {}),
+                 **{'params/' + name: np.asarray(value) for name, value in (params or {}).items()})
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path):
+    """
+    Read a checkpoint written by save_checkpoint.
+
+    Returns:
+    dict: Ck_Fk (numpy array), index, save_every (int), t0, dt, t (float), metadata (dict) and params (dict of
+          numpy arrays, or None if the checkpoint holds none).
+    """
+
+    with np.load(path) as data:
+        params = {name[len('params/'):]: data[name] for name in data.files if name.startswith('params/')}
+        return {'Ck_Fk': data['Ck_Fk'], 'index': int(data['index']), 'save_every': int(data['save_every']),
+                't0': float(data['t0']), 'dt': float(data['dt']), 't': float(data['t']),
+                'metadata': json.loads(str(data['metadata'])), 'params': params or None}
@@ -0,0 +1,242 @@
+"""
+Post-processing of a run written by the headless runner of JAX_VM_solver, e.g.
+
+    python JAX_VM_solver.py plasma_parameters_Landau_damping_HF_1D.json run
+    python Plotting.py run
+
+The snapshots (which must include Ck and Fk) are read back from the output directory, transformed to real space
+with anti_transform_species, and the figures of the fields, Hermite coefficients and energies are saved into
+output_dir/figures (or shown with --show). matplotlib is only needed here.
+"""
+
+import os
+import json
+import argparse
+import numpy as np
+import jax
+import jax.numpy as jnp
+import matplotlib.pyplot as plt
+from Output import open_snapshots, load_checkpoint
+
+
+def moving_average(data, window_size):
+    """
+    Compute the moving average using NumPy's convolution function.
+
+    Parameters:
+    data (list or array-like): The input data.
+    window_size (int): The number of data points to include in each average.
+
+    Returns:
+    numpy.ndarray: An array containing the moving averages.
+    """
+
+    data_array = np.array(data)
+    kernel = np.ones(window_size) / window_size
+    return np.convolve(data_array, kernel, mode='valid')
+
+
+def load_run(output_dir):
+    """
+    Read the parameters and snapshots of a run: the parameters of the checkpoint (which follow a restart that
+    extended the run), or of output_dir/parameters.json for runs without checkpoint.
+
+    Returns:
+    tuple: parameters (dict), t (Nt,), Ck (Nt, Ns * Nn * Nm * Np, Nx, Ny, Nz) and Fk (Nt, 6, Nx, Ny, Nz), with all
+           Hermite and Fourier modes, and the Hermite bases alpha_s, u_s (Nt, Ns, 3) of every snapshot (which vary
+           with Hermite_rescaling).
+    """
+
+    from JAX_VM_solver import VlasovMaxwellSolver
+
+    checkpoint_path = os.path.join(output_dir, 'checkpoint.npz')
+    if os.path.exists(checkpoint_path):
+        parameters = load_checkpoint(checkpoint_path)['metadata']['parameters']
+    else:
+        with open(os.path.join(output_dir, 'parameters.json'), 'r') as file:
+            parameters = json.load(file)
+
+    snapshots = open_snapshots(parameters.get('output_format', 'npy'), output_dir)
+    t, Nt = np.asarray(snapshots['t']), len(snapshots['t'])
+    Nx, Ny, Nz, Ns = parameters['Nx'], parameters['Ny'], parameters['Nz'], parameters['Ns']
+    alpha_s, u_s = [np.broadcast_to(snapshots[name][:] if name in snapshots else np.reshape(parameters[name], (Ns, 3)), (Nt, Ns, 3))
+                    for name in ('alpha_s', 'u_s')]
+
+    solver = VlasovMaxwellSolver(parameters)
+    with solver.precision_scope():
+        Ck_Fk = jnp.concatenate([jnp.asarray(snapshots['Ck'][:]).reshape(Nt, -1), jnp.asarray(snapshots['Fk'][:]).reshape(Nt, -1)], axis=1)
+        Ck_Fk = jax.vmap(solver.to_full_spectrum)(Ck_Fk)
+
+    Ck = Ck_Fk[:, :(-6 * Nx * Ny * Nz)].reshape(Nt, -1, Nx, Ny, Nz)
+    Fk = Ck_Fk[:, (-6 * Nx * Ny * Nz):].reshape(Nt, 6, Nx, Ny, Nz)
+
+    return parameters, t, Ck, Fk, alpha_s, u_s
+
+
+def plot_fields(t, E, B):
+    """
+    Root-mean-square of the components of E and B vs. time.
+    """
+
+    fig, axes = plt.subplots(1, 2, figsize=(12, 5))
+    for ax, F, name in zip(axes, (E, B), 'EB'):
+        for i, (component, linestyle) in enumerate(zip('xyz', ('-', '--', '-.'))):
+            ax.plot(t, np.sqrt(np.mean(F[:, i] ** 2, axis=(-3, -2, -1))), label=f'${name}_{{{component},rms}}$', linestyle=linestyle)
+        ax.set_xlabel(r'$t\omega_{pe}$')
+        ax.set_ylabel(f'${name}_{{rms}}$')
+        ax.legend()
+
+    return fig
+
+
+def plot_profiles(t, x, C, E, qs, alpha_s, title, n_times=4):
+    """
+    C_0 of every species, charge density and E_x along x (at y = z = 0) at n_times evenly spaced snapshots,
+    with the Hermite scalings alpha_s (Nt, Ns, 3) of the snapshots.
+    """
+
+    Ns = C.shape[1]
+    charge_density = np.einsum('s,ts,ts...->t...', np.asarray(qs), np.prod(alpha_s, axis=-1), C[:, :, 0])
+    times = np.linspace(0, len(t) - 1, n_times).astype(int)
+
+    fig, axes = plt.subplots(1, Ns + 2, figsize=(5 * (Ns + 2), 5))
+    profiles = [(C[:, s, 0], rf'$C_{{{s},0}}$') for s in range(Ns)] + [(charge_density, 'Charge density'), (E[:, 0], r'$E_x$')]
+    for ax, (profile, label) in zip(axes, profiles):
+        for i in times:
+            ax.plot(x, profile[i, :, 0, 0], label=rf'$t\omega_{{pe}} = {t[i]:.3g}$')
+        ax.set_xlabel(r'$x/d_e$')
+        ax.set_ylabel(label)
+        ax.set_title(title)
+        ax.legend()
+
+    return fig
+
+
+def plot_energy(t, plasma_energy, EM_energy, title, window_size=101):
+    """
+    Plasma, electromagnetic and total energies vs. time, with the moving average of the electromagnetic energy.
+    """
+
+    fig, ax = plt.subplots(figsize=(8, 6))
+    ax.plot(t, plasma_energy - plasma_energy[0], label='Plasma energy (change)', color='red')
+    ax.plot(t, EM_energy, label='EM energy', color='blue')
+    ax.plot(t, plasma_energy + EM_energy - plasma_energy[0], label='Total energy (change)', color='green')
+    if len(t) > window_size:
+        ax.plot(t[window_size // 2:len(t) - window_size // 2], moving_average(EM_energy, window_size),
+                label='mov_avg(EM energy)', color='black')
+    ax.set_xlabel(r'$t\omega_{pe}$')
+    ax.set_ylabel('Energy')
+    ax.set_title(title)
+    ax.legend()
+
+    return fig
+
+
+def plot_Hermite_spectrum(t, C, alpha_s, title):
+    """
+    log10 of the space-averaged <|C_{s,n}|^2> (without the Maxwellian background of n = 0) vs. n and time,
+    for every species, with the Hermite scalings alpha_s (Nt, Ns, 3) of the snapshots.
+    """
+
+    Ns = C.shape[1]
+    C = C.copy()
+    C[:, :, 0] -= 1 / np.prod(alpha_s, axis=-1)[:, :, None, None, None]
+    spectrum = np.mean(np.abs(C) ** 2, axis=(-3, -2, -1))
+
+    fig, axes = plt.subplots(1, Ns, figsize=(6 * Ns, 5), squeeze=False)
+    for s, ax in enumerate(axes[0]):
+        image = ax.imshow(np.log10(spectrum[:, s] + np.finfo(float).tiny), aspect='auto', cmap='viridis', interpolation='none',
+                          origin='lower', extent=(0, C.shape[2], t[0], t[-1]))
+        fig.colorbar(image, ax=ax, label=rf'$log_{{10}}(\langle |C_{{{s},n}}|^2\rangle (t))$')
+        ax.set_xlabel('n')
+        ax.set_ylabel('t')
+        ax.set_title(title)
+
+    return fig
+
+
+def plot_Hermite_basis(t, alpha_s, u_s):
+    """
+    Hermite scaling and shift of every species and velocity axis vs. time (with Hermite_rescaling).
+    """
+
+    fig, axes = plt.subplots(1, 2, figsize=(12, 5))
+    for ax, values, name in zip(axes, (alpha_s, u_s), (r'$\alpha_s$', r'$u_s$')):
+        for s in range(values.shape[1]):
+            for i, (component, linestyle) in enumerate(zip('xyz', ('-', '--', '-.'))):
+                ax.plot(t, values[:, s, i], label=f'$s = {s}, {component}$', linestyle=linestyle)
+        ax.set_xlabel(r'$t\omega_{pe}$')
+        ax.set_ylabel(name)
+        ax.legend()
+
+    return fig
+
+
+def plot_diagnostics(diagnostics):
+    """
+    Per-step diagnostics saved by run() (see DIAGNOSTICS), one panel for each scalar or per-species series.
+    """
+
+    names = [name for name, values in diagnostics.items() if name != 't' and values.ndim <= 2]
+    fig, axes = plt.subplots(1, len(names), figsize=(6 * len(names), 5), squeeze=False)
+    t = np.asarray(diagnostics['t'])
+    for ax, name in zip(axes[0], names):
+        values = np.asarray(diagnostics[name])
+        ax.plot(t, values.reshape(len(t), -1))
+        ax.set_xlabel(r'$t\omega_{pe}$')
+        ax.set_ylabel(name)
+
+    return fig
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('output_dir', help='Output directory of the run.')
+    parser.add_argument('--figures-dir', default=None, help='Directory of the figures (default: output_dir/figures).')
+    parser.add_argument('--format', default='png', help='File format of the figures.')
+    parser.add_argument('--show', action='store_true', help='Show the figures instead of only saving them.')
+    args = parser.parse_args()
+
+    if not args.show:
+        plt.switch_backend('Agg')
+
+    from JAX_VM_solver import anti_transform_species, species_masses
+
+    with jax.enable_x64(True):
+        parameters, t, Ck, Fk, alpha_s, u_s = load_run(args.output_dir)
+        Nx, Ny, Nz = parameters['Nx'], parameters['Ny'], parameters['Nz']
+        Nn, Nm, Np, Ns = parameters['Nn'], parameters['Nm'], parameters['Np'], parameters['Ns']
+        
+        # One snapshot at a time, each in its own Hermite basis.
+        transform = lambda Ck, Fk, alpha, u: anti_transform_species(
+            Ck[None], Fk[None], parameters['Omega_ce'], species_masses(Ns, parameters['mi_me'], parameters.get('ms')), alpha, u,
+            parameters['Lx'], parameters['Ly'], parameters['Lz'], Nx, Ny, Nz, parameters['Nvx'], parameters['Nvy'], parameters['Nvz'],
+            Nn, Nm, Np)
+        B, E, C, plasma_energy, EM_energy = (np.asarray(array)[:, 0] for array in jax.vmap(transform)(Ck, Fk, alpha_s, u_s))
+
+    x = np.linspace(0, parameters['Lx'], Nx, endpoint=False)
+    title = rf"$\nu = {parameters['nu']}, L_x = {parameters['Lx']}, N_x = {Nx}, N_n = {Nn}$"
+    figures = {'fields': plot_fields(t, E, B),
+               'profiles': plot_profiles(t, x, C, E, parameters['qs'], alpha_s, title),
+               'energy': plot_energy(t, plasma_energy, EM_energy, title),
+               'Hermite_spectrum': plot_Hermite_spectrum(t, C, alpha_s, title)}
+    if parameters.get('Hermite_rescaling'):
+        figures['Hermite_basis'] = plot_Hermite_basis(t, alpha_s, u_s)
+
+    diagnostics_dir = os.path.join(args.output_dir, 'diagnostics')
+    if os.path.isdir(diagnostics_dir):
+        figures['diagnostics'] = plot_diagnostics(open_snapshots(parameters.get('output_format', 'npy'), diagnostics_dir))
+
+    figures_dir = args.figures_dir or os.path.join(args.output_dir, 'figures')
+    os.makedirs(figures_dir, exist_ok=True)
+    for name, fig in figures.items():
+        fig.tight_layout()
+        fig.savefig(os.path.join(figures_dir, f'{name}.{args.format}'))
+    print(f"Saved {len(figures)} figures to {figures_dir}.")
+
+    if args.show:
+        plt.show()
+
+
+if __name__ == '__main__':
+    main()
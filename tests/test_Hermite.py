@@ -0,0 +1,54 @@
+import os
+import json
+import numpy as np
+import jax
+import jax.numpy as jnp
+import pytest
+import JAX_VM_solver as S
+
+PARAMETERS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'plasma_parameters_Landau_damping_HF_1D.json')
+
+
+@pytest.fixture
+def parameters():
+    with open(PARAMETERS) as file:
+        return dict(json.load(file), Nn=3, Nm=3, Np=1)
+
+
+@pytest.mark.parametrize('indices, message', [([], 'empty'), ([[0, 0, 0], [0, 0, 0]], 'repeated'),
+                                              ([[0, 0, 0], [1, 0, 0], [3, 0, 0]], 'outside'), ([[0, 0, 0], [0, 0, 1]], 'outside'),
+                                              ([[0, 0, 0], [2, 0, 0]], 'downward closed'), ([[0, 0, 0], [1, 0, 0], [1, 1, 0]], 'downward closed')])
+def test_invalid_Hermite_indices_are_rejected(parameters, indices, message):
+    with pytest.raises(ValueError, match=message):
+        S.VlasovMaxwellSolver(dict(parameters, Hermite_indices=indices))
+
+
+def test_downward_closed_Hermite_indices_are_accepted(parameters):
+    indices = [[1, 1, 0], [0, 0, 0], [1, 0, 0], [0, 1, 0], [2, 0, 0]]
+    assert S.VlasovMaxwellSolver(dict(parameters, Hermite_indices=indices)).index_set == ((0, 0, 0), (1, 0, 0), (2, 0, 0), (0, 1, 0), (1, 1, 0))
+    for truncation in ('tensor', 'total_degree', 'hyperbolic_cross'):
+        S.check_Hermite_index_set(S.Hermite_index_set(4, 3, 2, truncation), 4, 3, 2)
+
+
+def test_Hermite_recurrence_matches_the_power_series():
+    x = np.linspace(-3, 3, 13)
+    with jax.enable_x64(True):
+        h = S.Hermite_recurrence(12, jnp.asarray(x))
+        for n in range(12):
+            H_n = np.polynomial.hermite.hermval(x, np.eye(12)[n])
+            np.testing.assert_allclose(h[n] * np.sqrt(2.0 ** n * np.prod(np.arange(1, n + 1))), H_n, rtol=1e-11, atol=1e-11)
+            np.testing.assert_allclose(S.Hermite(n, jnp.asarray(x)), H_n, rtol=1e-11, atol=1e-11)
+            np.testing.assert_allclose(S.normalized_Hermite(n, jnp.asarray(x)), h[n], rtol=1e-13, atol=1e-13)
+
+
+def test_Hermite_tables_are_orthonormal_at_high_order():
+    # 200 orders on the 250 Gauss-Hermite nodes, |x| up to ~21: H_199 alone would overflow float64.
+    x, w = np.polynomial.hermite.hermgauss(250)
+    with jax.enable_x64(True):
+        h, psi = S.Hermite_tables(x, 1.0, 0.0, 200)
+        np.testing.assert_allclose(np.asarray(h) * np.exp(np.log(w) + x ** 2) @ np.asarray(psi).T, np.eye(200), atol=1e-10)
+        
+        # The traced tables, used when alpha and u are differentiated, agree with the cached ones.
+        h_traced, psi_traced = jax.jit(S.Hermite_tables, static_argnums=3)(x, 1.0, 0.0, 200)
+        np.testing.assert_allclose(h_traced, h, rtol=1e-10, atol=1e-10 * np.abs(h).max())
+        np.testing.assert_allclose(psi_traced, psi, rtol=1e-10, atol=1e-14)
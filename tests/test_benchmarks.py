@@ -0,0 +1,36 @@
+import copy
+import json
+import numpy as np
+import Benchmarks as B
+
+
+def test_benchmarks_run_and_compare():
+    with open(B.DEFAULT_PARAMETERS) as file:
+        parameters = dict(json.load(file), Nn=6)
+    results = B.run_benchmarks(parameters, sweeps={'Nn': [6], 'Ns': [3], 'precision': ['single']}, repeats=1, isolate=False)
+
+    # Nn=6 is the base value, so it adds no case.
+    assert list(results['results']) == ['base', 'Ns=3', 'precision=single']
+    assert results['results']['Ns=3']['Ns'] == 3 and results['results']['precision=single']['precision'] == 'single'
+    for result in results['results'].values():
+        assert set(result['kernels']) == set(B.KERNELS)
+        assert all(timings['time'] > 0 for timings in result['kernels'].values())
+    json.dumps(results)
+
+    # Against itself every ratio is 1; a baseline twice as fast flags every timed kernel.
+    ratios, regressions = B.compare(results, results)
+    assert ratios and not regressions and np.allclose([ratio[-1] for ratio in ratios], 1)
+    faster = copy.deepcopy(results)
+    for result in faster['results'].values():
+        for timings in result['kernels'].values():
+            timings['time'] /= 2
+    regressions = B.compare(results, faster)[1]
+    assert {(case, kernel) for case, kernel, metric, *_ in regressions if metric == 'time'} == \
+           {(case, kernel) for case in results['results'] for kernel in B.KERNELS}
+
+
+def test_species_parameters_repeat_the_last_species():
+    parameters = {'Ns': 2, 'qs': [-1, 1], 'alpha_s': [0.5] * 3 + [0.05] * 3, 'u_s': [0.0] * 6}
+    three = B.species_parameters(parameters, 3)
+    assert three['Ns'] == 3 and three['qs'] == [-1, 1, 1] and three['alpha_s'] == [0.5] * 3 + [0.05] * 6
+    assert B.species_parameters(parameters, 1)['qs'] == [-1]
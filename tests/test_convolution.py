@@ -0,0 +1,45 @@
+import os
+import json
+import numpy as np
+import jax
+import jax.numpy as jnp
+import pytest
+from jax.scipy.signal import convolve
+import JAX_VM_solver as S
+
+PARAMETERS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'plasma_parameters_Landau_damping_HF_1D.json')
+
+
+def random_spectrum(key, shape):
+    real, imag = jax.random.normal(key, (2,) + shape)
+    return real + 1j * imag
+
+
+@pytest.mark.parametrize('N', [(4, 1, 1), (6, 4, 1), (8, 3, 2), (5, 3, 1)])
+def test_pseudospectral_matches_direct_convolution(N):
+    with jax.enable_x64(True):
+        Fk, Ck = random_spectrum(jax.random.key(0), N), random_spectrum(jax.random.key(1), N)
+        np.testing.assert_allclose(S.convolve_pseudospectral(Fk, Ck), convolve(Fk, Ck, mode='same'), atol=1e-12)
+
+
+@pytest.mark.parametrize('Nx', [4, 6, 8, 9])
+def test_pseudospectral_rhs_matches_direct_rhs(Nx):
+    with open(PARAMETERS) as file:
+        parameters = dict(json.load(file), Nx=Nx, Nn=6)
+    with jax.enable_x64(True):
+        direct, pseudospectral = [S.VlasovMaxwellSolver(dict(parameters, convolution=convolution))
+                                  for convolution in ('direct', 'pseudospectral')]
+        Ck_Fk = random_spectrum(jax.random.key(0), (direct.size_Ck + 6 * Nx,))
+        np.testing.assert_allclose(pseudospectral.rhs(Ck_Fk, 0.0, pseudospectral.params), direct.rhs(Ck_Fk, 0.0, direct.params),
+                                   atol=1e-10)
+
+
+@pytest.mark.parametrize('N', [4, 5])
+def test_centered_modes_agree(N):
+    # k = 0 sits where wave_vector_grids puts it, and Fourier_matrix evaluates the same modes as the inverse FFT.
+    kx, _, _ = S.wave_vector_grids(N, 1, 1)
+    assert kx[S.zero_mode((N, 1, 1))[0], 0, 0] == 0
+    with jax.enable_x64(True):
+        Ck = random_spectrum(jax.random.key(0), (N, 1, 1))
+        x = jnp.arange(N) / N
+        np.testing.assert_allclose(S.Fourier_matrix(N, 1.0, x) @ Ck[:, 0, 0], S.spectrum_to_grid(Ck, (N, 1, 1))[:, 0, 0], atol=1e-12)
@@ -0,0 +1,72 @@
+import os
+import json
+import numpy as np
+import jax
+import jax.numpy as jnp
+import JAX_VM_solver as S
+
+PARAMETERS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'plasma_parameters_Landau_damping_HF_1D.json')
+
+
+def test_diagnostics_agree_with_anti_transform():
+    # The energies in Fourier-Hermite space and on the real-space grid of anti_transform.
+    with open(PARAMETERS) as file:
+        parameters = json.load(file)
+    solver = S.VlasovMaxwellSolver(parameters)
+    Nx, Ny, Nz, Nn, Nm, Np = (parameters[name] for name in ('Nx', 'Ny', 'Nz', 'Nn', 'Nm', 'Np'))
+    with jax.enable_x64(True):
+        Ck_Fk = S.initial_condition(parameters)
+        diagnostics = {name: np.asarray(value) for name, value in solver.snapshot_output(('kinetic_energy', 'EM_energy'))(Ck_Fk).items()}
+        Ck, Fk = Ck_Fk[:-6 * Nx * Ny * Nz].reshape(1, -1, Nx, Ny, Nz), Ck_Fk[-6 * Nx * Ny * Nz:].reshape(1, 6, Nx, Ny, Nz)
+        ms = S.species_masses(parameters['Ns'], parameters['mi_me'])
+        B, E, C, plasma_energy, EM_energy = S.anti_transform_species(Ck, Fk, parameters['Omega_ce'], ms, parameters['alpha_s'],
+                                                                     parameters['u_s'], parameters['Lx'], parameters['Ly'], parameters['Lz'],
+                                                                     Nx, Ny, Nz, parameters['Nvx'], parameters['Nvy'], parameters['Nvz'], Nn, Nm, Np)
+        # The two-species interface, with the mass ratio instead of the masses.
+        legacy = S.anti_transform(Ck, Fk, parameters['Omega_ce'], parameters['mi_me'], parameters['alpha_s'], parameters['u_s'],
+                                  parameters['Lx'], parameters['Ly'], parameters['Lz'], Nx, Ny, Nz, parameters['Nvx'], parameters['Nvy'],
+                                  parameters['Nvz'], Nn, Nm, Np)
+
+    np.testing.assert_allclose(EM_energy[0], diagnostics['EM_energy'], rtol=1e-10)
+    np.testing.assert_allclose(plasma_energy[0], np.sum(diagnostics['kinetic_energy']), rtol=1e-10)
+    for value, reference in zip(legacy, (B, E, C[:, 0], C[:, 1], plasma_energy, EM_energy)):
+        np.testing.assert_array_equal(value, reference)
+
+
+def test_projected_initial_condition_has_physical_amplitudes():
+    # Landau_damping_1D: n_e = 1 + dn sin(kx x), Ex = dn / kx cos(kx x) and Bx = Omega_ce, with dn = 0.01.
+    with open(PARAMETERS) as file:
+        parameters = dict(json.load(file), initial_condition='Landau_damping_1D', Nx=8)
+    Nx, Nn = parameters['Nx'], parameters['Nn']
+    kx, dn, k0 = 2 * np.pi / parameters['Lx'], 0.01, (parameters['Nx'] - 1) // 2
+    with jax.enable_x64(True):
+        Ck_Fk = np.asarray(S.initial_condition(parameters))
+    Ck, Fk = Ck_Fk[:-6 * Nx].reshape(2, Nn, Nx), Ck_Fk[-6 * Nx:].reshape(6, Nx)
+    alpha_s = np.reshape(parameters['alpha_s'], (2, 3))
+
+    density = np.prod(alpha_s, axis=1)[:, None] * Ck[:, 0]
+    np.testing.assert_allclose(density[:, k0], [1, 1], rtol=1e-8)
+    np.testing.assert_allclose(density[0, k0 + 1], -0.5j * dn, rtol=1e-6)
+    np.testing.assert_allclose(Fk[0, k0 + 1], dn / (2 * kx), rtol=1e-8)
+    np.testing.assert_allclose(Fk[3, k0], parameters['Omega_ce'], rtol=1e-12)
+
+
+def test_moments_of_a_drifting_Maxwellian():
+    # Density 1 + 0.1 sin(x), flow U and thermal speeds a, in a basis alpha, u that does not match them: momentum U
+    # and kinetic energy (|U|^2 + |a|^2 / 2) / 2 (in units of the mass of the first, and here only, species).
+    alpha, u, a, U = np.array([0.5, 0.6, 0.7]), np.array([0.1, 0.0, -0.1]), np.array([0.45, 0.65, 0.6]), np.array([0.3, -0.1, 0.0])
+    f = lambda x, y, z, vx, vy, vz: ((1 + 0.1 * jnp.sin(x)) * jnp.exp(-((vx - U[0]) / a[0]) ** 2 - ((vy - U[1]) / a[1]) ** 2 -
+                                                                ((vz - U[2]) / a[2]) ** 2) / (jnp.pi ** 1.5 * np.prod(a)))
+    with jax.enable_x64(True):
+        C = S.project_Hermite(f, alpha, u, np.arange(5) * 2 * np.pi / 5, np.zeros(1), np.zeros(1), 3, 3, 3)
+        Ck = S.grid_to_spectrum(C, (5, 1, 1))[None]
+        Fk = S.grid_to_spectrum(jax.random.normal(jax.random.key(0), (6, 5, 1, 1)), (5, 1, 1))
+        arguments = (alpha[None], u[None], jnp.array([-1.0]), jnp.array([0.5]))
+        diagnostics = S.compute_diagnostics(Ck, Fk, *arguments)
+        half = S.compute_diagnostics(S.half_spectrum(Ck), S.half_spectrum(Fk), *arguments, spectrum='half')
+    
+    np.testing.assert_allclose(diagnostics['momentum'], U[None], atol=1e-12)
+    np.testing.assert_allclose(diagnostics['kinetic_energy'], [(np.sum(U ** 2) + np.sum(a ** 2) / 2) / 2], rtol=1e-12)
+    # The half spectrum counts the kx > 0 modes twice, for their conjugates.
+    for name in ('kinetic_energy', 'EM_energy', 'momentum', 'Hermite_spectrum'):
+        np.testing.assert_allclose(half[name], diagnostics[name], rtol=1e-12, atol=1e-14)
@@ -0,0 +1,44 @@
+import os
+import json
+import numpy as np
+import jax
+import jax.numpy as jnp
+import JAX_VM_solver as S
+
+PARAMETERS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'plasma_parameters_Landau_damping_HF_1D.json')
+
+
+def test_distribution_with_the_Hermite_basis_of_every_snapshot():
+    with open(PARAMETERS) as file:
+        solver = S.VlasovMaxwellSolver(json.load(file))
+    rng = np.random.default_rng(0)
+    Nt, Ns = 7, solver.shape_Ck[0]
+    Ck = rng.normal(size=(Nt,) + solver.shape_Ck) + 1j * rng.normal(size=(Nt,) + solver.shape_Ck)
+    alpha_s = np.asarray(solver.params['alpha_s']) * (1 + 0.1 * np.arange(Nt))[:, None, None]
+    u_s = rng.normal(size=(Nt, Ns, 3))
+    x, y, z, vx, vy, vz = np.linspace(0, solver.params['Lx'], 5), [0.0], [0.0], np.linspace(-2, 2, 9), [0.0], [0.0]
+
+    f = solver.distribution(Ck, 0, x, y, z, vx, vy, vz, times=slice(1, None, 2), time_chunk=2, alpha_s=alpha_s, u_s=u_s)
+    reference = [S.evaluate_distribution(Ck[i, 0], alpha_s[i, 0], u_s[i, 0], solver.params['Lx'], solver.params['Ly'],
+                                         solver.params['Lz'], x, y, z, vx, vy, vz) for i in range(1, Nt, 2)]
+    np.testing.assert_allclose(f, np.stack(reference), rtol=1e-4, atol=1e-4 * np.abs(reference).max())
+
+    # Without them, the basis of solver.params is used for every snapshot.
+    f = solver.distribution(Ck, 0, x, y, z, vx, vy, vz, time_chunk=3)
+    reference = [S.evaluate_distribution(Ck[i, 0], solver.params['alpha_s'][0], solver.params['u_s'][0], solver.params['Lx'],
+                                         solver.params['Ly'], solver.params['Lz'], x, y, z, vx, vy, vz) for i in range(Nt)]
+    np.testing.assert_allclose(f, np.stack(reference), rtol=1e-4, atol=1e-4 * np.abs(reference).max())
+
+
+def test_distribution_reconstructs_the_projected_function():
+    # A drifting Maxwellian with a density wave, projected with initialize_system's transforms and evaluated off the grid.
+    alpha, u, L = np.array([0.5, 0.6, 0.7]), np.array([0.1, 0.0, -0.1]), (8.0, 1.0, 1.0)
+    f = lambda x, y, z, vx, vy, vz: ((1 + 0.1 * jnp.sin(2 * jnp.pi * x / L[0])) *
+                                     jnp.exp(-((vx - 0.3) / 0.5) ** 2 - ((vy + 0.1) / 0.6) ** 2 - (vz / 0.7) ** 2) / (jnp.pi ** 1.5 * 0.21))
+    with jax.enable_x64(True):
+        C = S.project_Hermite(f, alpha, u, np.arange(5) * L[0] / 5, np.zeros(1), np.zeros(1), 14, 10, 10)
+        Ck = S.grid_to_spectrum(C, (5, 1, 1))
+        x, vx, vy, vz = np.linspace(0, L[0], 7), np.linspace(-1, 1.5, 6), np.array([-0.3, 0.2]), np.array([0.0, 0.4])
+        reference = f(*np.meshgrid(x, [0.0], [0.0], vx, vy, vz, indexing='ij'))
+        np.testing.assert_allclose(S.evaluate_distribution(Ck, alpha, u, *L, x, [0.0], [0.0], vx, vy, vz), reference,
+                                   atol=1e-6 * np.abs(reference).max())
@@ -0,0 +1,33 @@
+import os
+import json
+import numpy as np
+import jax.numpy as jnp
+from jax.experimental.ode import odeint
+import JAX_VM_solver as S
+from Integrators import make_stepper, integrate, integrate_ensemble
+
+PARAMETERS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'plasma_parameters_Landau_damping_HF_1D.json')
+
+SWEEP = {'nu': [0.0, 1.0, 10.0], 'Lx': [4.0, 8.0, 16.0]}
+
+
+def test_ensemble_members_match_individual_runs():
+    with open(PARAMETERS) as file:
+        parameters = json.load(file)
+    solver = S.VlasovMaxwellSolver(parameters)
+    stepper, output = make_stepper(solver, 'rk4', 0.02), solver.snapshot_output(('EM_energy',))
+    with solver.precision_scope():
+        Ck_Fk_0 = solver.from_full_spectrum(S.initial_condition(parameters))
+        members = [dict(zip(SWEEP, values)) for values in zip(*SWEEP.values())]
+        params = solver.ensemble_params(**{name: jnp.array(values) for name, values in SWEEP.items()})
+
+        Ck_Fk, _, snapshots = integrate_ensemble(stepper, Ck_Fk_0, params, 0.02, 50, 10, output=output)
+        states = solver.solve_ensemble(Ck_Fk_0, jnp.array([0.0, 1.0]), params)
+        for i, member in enumerate(members):
+            Ck_Fk_i, _, snapshots_i = integrate(stepper, Ck_Fk_0, solver.make_params(**member), 0.02, 50, 10, output=output)
+            np.testing.assert_allclose(Ck_Fk[i], Ck_Fk_i, rtol=1e-12, atol=1e-12 * np.abs(Ck_Fk_i).max())
+            np.testing.assert_allclose(snapshots['EM_energy'][i], snapshots_i['EM_energy'], rtol=1e-12)
+
+            # The adaptive steps of each member follow its own error estimate.
+            reference = odeint(solver.rhs, Ck_Fk_0, jnp.array([0.0, 1.0]), solver.make_params(**member), rtol=1.4e-8, atol=1.4e-8)[-1]
+            np.testing.assert_allclose(states[i, -1], reference, rtol=1e-6, atol=1e-6 * np.abs(reference).max())
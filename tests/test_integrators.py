@@ -0,0 +1,149 @@
+import os
+import json
+import numpy as np
+import jax
+import jax.numpy as jnp
+import pytest
+import JAX_VM_solver as S
+from Integrators import make_stepper, integrate, implicit_midpoint_stepper
+
+PARAMETERS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'plasma_parameters_Landau_damping_HF_1D.json')
+
+
+def EM_energy_loss(solver, Ck_Fk_0, dt, t_max, integrator, gradient):
+    """
+    Sum of the EM energy at the snapshots t = 1, 2, ..., t_max, as a function of nu.
+    """
+
+    output = solver.snapshot_output(('EM_energy',))
+    n_steps, save_every = int(round(t_max / dt)), int(round(1 / dt))
+
+    def loss(nu):
+        snapshots = solver.solve_differentiable(Ck_Fk_0, dt, n_steps, save_every, params=solver.make_params(nu=nu),
+                                                integrator=integrator, output=output, gradient=gradient)[2]
+        return jnp.sum(snapshots['EM_energy'])
+
+    return loss
+
+
+@pytest.fixture(scope='module')
+def collisional_solver():
+    with open(PARAMETERS) as file:
+        parameters = dict(json.load(file))
+    with jax.enable_x64(True):
+        yield S.VlasovMaxwellSolver(parameters), S.initial_condition(parameters)
+
+
+@pytest.mark.parametrize('gradient', ['checkpoint', 'binomial'])
+def test_discrete_adjoint_at_stiff_dt(collisional_solver, gradient):
+    # dt = 1 is 3.6 times the stability limit of RK4 for nu = 10.
+    solver, Ck_Fk_0 = collisional_solver
+    with jax.enable_x64(True):
+        loss = EM_energy_loss(solver, Ck_Fk_0, 1.0, 10.0, 'implicit-midpoint', gradient)
+        finite_difference = (loss(10.0 + 1e-3) - loss(10.0 - 1e-3)) / 2e-3
+        np.testing.assert_allclose(jax.grad(loss)(10.0), finite_difference, rtol=1e-3)
+
+
+def test_continuous_adjoint_at_stiff_dt(collisional_solver):
+    solver, Ck_Fk_0 = collisional_solver
+    with jax.enable_x64(True):
+        # Resolved steps: the continuous adjoint converges to the gradient of the run.
+        loss = EM_energy_loss(solver, Ck_Fk_0, 0.05, 5.0, 'implicit-midpoint', 'continuous')
+        finite_difference = (loss(10.0 + 1e-3) - loss(10.0 - 1e-3)) / 2e-3
+        np.testing.assert_allclose(jax.grad(loss)(10.0), finite_difference, rtol=1e-2)
+        
+        # Stiff steps: the sub-stepped backward integration stays bounded (it used to diverge to ~1e23).
+        loss = EM_energy_loss(solver, Ck_Fk_0, 1.0, 10.0, 'implicit-midpoint', 'continuous')
+        finite_difference = (loss(10.0 + 1e-3) - loss(10.0 - 1e-3)) / 2e-3
+        assert np.abs(jax.grad(loss)(10.0)) < 10 * np.abs(finite_difference)
+
+
+def test_implicit_midpoint_conserves_energy():
+    # Collisionless, so the total energy is an invariant of the system; 40 steps of dt = 0.5.
+    with open(PARAMETERS) as file:
+        parameters = dict(json.load(file), nu=0.0)
+    solver = S.VlasovMaxwellSolver(parameters)
+    output = solver.snapshot_output(('kinetic_energy', 'EM_energy'))
+    total_energy = lambda diagnostics: np.sum(diagnostics['kinetic_energy'], axis=-1) + diagnostics['EM_energy']
+    with solver.precision_scope():
+        Ck_Fk_0 = solver.from_full_spectrum(S.initial_condition(parameters))
+        snapshots = integrate(make_stepper(solver, 'implicit-midpoint', 0.5), Ck_Fk_0, solver.params, 0.5, 40, 2, output=output)[2]
+        energy, energy_0 = total_energy(jax.tree.map(np.asarray, snapshots)), total_energy(jax.tree.map(np.asarray, output(Ck_Fk_0)))
+    
+    np.testing.assert_allclose(energy, energy_0, rtol=1e-10)
+
+
+def test_unconverged_implicit_step_is_nan():
+    with open(PARAMETERS) as file:
+        parameters = dict(json.load(file), implicit_options={'max_newton': 1})
+    solver = S.VlasovMaxwellSolver(parameters)
+    with solver.precision_scope():
+        Ck_Fk_0 = solver.from_full_spectrum(S.initial_condition(parameters))
+        Ck_Fk = integrate(make_stepper(solver, 'implicit-midpoint', 0.5), Ck_Fk_0, solver.params, 0.5, 4)[0]
+    
+    assert np.all(np.isnan(Ck_Fk))
+
+
+@pytest.mark.parametrize('preconditioner', ['block', None])
+def test_implicit_midpoint_solves_the_midpoint_equation(collisional_solver, preconditioner):
+    # dt = 1 is beyond the stability limit of the explicit integrators for nu = 10.
+    solver, Ck_Fk_0 = collisional_solver
+    with jax.enable_x64(True):
+        Ck_Fk_0 = solver.from_full_spectrum(Ck_Fk_0)
+        Ck_Fk = integrate(implicit_midpoint_stepper(solver, 1.0, preconditioner=preconditioner), Ck_Fk_0, solver.params, 1.0, 1)[0]
+        residual = Ck_Fk - Ck_Fk_0 - solver.rhs((Ck_Fk + Ck_Fk_0) / 2, 0.5, solver.params)
+    
+    assert np.all(np.isfinite(Ck_Fk))
+    assert np.linalg.norm(residual) < 1e-8 * np.linalg.norm(Ck_Fk_0)
+
+
+def test_implicit_midpoint_order_of_convergence(collisional_solver):
+    solver, Ck_Fk_0 = collisional_solver
+    with jax.enable_x64(True):
+        Ck_Fk_0 = solver.from_full_spectrum(Ck_Fk_0)
+        reference = solver.solve(Ck_Fk_0, jnp.array([0.0, 1.0]), rtol=1e-13, atol=1e-13)[-1]
+        errors = [np.abs(integrate(make_stepper(solver, 'implicit-midpoint', dt), Ck_Fk_0, solver.params, dt, int(round(1.0 / dt)))[0] - reference).max()
+                  for dt in (0.1, 0.05, 0.025)]
+    
+    np.testing.assert_allclose(np.log2(np.divide(errors[:-1], errors[1:])), 2, atol=0.2)
+
+
+@pytest.mark.parametrize('integrator, order', [('if-rk2', 2), ('if-rk4', 4)])
+def test_integrating_factor_order_of_convergence(collisional_solver, integrator, order):
+    # The hypercollisions (nu = 10) are integrated exactly, so the error follows the order of the explicit tableau.
+    solver, Ck_Fk_0 = collisional_solver
+    with jax.enable_x64(True):
+        Ck_Fk_0 = solver.from_full_spectrum(Ck_Fk_0)
+        reference = solver.solve(Ck_Fk_0, jnp.array([0.0, 2.0]), rtol=1e-13, atol=1e-13)[-1]
+        errors = [np.abs(integrate(make_stepper(solver, integrator, dt), Ck_Fk_0, solver.params, dt, int(round(2.0 / dt)))[0] - reference).max()
+                  for dt in (0.2, 0.1, 0.05)]
+    
+    np.testing.assert_allclose(np.log2(np.divide(errors[:-1], errors[1:])), order, atol=0.2)
+
+
+def test_adaptive_statistics_account_for_every_step(collisional_solver):
+    solver, Ck_Fk_0 = collisional_solver
+    t = jnp.linspace(0.0, 2.0, 5)
+    with jax.enable_x64(True):
+        Ck_Fk_0 = solver.from_full_spectrum(Ck_Fk_0)
+        states, stats = solver.solve_adaptive(Ck_Fk_0, t, max_steps=500)
+        reference = solver.solve(Ck_Fk_0, t)
+    
+    np.testing.assert_allclose(states, reference, rtol=1e-6, atol=1e-6 * np.abs(reference).max())
+    n_attempts = int(stats['n_accepted'] + stats['n_rejected'])
+    assert stats['n_rhs'] == 2 + 6 * n_attempts and np.sum(stats['accepted']) == stats['n_accepted']
+    assert np.all(np.isfinite(stats['dt'][:n_attempts])) and np.all(np.isnan(stats['dt'][n_attempts:]))
+    np.testing.assert_allclose(np.sum(stats['dt'][:n_attempts][stats['accepted'][:n_attempts]]), 2.0, rtol=1e-12)
+    assert np.all(stats['error'][:n_attempts][stats['accepted'][:n_attempts]] <= 1)
+
+
+def test_rhs_terms_add_up_to_the_rhs(collisional_solver):
+    solver, Ck_Fk_0 = collisional_solver
+    with jax.enable_x64(True):
+        Ck_Fk = solver.from_full_spectrum(Ck_Fk_0)
+        terms = {name: term(Ck_Fk, solver.params) for name, term in solver.rhs_terms().items()}
+        dCk_dt, dFk_dt = solver.unpack(solver.rhs(Ck_Fk, 0.0, solver.params))
+    
+    vlasov = sum(terms[name] for name in ('streaming', 'E_coupling', 'B_coupling', 'collisions'))
+    np.testing.assert_allclose(vlasov, dCk_dt, rtol=1e-12, atol=1e-12 * np.abs(dCk_dt).max())
+    np.testing.assert_allclose(terms['maxwell'], dFk_dt, rtol=1e-12, atol=1e-14)
@@ -0,0 +1,66 @@
+import os
+import json
+import numpy as np
+import jax
+import jax.numpy as jnp
+import JAX_VM_solver as S
+
+PARAMETERS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'plasma_parameters_Landau_damping_HF_1D.json')
+
+
+def test_Landau_damping_rate_without_null_modes():
+    # Electrons only, k lambda_D = 0.5: omega = 1.4156, gamma = -0.1533.
+    with open(PARAMETERS) as file:
+        parameters = dict(json.load(file), Ns=1, qs=[-1], alpha_s=[np.sqrt(2)] * 3, u_s=[0.0] * 3, Lx=4 * np.pi, Nn=60)
+    with jax.enable_x64(True):
+        solver = S.VlasovMaxwellSolver(parameters)
+        Ck_eq = jnp.zeros(solver.shape_Ck, dtype=complex).at[:, 0, 0, 0, (solver.Nx - 1) // 2, 0, 0].set(1 / np.sqrt(2) ** 3)
+        Ck_Fk_eq = solver.pack(Ck_eq, jnp.zeros(solver.shape_Fk, dtype=complex))
+        
+        # The operator has omega = gamma = 0 modes (e.g. the Gauss's law mismatch of Ex), which must not be returned.
+        assert np.abs(np.linalg.eigvals(np.asarray(solver.linear_operator(Ck_Fk_eq, (1, 0, 0))))).min() < 1e-10
+        
+        omega, gamma = solver.linear_eigenvalues(Ck_Fk_eq, (1, 0, 0), params=solver.ensemble_params(nu=jnp.array([2.0, 4.0])),
+                                                 n_eigs=1, component=0)
+        np.testing.assert_allclose(np.abs(omega[:, 0]), 1.4156, rtol=1e-2)
+        np.testing.assert_allclose(gamma[:, 0], -0.1533, rtol=2e-2)
+
+
+def test_linear_operator_is_the_jacobian_of_the_rhs():
+    # Two drifting species in 2V: the operator applied to a perturbation of the mode k = (1, 1, 0) is the Jacobian-vector
+    # product of the full right-hand side at that mode.
+    with open(PARAMETERS) as file:
+        parameters = dict(json.load(file), Ny=3, Nn=6, Nm=4, Ly=3.0, u_s=[0.1, -0.1, 0.0, 0.0, 0.01, 0.0], nu=1.0)
+    with jax.enable_x64(True):
+        solver = S.VlasovMaxwellSolver(parameters)
+        k0, k = (1, 1, 0), (2, 2, 0)
+        Ck_eq = jnp.zeros(solver.shape_Ck, dtype=complex).at[:, 0, 0, 0, k0[0], k0[1], 0].set(1 / np.prod(np.reshape(parameters['alpha_s'], (2, 3)), axis=1))
+        Fk_eq = jnp.zeros(solver.shape_Fk, dtype=complex).at[3, k0[0], k0[1], 0].set(parameters['Omega_ce'])
+        Ck_Fk_eq = solver.pack(Ck_eq, Fk_eq)
+        
+        operator = solver.linear_operator(Ck_Fk_eq, (1, 1, 0))
+        real, imag = jax.random.normal(jax.random.key(0), (2, operator.shape[0]))
+        delta = real + 1j * imag
+        Ck, Fk = jnp.zeros(solver.shape_Ck[:-3] + (1,), dtype=complex), jnp.zeros((6, 1), dtype=complex)
+        Ck, Fk = Ck.at[..., 0].set(delta[:-6].reshape(solver.shape_Ck[:-3])), Fk.at[:, 0].set(delta[-6:])
+        tangent = solver.pack(jnp.zeros(solver.shape_Ck, dtype=complex).at[..., k[0], k[1], 0].set(Ck[..., 0]),
+                              jnp.zeros(solver.shape_Fk, dtype=complex).at[:, k[0], k[1], 0].set(Fk[:, 0]))
+        dCk_dt, dFk_dt = solver.unpack(jax.jvp(lambda Ck_Fk: solver.rhs(Ck_Fk, 0.0, solver.params), (Ck_Fk_eq,), (tangent,))[1])
+        
+        reference = jnp.concatenate([dCk_dt[..., k[0], k[1], 0].flatten(), dFk_dt[:, k[0], k[1], 0]])
+        np.testing.assert_allclose(operator @ delta, reference, rtol=1e-12, atol=1e-12 * np.abs(reference).max())
+
+
+def test_arnoldi_matches_the_dense_eigenvalues():
+    with open(PARAMETERS) as file:
+        parameters = dict(json.load(file), Ns=1, qs=[-1], alpha_s=[np.sqrt(2)] * 3, u_s=[0.0] * 3, Lx=4 * np.pi, Nn=60, nu=2.0)
+    with jax.enable_x64(True):
+        solver = S.VlasovMaxwellSolver(parameters)
+        Ck_eq = jnp.zeros(solver.shape_Ck, dtype=complex).at[:, 0, 0, 0, (solver.Nx - 1) // 2, 0, 0].set(1 / np.sqrt(2) ** 3)
+        Ck_Fk_eq = solver.pack(Ck_eq, jnp.zeros(solver.shape_Fk, dtype=complex))
+        
+        omega, gamma = solver.linear_eigenvalues(Ck_Fk_eq, (1, 0, 0), component=0)
+        # Shift-invert about a guess of the Landau mode (the +-omega pair is degenerate in gamma).
+        omega_arnoldi, gamma_arnoldi = solver.linear_eigenvalues(Ck_Fk_eq, (1, 0, 0), method='arnoldi', component=0, sigma=-0.1 - 1.3j)
+        np.testing.assert_allclose(np.abs(omega_arnoldi), np.abs(omega), rtol=1e-8)
+        np.testing.assert_allclose(gamma_arnoldi, gamma, rtol=1e-8)
@@ -0,0 +1,47 @@
+import os
+import json
+import numpy as np
+import JAX_VM_solver as S
+from Integrators import make_stepper, integrate, integrate_chunked
+from Output import NpyWriter, open_snapshots, load_checkpoint
+
+PARAMETERS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'plasma_parameters_Landau_damping_HF_1D.json')
+
+
+def test_chunked_snapshots_match_integrate(tmp_path):
+    # 12 snapshots in chunks of 5, so the last chunk is partial.
+    with open(PARAMETERS) as file:
+        parameters = json.load(file)
+    solver = S.VlasovMaxwellSolver(parameters)
+    stepper, output = make_stepper(solver, 'rk4', 0.05), solver.snapshot_output(('Fk', 'EM_energy'))
+    with solver.precision_scope():
+        Ck_Fk_0 = solver.from_full_spectrum(S.initial_condition(parameters))
+        Ck_Fk, t, snapshots = integrate(stepper, Ck_Fk_0, solver.params, 0.05, 24, 2, output=output)
+        with NpyWriter(str(tmp_path), 13) as writer:
+            Ck_Fk_chunked = integrate_chunked(stepper, Ck_Fk_0, solver.params, 0.05, 24, writer, 2, chunk_size=5, output=output)
+        first = output(Ck_Fk_0, solver.params)
+
+    saved = open_snapshots('npy', str(tmp_path))
+    np.testing.assert_allclose(saved['t'], np.linspace(0, 1.2, 13), rtol=1e-12)
+    for name in ('Fk', 'EM_energy'):
+        reference = np.concatenate([np.asarray(first[name])[None], snapshots[name]])
+        np.testing.assert_allclose(saved[name], reference, rtol=1e-12, atol=1e-14 * np.abs(reference).max())
+    np.testing.assert_allclose(Ck_Fk_chunked, Ck_Fk, rtol=1e-12, atol=1e-14 * np.abs(Ck_Fk).max())
+
+
+def test_restart_is_bit_identical(tmp_path):
+    # A run to t = 0.6 extended to t = 1 by restart(), against one run to t = 1, with the same chunk layout.
+    with open(PARAMETERS) as file:
+        parameters = dict(json.load(file), integrator='rk4', dt=0.05, t_max=1.0, t_steps=11)
+    Ck_Fk_0 = S.initial_condition(parameters)
+    Ck_Fk = S.run(parameters, Ck_Fk_0, str(tmp_path / 'full'), chunk_size=3, diagnostics=('EM_energy',))
+    S.run(dict(parameters, t_max=0.6, t_steps=7), Ck_Fk_0, str(tmp_path / 'restarted'), chunk_size=3, diagnostics=('EM_energy',))
+    assert load_checkpoint(str(tmp_path / 'restarted' / 'checkpoint.npz'))['index'] == 6
+    Ck_Fk_restarted = S.restart(str(tmp_path / 'restarted'), t_max=1.0)
+
+    np.testing.assert_array_equal(Ck_Fk_restarted, Ck_Fk)
+    for directory in ('', 'diagnostics'):
+        full, restarted = (open_snapshots('npy', str(tmp_path / run / directory)) for run in ('full', 'restarted'))
+        assert full.keys() == restarted.keys()
+        for name in full:
+            np.testing.assert_array_equal(restarted[name], full[name])
@@ -0,0 +1,90 @@
+import numpy as np
+import jax
+import jax.numpy as jnp
+import pytest
+from math import factorial
+import JAX_VM_solver as S
+
+
+def drifting_Maxwellian(x, y, z, vx, vy, vz):
+    # Not separable in x and v: the drift varies along x.
+    return (1 + 0.1 * jnp.sin(x)) * jnp.exp(-((vx - 0.2 * jnp.cos(x)) ** 2 + (vy - 0.1) ** 2 + vz ** 2) / 0.5) / (0.5 * jnp.pi) ** 1.5
+
+
+@pytest.mark.parametrize('memory_budget', [10 ** 7, 10 ** 5, 1])
+def test_memory_budget_does_not_change_the_projection(memory_budget):
+    # With 40 nodes per axis a point takes about 1 MB: 10**7 bytes gives blocks of points, 10**5 blocks of 3 vx nodes
+    # and 1 one node at a time.
+    alpha, u = jnp.array([0.5, 0.5, 0.5]), jnp.array([0.0, 0.1, 0.0])
+    x, y, z = jnp.linspace(0, 2 * jnp.pi, 6, endpoint=False), jnp.zeros(1), jnp.zeros(1)
+    with jax.enable_x64(True):
+        reference = S.project_Hermite(drifting_Maxwellian, alpha, u, x, y, z, 6, 4, 3)
+        C = S.project_Hermite(drifting_Maxwellian, alpha, u, x, y, z, 6, 4, 3, memory_budget=memory_budget)
+        np.testing.assert_allclose(C, reference, rtol=1e-12, atol=1e-12 * jnp.abs(reference).max())
+
+
+def test_projection_of_a_drifting_Maxwellian():
+    # For a Maxwellian of thermal speeds alpha drifting by delta from u, C_nmp = prod_i (sqrt(2) d_i)^n_i / sqrt(n_i!) / alpha_i
+    # with d = delta / alpha, times the density.
+    alpha, u, delta = np.array([0.5, 0.6, 0.7]), np.array([0.1, 0.0, -0.2]), np.array([0.2, -0.15, 0.1])
+    density = lambda x, y, z: 1 + 0.1 * jnp.sin(x)
+    Maxwellian = lambda i: lambda v: jnp.exp(-((v - u[i] - delta[i]) / alpha[i]) ** 2) / (jnp.sqrt(jnp.pi) * alpha[i])
+    x, y, z = np.linspace(0, 2 * np.pi, 6, endpoint=False), np.zeros(1), np.zeros(1)
+    with jax.enable_x64(True):
+        factors = [np.array([(np.sqrt(2) * delta[i] / alpha[i]) ** n / np.sqrt(factorial(n)) / alpha[i] for n in range(N)])
+                   for i, N in enumerate((8, 5, 4))]
+        reference = np.einsum('k,j,i,x->kjix', factors[2], factors[1], factors[0], density(x, 0, 0))[..., None, None]
+        
+        separable = S.project_Hermite((density, Maxwellian(0), Maxwellian(1), Maxwellian(2)), alpha, u, x, y, z, 8, 5, 4)
+        f = lambda x, y, z, vx, vy, vz: density(x, y, z) * Maxwellian(0)(vx) * Maxwellian(1)(vy) * Maxwellian(2)(vz)
+        for C in (separable, S.project_Hermite(f, alpha, u, x, y, z, 8, 5, 4, n_quad=20)):
+            np.testing.assert_allclose(C, reference, rtol=1e-12, atol=1e-14 * np.abs(reference).max())
+
+
+def test_memory_budget_does_not_change_the_initial_condition():
+    # 16 points in x, taken 2 at a time (about 1 MB each).
+    with jax.enable_x64(True):
+        arguments = (1.0, 100.0, jnp.array([0.5] * 3 + [0.05] * 3), jnp.zeros(6), 8.0, 1.0, 1.0, 16, 1, 1, 6, 2, 2)
+        Ck_0, Fk_0 = S.initialize_system(*arguments)
+        Ck_0_blocked, Fk_0_blocked = S.initialize_system(*arguments, memory_budget=3 * 10 ** 6)
+        np.testing.assert_allclose(Ck_0_blocked, Ck_0, rtol=1e-12, atol=1e-12 * jnp.abs(Ck_0).max())
+        np.testing.assert_array_equal(Fk_0_blocked, Fk_0)
+
+
+@pytest.mark.parametrize('truncation', ['tensor', 'total_degree'])
+def test_rescaling_matches_the_projection_onto_the_new_basis(truncation):
+    # A non-Maxwellian f (a drifting Maxwellian plus a beam) projected onto two bases: the re-projected coefficients
+    # equal the projection onto the new basis (the rescaling matrices are lower triangular, so nothing is truncated).
+    alpha, u = np.array([[0.5, 0.6, 0.7]]), np.array([[0.1, 0.0, -0.1]])
+    alpha_new, u_new = np.array([[0.55, 0.5, 0.8]]), np.array([[0.2, -0.05, 0.0]])
+    Maxwellian = lambda a, U: lambda v: jnp.exp(-((v - U) / a) ** 2) / (jnp.sqrt(jnp.pi) * a)
+    f = [(lambda x, y, z: 1 + 0.1 * jnp.sin(x), Maxwellian(0.5, 0.2), Maxwellian(0.6, 0.0), Maxwellian(0.7, -0.1)),
+         (lambda x, y, z: 0.1 * jnp.ones_like(x), Maxwellian(0.3, 0.6), Maxwellian(0.6, 0.1), Maxwellian(0.7, 0.0))]
+    x, y, z = np.linspace(0, 2 * np.pi, 4, endpoint=False), np.zeros(1), np.zeros(1)
+    index_set = None if truncation == 'tensor' else S.Hermite_index_set(8, 5, 4, truncation)
+    with jax.enable_x64(True):
+        C, C_new = [S.project_Hermite(f, a[0], w[0], x, y, z, 8, 5, 4, n_quad=60)[None] for a, w in ((alpha, u), (alpha_new, u_new))]
+        if index_set is not None:
+            C, C_new = S.restrict_Hermite(C, index_set), S.restrict_Hermite(C_new, index_set)
+        C_rescaled = S.rescale_Hermite(C, jnp.asarray(alpha), jnp.asarray(u), jnp.asarray(alpha_new), jnp.asarray(u_new), index_set)
+        np.testing.assert_allclose(C_rescaled, C_new, rtol=1e-10, atol=1e-12 * np.abs(C_new).max())
+
+
+def test_rescaled_basis_matches_the_plasma():
+    # After rescale_basis the mean velocity and temperature are those of the basis: the space-averaged first- and
+    # second-order coefficients vanish.
+    parameters = {'Nx': 3, 'Ny': 1, 'Nz': 1, 'Nn': 10, 'Nm': 6, 'Np': 1, 'Ns': 1, 'Lx': 2 * np.pi, 'Ly': 1.0, 'Lz': 1.0, 'nu': 0.0,
+                  'Omega_ce': 1.0, 'mi_me': 100.0, 'qs': [-1], 'alpha_s': [0.5, 0.5, 0.5], 'u_s': [0.0] * 3}
+    f = (lambda x, y, z: 1 + 0.1 * jnp.sin(x), lambda v: jnp.exp(-((v - 0.15) / 0.55) ** 2) / (jnp.sqrt(jnp.pi) * 0.55),
+         lambda v: jnp.exp(-((v + 0.05) / 0.45) ** 2) / (jnp.sqrt(jnp.pi) * 0.45), lambda v: jnp.exp(-(v / 0.5) ** 2) / (jnp.sqrt(jnp.pi) * 0.5))
+    with jax.enable_x64(True):
+        solver = S.VlasovMaxwellSolver(parameters)
+        C = S.project_Hermite(f, np.full(3, 0.5), np.zeros(3), np.arange(3) * 2 * np.pi / 3, np.zeros(1), np.zeros(1), 10, 6, 1)
+        Ck_Fk = solver.pack(S.grid_to_spectrum(C, (3, 1, 1))[None], jnp.zeros(solver.shape_Fk, dtype=complex))
+        Ck_Fk, params = solver.rescale(Ck_Fk, solver.params)
+        C0, C1, C2 = S.Hermite_moments(solver.unpack(Ck_Fk)[0][..., 1, 0, 0].real)
+    
+    np.testing.assert_allclose(params['alpha_s'][0, :2], [0.55, 0.45], rtol=1e-3)
+    np.testing.assert_allclose(params['u_s'][0, :2], [0.15, -0.05], atol=1e-3)
+    np.testing.assert_allclose(C1[0, :2], 0, atol=1e-10 * C0[0])
+    np.testing.assert_allclose(C2[0, :2], 0, atol=1e-10 * C0[0])
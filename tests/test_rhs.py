@@ -0,0 +1,131 @@
+import numpy as np
+import jax
+import jax.numpy as jnp
+import pytest
+import JAX_VM_solver as S
+
+
+def random_spectrum(key, shape):
+    real, imag = jax.random.normal(key, (2,) + shape)
+    return real + 1j * imag
+
+
+@pytest.mark.parametrize('convolution', ['direct', 'pseudospectral'])
+def test_tensor_rhs_matches_ode_system(convolution):
+    # Anisotropic and drifting species in 3V, so that every Hermite ladder term is exercised.
+    Nx, Ny, Nz, Nn, Nm, Np, Ns = 4, 3, 2, 5, 4, 3, 2
+    with jax.enable_x64(True):
+        Ck_Fk = random_spectrum(jax.random.key(0), (Ns * Nn * Nm * Np * Nx * Ny * Nz + 6 * Nx * Ny * Nz,))
+        qs, nu, Omega_cs = jnp.array([-1.0, 1.0]), 2.0, jnp.array([1.0, 0.01])
+        alpha_s = jnp.array([0.5, 0.7, 0.9, 0.05, 0.06, 0.07])
+        u_s = jnp.array([0.1, -0.2, 0.3, 0.01, 0.02, -0.03])
+        arguments = (Ck_Fk, 0.0, qs, nu, Omega_cs, alpha_s, u_s, 8.0, 3.0, 2.0, Nx, Ny, Nz, Nn, Nm, Np, Ns, convolution)
+
+        reference = S.ode_system(*arguments)
+        np.testing.assert_allclose(S.ode_system_tensor(*arguments), reference, rtol=1e-12, atol=1e-12 * np.abs(reference).max())
+
+
+def Hermitian_state(key, solver):
+    # Coefficients of real fields, C(-k) = conj(C(k)), holding all Fourier modes.
+    N = (solver.Nx, solver.Ny, solver.Nz)
+    size_Ck = solver.Ns * solver.Np * solver.Nm * solver.Nn
+    C = jax.random.normal(key, (size_Ck + 6,) + N)
+    return S.grid_to_spectrum(C, N).flatten()
+
+
+@pytest.mark.parametrize('convolution', ['direct', 'pseudospectral'])
+def test_half_spectrum_rhs_matches_full_rhs(convolution):
+    parameters = {'Nx': 5, 'Ny': 3, 'Nz': 1, 'Nn': 4, 'Nm': 3, 'Np': 1, 'Ns': 2, 'Lx': 8.0, 'Ly': 3.0, 'Lz': 1.0, 'nu': 2.0,
+                  'Omega_ce': 1.0, 'mi_me': 100.0, 'qs': [-1, 1], 'alpha_s': [0.5, 0.7, 0.5, 0.05, 0.06, 0.05],
+                  'u_s': [0.1, -0.2, 0.0, 0.01, 0.0, 0.0], 'convolution': convolution}
+    with jax.enable_x64(True):
+        full, half = [S.VlasovMaxwellSolver(dict(parameters, spectrum=spectrum)) for spectrum in ('full', 'half')]
+        Ck_Fk = Hermitian_state(jax.random.key(0), full)
+        Ck_Fk_half = half.from_full_spectrum(Ck_Fk)
+        # 3 of the 5 kx modes are stored.
+        assert Ck_Fk_half.size == Ck_Fk.size // 5 * 3
+        np.testing.assert_allclose(half.to_full_spectrum(Ck_Fk_half), Ck_Fk, atol=1e-15)
+
+        reference = full.rhs(Ck_Fk, 0.0, full.params)
+        np.testing.assert_allclose(half.to_full_spectrum(half.rhs(Ck_Fk_half, 0.0, half.params)), reference,
+                                   rtol=1e-12, atol=1e-12 * np.abs(reference).max())
+
+
+@pytest.mark.parametrize('truncation', [{'Hermite_truncation': 'total_degree'}, {'Hermite_truncation': 'hyperbolic_cross', 'Hermite_degree': 5},
+                                        {'Hermite_indices': [[0, 0, 0], [1, 0, 0], [2, 0, 0], [0, 1, 0], [1, 1, 0], [0, 0, 1]]}])
+def test_reduced_Hermite_rhs_matches_dense_rhs(truncation):
+    # On a state that vanishes outside the index set, the reduced RHS is the dense RHS restricted to the set.
+    parameters = {'Nx': 3, 'Ny': 3, 'Nz': 1, 'Nn': 4, 'Nm': 4, 'Np': 3, 'Ns': 2, 'Lx': 8.0, 'Ly': 3.0, 'Lz': 1.0, 'nu': 2.0,
+                  'Omega_ce': 1.0, 'mi_me': 100.0, 'qs': [-1, 1], 'alpha_s': [0.5, 0.7, 0.6, 0.05, 0.06, 0.05],
+                  'u_s': [0.1, -0.2, 0.05, 0.01, 0.0, 0.0]}
+    with jax.enable_x64(True):
+        dense, reduced = S.VlasovMaxwellSolver(parameters), S.VlasovMaxwellSolver(dict(parameters, **truncation))
+        Ck_Fk = reduced.to_full_spectrum(reduced.from_full_spectrum(random_spectrum(jax.random.key(0), (dense.size_Ck + 6 * 9,))))
+        Ck_Fk_reduced = reduced.from_full_spectrum(Ck_Fk)
+        assert Ck_Fk_reduced.size < Ck_Fk.size
+        
+        reference = reduced.from_full_spectrum(dense.rhs(Ck_Fk, 0.0, dense.params))
+        np.testing.assert_allclose(reduced.rhs(Ck_Fk_reduced, 0.0, reduced.params), reference, rtol=1e-12, atol=1e-12 * np.abs(reference).max())
+        
+        names = ('kinetic_energy', 'EM_energy', 'momentum')
+        diagnostics = reduced.snapshot_output(names)(Ck_Fk_reduced, reduced.params)
+        for name, value in dense.snapshot_output(names)(Ck_Fk, dense.params).items():
+            np.testing.assert_allclose(diagnostics[name], value, rtol=1e-12)
+
+
+def test_sparse_Fourier_rhs_matches_dense_rhs():
+    # On a state that vanishes outside the mode set, the sparse RHS is the dense RHS restricted to the set.
+    parameters = {'Nx': 5, 'Ny': 3, 'Nz': 1, 'Nn': 4, 'Nm': 3, 'Np': 1, 'Ns': 2, 'Lx': 8.0, 'Ly': 3.0, 'Lz': 1.0, 'nu': 2.0,
+                  'Omega_ce': 1.0, 'mi_me': 100.0, 'qs': [-1, 1], 'alpha_s': [0.5, 0.7, 0.5, 0.05, 0.06, 0.05],
+                  'u_s': [0.1, -0.2, 0.0, 0.01, 0.0, 0.0]}
+    with jax.enable_x64(True):
+        dense = S.VlasovMaxwellSolver(parameters)
+        sparse = S.VlasovMaxwellSolver(dict(parameters, Fourier_modes=[[1, 0, 0], [2, 0, 0], [1, 1, 0]]))
+        assert sparse.mode_set == ((-2, 0, 0), (-1, -1, 0), (-1, 0, 0), (0, 0, 0), (1, 0, 0), (1, 1, 0), (2, 0, 0))
+        Ck_Fk = sparse.to_full_spectrum(sparse.from_full_spectrum(Hermitian_state(jax.random.key(0), dense)))
+        
+        reference = sparse.from_full_spectrum(dense.rhs(Ck_Fk, 0.0, dense.params))
+        np.testing.assert_allclose(sparse.rhs(sparse.from_full_spectrum(Ck_Fk), 0.0, sparse.params), reference,
+                                   rtol=1e-12, atol=1e-12 * np.abs(reference).max())
+
+
+def test_Fourier_modes_above_the_threshold_are_activated():
+    parameters = {'Nx': 5, 'Ny': 1, 'Nz': 1, 'Nn': 4, 'Nm': 1, 'Np': 1, 'Ns': 2, 'Lx': 8.0, 'Ly': 1.0, 'Lz': 1.0, 'nu': 2.0,
+                  'Omega_ce': 1.0, 'mi_me': 100.0, 'qs': [-1, 1], 'alpha_s': [0.5] * 3 + [0.05] * 3, 'u_s': [0.0] * 6,
+                  'Fourier_modes': [[1, 0, 0]], 'Fourier_activation_threshold': 1e-3}
+    with jax.enable_x64(True):
+        solver = S.VlasovMaxwellSolver(parameters)
+        assert solver.mode_set == ((-2, 0, 0), (-1, 0, 0), (0, 0, 0), (1, 0, 0), (2, 0, 0))
+        Ck, Fk = solver.unpack(solver.from_full_spectrum(Hermitian_state(jax.random.key(0), solver)))
+        
+        # Below the threshold on the fringe (kx = +-2) nothing changes; above it the fringe becomes active.
+        quiet = solver.pack(Ck.at[..., 0, :, :].set(1e-4).at[..., 4, :, :].set(1e-4), Fk.at[:, (0, 4)].set(0.0))
+        assert solver.activate_Fourier_modes(quiet)[0] is solver
+        activated, Ck_Fk = solver.activate_Fourier_modes(solver.pack(Ck, Fk))
+        assert activated.active_modes == solver.mode_set
+        np.testing.assert_array_equal(activated.to_full_spectrum(Ck_Fk), solver.to_full_spectrum(solver.pack(Ck, Fk)))
+
+
+def test_a_species_split_in_two_gives_the_same_fields():
+    # The ions as two identical species of half the density: the same current, and half the ion RHS in each.
+    parameters = {'Nx': 5, 'Ny': 1, 'Nz': 1, 'Nn': 6, 'Nm': 2, 'Np': 1, 'Ns': 2, 'Lx': 8.0, 'Ly': 1.0, 'Lz': 1.0, 'nu': 2.0,
+                  'Omega_ce': 1.0, 'mi_me': 100.0, 'qs': [-1, 1], 'alpha_s': [0.5, 0.6, 0.5, 0.05, 0.06, 0.05],
+                  'u_s': [0.1, 0.0, 0.0, 0.01, -0.02, 0.0]}
+    three = dict(parameters, Ns=3, qs=[-1, 1, 1], alpha_s=parameters['alpha_s'] + parameters['alpha_s'][3:],
+                 u_s=parameters['u_s'] + parameters['u_s'][3:])
+    with jax.enable_x64(True):
+        two, three = S.VlasovMaxwellSolver(parameters), S.VlasovMaxwellSolver(three)
+        Ck, Fk = two.unpack(Hermitian_state(jax.random.key(0), two))
+        split = three.pack(jnp.concatenate([Ck[:1], Ck[1:] / 2, Ck[1:] / 2]), Fk)
+        
+        dCk_dt, dFk_dt = two.unpack(two.rhs(two.pack(Ck, Fk), 0.0, two.params))
+        dCk_dt_split, dFk_dt_split = three.unpack(three.rhs(split, 0.0, three.params))
+        np.testing.assert_allclose(dFk_dt_split, dFk_dt, rtol=1e-12, atol=1e-12 * np.abs(dFk_dt).max())
+        np.testing.assert_allclose(dCk_dt_split, jnp.concatenate([dCk_dt[:1], dCk_dt[1:] / 2, dCk_dt[1:] / 2]),
+                                   rtol=1e-12, atol=1e-12 * np.abs(dCk_dt).max())
+        
+        names = ('kinetic_energy', 'EM_energy', 'momentum')
+        diagnostics, diagnostics_split = two.snapshot_output(names)(two.pack(Ck, Fk)), three.snapshot_output(names)(split)
+        np.testing.assert_allclose(diagnostics_split['kinetic_energy'][1:].sum(), diagnostics['kinetic_energy'][1], rtol=1e-12)
+        np.testing.assert_allclose(diagnostics_split['momentum'][1:].sum(axis=0), diagnostics['momentum'][1], rtol=1e-12, atol=1e-15)
+        np.testing.assert_allclose(diagnostics_split['EM_energy'], diagnostics['EM_energy'], rtol=1e-12)
@@ -0,0 +1,77 @@
+import os
+import sys
+import subprocess
+import json
+import numpy as np
+import jax.numpy as jnp
+import pytest
+import JAX_VM_solver as S
+
+PARAMETERS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'plasma_parameters_Landau_damping_HF_1D.json')
+
+
+def test_default_run_is_chunked(tmp_path):
+    # Without an integrator, main() streams odeint through run(): several chunks and a checkpoint.
+    with open(PARAMETERS) as file:
+        parameters = dict(json.load(file), t_max=2.0, t_steps=21)
+    config = tmp_path / 'parameters.json'
+    config.write_text(json.dumps(parameters))
+    S.main([str(config), str(tmp_path / 'run'), '--chunk-size', '8', '--no-compilation-cache'])
+
+    solver = S.VlasovMaxwellSolver(parameters)
+    with solver.precision_scope():
+        reference = solver.solve(solver.from_full_spectrum(S.initial_condition(parameters)), jnp.linspace(0, 2.0, 21))
+        reference = np.asarray(jnp.stack([solver.snapshot_output(('Fk',))(Ck_Fk, solver.params)['Fk'] for Ck_Fk in reference]))
+
+    assert os.path.exists(tmp_path / 'run' / 'checkpoint.npz')
+    assert np.load(tmp_path / 'run' / 'Fk.npy').dtype == np.complex128
+    np.testing.assert_allclose(np.load(tmp_path / 'run' / 't.npy'), np.linspace(0, 2.0, 21), rtol=1e-6)
+    np.testing.assert_allclose(np.load(tmp_path / 'run' / 'Fk.npy'), reference, atol=1e-8 * np.abs(reference).max())
+
+
+@pytest.mark.parametrize('precision, dtype', [('double', np.complex128), ('mixed', np.complex64), ('single', np.complex64)])
+def test_initial_condition_follows_the_precision(precision, dtype):
+    # Outside of any precision scope, i.e. with 64-bit types disabled.
+    with open(PARAMETERS) as file:
+        parameters = dict(json.load(file), precision=precision)
+    for name in ('Landau_damping_HF_1D', 'Landau_damping_1D'):
+        assert S.initial_condition(dict(parameters, initial_condition=name)).dtype == dtype
+
+
+def test_adaptive_step_statistics_are_saved(tmp_path):
+    with open(PARAMETERS) as file:
+        parameters = dict(json.load(file), t_max=2.0, t_steps=5)
+    config = tmp_path / 'parameters.json'
+    config.write_text(json.dumps(parameters))
+    S.main([str(config), str(tmp_path / 'run'), '--no-compilation-cache', '--diagnostics', 'EM_energy', 'n_accepted', 'n_rhs', 'min_dt'])
+    
+    diagnostics = {name: np.load(tmp_path / 'run' / 'diagnostics' / (name + '.npy')) for name in ('EM_energy', 'n_accepted', 'n_rhs', 'min_dt')}
+    assert all(len(values) == 5 for values in diagnostics.values())
+    # Index 0 is the initial state, before any step.
+    assert np.all(diagnostics['n_accepted'][1:] >= 1) and np.all(diagnostics['n_rhs'][1:] >= 6 * diagnostics['n_accepted'][1:])
+    assert np.all((diagnostics['min_dt'][1:] > 0) & (diagnostics['min_dt'][1:] <= 0.5 + 1e-12))
+    
+    with pytest.raises(ValueError, match='odeint'):
+        S.run(dict(parameters, integrator='rk4', dt=0.01), S.initial_condition(parameters), str(tmp_path / 'rk4'), diagnostics=('n_rhs',))
+
+
+def test_command_line_restart_extends_the_run(tmp_path):
+    with open(PARAMETERS) as file:
+        parameters = dict(json.load(file), integrator='rk4', dt=0.05, t_max=1.0, t_steps=6)
+    config = tmp_path / 'parameters.json'
+    config.write_text(json.dumps(parameters))
+    S.main([str(config), str(tmp_path / 'run'), '--variables', 'Fk', '--diagnostics', 'EM_energy', '--chunk-size', '2',
+            '--no-compilation-cache'])
+    assert json.loads((tmp_path / 'run' / 'parameters.json').read_text()) == parameters
+    S.main([str(tmp_path / 'run'), '--restart', '--t-max', '2.0', '--no-compilation-cache'])
+    
+    np.testing.assert_allclose(np.load(tmp_path / 'run' / 't.npy'), np.linspace(0, 2.0, 11), rtol=1e-12)
+    assert np.load(tmp_path / 'run' / 'Fk.npy').shape[0] == 11 and not os.path.exists(tmp_path / 'run' / 'Ck.npy')
+    assert len(np.load(tmp_path / 'run' / 'diagnostics' / 'EM_energy.npy')) == 41
+    assert np.all(np.isfinite(np.load(tmp_path / 'run' / 'Fk.npy')))
+
+
+def test_the_runner_does_not_import_plotting():
+    code = 'import sys, JAX_VM_solver; sys.exit(any(name in sys.modules for name in ("matplotlib", "Plotting")))'
+    environment = dict(os.environ, PYTHONPATH=os.path.dirname(PARAMETERS))
+    assert subprocess.run([sys.executable, '-c', code], env=environment).returncode == 0
@@ -0,0 +1,35 @@
+import os
+import sys
+import subprocess
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PARAMETERS = os.path.join(ROOT, 'plasma_parameters_Landau_damping_HF_1D.json')
+
+# The host devices are fixed when JAX starts, so the sharded solver runs in its own process.
+SCRIPT = """
+import sys, json
+import numpy as np
+import jax
+import JAX_VM_solver as S
+
+with open(sys.argv[1]) as file:
+    parameters = dict(json.load(file), Nx=4, Nn=8, convolution=sys.argv[2])
+assert len(jax.devices()) == 4
+with jax.enable_x64(True):
+    reference = S.VlasovMaxwellSolver(parameters)
+    real, imag = jax.random.normal(jax.random.key(0), (2, reference.size_Ck + 6 * reference.Nx))
+    Ck_Fk = real + 1j * imag
+    dCk_Fk_dt = np.asarray(reference.rhs(Ck_Fk, 0.0, reference.params))
+    for axis in ('n', 'x'):
+        solver = S.VlasovMaxwellSolver(dict(parameters, sharding=axis))
+        np.testing.assert_allclose(solver.rhs(Ck_Fk, 0.0, solver.params), dCk_Fk_dt, rtol=1e-12, atol=1e-12 * np.abs(dCk_Fk_dt).max())
+"""
+
+
+@pytest.mark.parametrize('convolution', ['direct', 'pseudospectral'])
+def test_sharded_rhs_matches_single_device(convolution):
+    # Split along a Hermite axis and along x (which the pseudospectral FFTs transpose away) over 4 CPU devices.
+    environment = dict(os.environ, XLA_FLAGS='--xla_force_host_platform_device_count=4', PYTHONPATH=ROOT)
+    result = subprocess.run([sys.executable, '-c', SCRIPT, PARAMETERS, convolution], env=environment, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
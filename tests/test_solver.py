@@ -0,0 +1,57 @@
+import os
+import json
+import numpy as np
+import jax
+import pytest
+import JAX_VM_solver as S
+from Integrators import make_stepper, integrate
+
+PARAMETERS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'plasma_parameters_Landau_damping_HF_1D.json')
+
+
+def test_compilation_cache_is_opt_in(tmp_path):
+    with open(PARAMETERS) as file:
+        parameters = json.load(file)
+    cache_dir = jax.config.jax_compilation_cache_dir
+    S.VlasovMaxwellSolver(parameters)
+    assert jax.config.jax_compilation_cache_dir == cache_dir
+    
+    try:
+        S.VlasovMaxwellSolver(dict(parameters, compilation_cache_dir=str(tmp_path / 'cache')))
+        assert jax.config.jax_compilation_cache_dir == str(tmp_path / 'cache')
+    finally:
+        jax.config.update('jax_compilation_cache_dir', cache_dir)
+
+
+def test_new_parameter_values_reuse_the_compiled_rhs():
+    with open(PARAMETERS) as file:
+        parameters = json.load(file)
+    solver = S.VlasovMaxwellSolver(parameters)
+    with solver.precision_scope():
+        Ck_Fk = solver.from_full_spectrum(S.initial_condition(parameters))
+        solver.rhs(Ck_Fk, 0.0, solver.params)
+        solver.rhs(Ck_Fk, 0.0, solver.make_params(nu=1.0, Lx=4.0, alpha_s=[0.4] * 6))
+    
+    assert solver.rhs._cache_size() == 1
+
+
+@pytest.mark.parametrize('precision, diagnostics_dtype', [('single', np.float32), ('mixed', np.float64)])
+def test_reduced_precision_runs_track_double_precision(precision, diagnostics_dtype):
+    with open(PARAMETERS) as file:
+        parameters = json.load(file)
+    output = ('Fk', 'EM_energy')
+    runs = {}
+    for name in ('double', precision):
+        solver = S.VlasovMaxwellSolver(dict(parameters, precision=name))
+        with solver.precision_scope():
+            Ck_Fk_0 = solver.from_full_spectrum(S.initial_condition(dict(parameters, precision=name)))
+            Ck_Fk, _, snapshots = integrate(make_stepper(solver, 'rk4', 0.05), Ck_Fk_0, solver.params, 0.05, 40, 10,
+                                            output=solver.snapshot_output(output))
+            runs[name] = Ck_Fk, jax.tree.map(np.asarray, snapshots)
+    # The global setting is left as it was.
+    assert not jax.config.jax_enable_x64
+    
+    (Ck_Fk, snapshots), (reference, reference_snapshots) = runs[precision], runs['double']
+    assert Ck_Fk.dtype == np.complex64 and snapshots['EM_energy'].dtype == diagnostics_dtype
+    np.testing.assert_allclose(Ck_Fk, reference, rtol=1e-4, atol=1e-5 * np.abs(reference).max())
+    np.testing.assert_allclose(snapshots['EM_energy'], reference_snapshots['EM_energy'], rtol=1e-5)